@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+CLI Import Time Benchmark:
+--------------------------
+Measure the module import time of the symphony CLI with python
+-X importtime, for the commands that should stay light:
+
+    help:   symphony build -h
+    list:   symphony list, on an empty staging directory
+    helper: import symphony.helper
+
+and report the slowest imports of each. HEAVY_MODULES are only needed
+by some operations, and must not be imported by any of these.
+
+Usage (from the repository root):
+    PYTHONPATH=. python benchmarks/import_bench.py --repeat 5
+'''
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ["yaml", "jinja2", "prettytable", "paramiko", "asyncio",
+                 "concurrent.futures"]
+
+def get_commands(staging_dir):
+    return {
+        'help': ["-m", "symphony.symphony", "build", "-h"],
+        'list': ["-m", "symphony.symphony", "list", "--staging",
+                 staging_dir],
+        'helper': ["-c", "import symphony.helper"]
+    }
+
+
+def parse_importtime(output):
+    '''
+    Parse python -X importtime output. Returns {module: (self us,
+    cumulative us)}, and the total import time in us.
+    '''
+    modules = {}
+    total = 0
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        name = fields[2].rstrip()
+        self_us = int(fields[0])
+        cumulative_us = int(fields[1])
+        modules[name.strip()] = (self_us, cumulative_us)
+        if not name.startswith("  "):
+            total += cumulative_us
+
+    return modules, total
+
+
+def measure_imports(args):
+    '''
+    Run python -X importtime with args from the repository root. Returns
+    the parsed imports, the total import time in us and the wall time.
+    '''
+    env = os.environ.copy()
+    env['PYTHONPATH'] = REPO_ROOT + os.pathsep + env.get('PYTHONPATH', "")
+    # Measure the CLI itself, not a request to a running daemon.
+    env['SYMPHONY_DAEMON'] = "0"
+    start = time.time()
+    sproc = subprocess.Popen([sys.executable, "-X", "importtime"] + args,
+                             cwd=REPO_ROOT, env=env,
+                             stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE,
+                             universal_newlines=True)
+    _, stderr = sproc.communicate()
+    wall_time = time.time() - start
+    modules, total = parse_importtime(stderr)
+
+    return modules, total, wall_time
+
+
+def run_benchmark(repeat, top):
+    staging_dir = tempfile.mkdtemp(prefix="symphony-import-")
+    results = []
+    try:
+        for name, args in sorted(get_commands(staging_dir).items()):
+            runs = [measure_imports(args) for _ in range(repeat)]
+            modules, total, wall_time = min(runs, key=lambda run: run[1])
+            slowest = sorted(modules.items(), key=lambda item: item[1][0],
+                             reverse=True)[:top]
+            results.append({
+                'command': name,
+                'import_time': total / 1e6,
+                'wall_time': wall_time,
+                'modules': len(modules),
+                'heavy_modules': [module for module in HEAVY_MODULES
+                                  if module in modules],
+                'slowest': [{'module': module, 'self': timing[0] / 1e6,
+                             'cumulative': timing[1] / 1e6}
+                            for module, timing in slowest]
+            })
+    finally:
+        shutil.rmtree(staging_dir)
+
+    return results
+
+
+def print_results(results):
+    print("%-8s %10s %10s %8s  %s" % ("Command", "Import(s)", "Wall(s)",
+                                      "Modules", "Heavy modules"))
+    print("-" * 70)
+    for result in results:
+        print("%-8s %10.4f %10.4f %8d  %s" %
+              (result['command'], result['import_time'],
+               result['wall_time'], result['modules'],
+               ", ".join(result['heavy_modules']) or "-"))
+    for result in results:
+        print("")
+        print("%s: slowest imports (self)" % result['command'])
+        for module in result['slowest']:
+            print("    %-40s %8.4f %8.4f" % (module['module'], module['self'],
+                                             module['cumulative']))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="import_bench",
+        description="Benchmark the symphony CLI import time")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Runs of each command, the fastest is kept")
+    parser.add_argument("--top", type=int, default=10,
+                        help="Number of slowest imports to show")
+    parser.add_argument("--output",
+                        help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = run_benchmark(args.repeat, args.top)
+    print_results(results)
+    if args.output:
+        with open(args.output, "w") as out_fp:
+            json.dump(results, out_fp, indent=2)
+
+    # None of them needs a heavy module. list only imports prettytable to
+    # print the tables, and there are none on an empty staging directory.
+    for result in results:
+        if result['heavy_modules']:
+            print("%s imports %s" % (result['command'],
+                                     ", ".join(result['heavy_modules'])))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Dynamic Inventory Benchmark:
+----------------------------
+Measure the time to generate the ansible dynamic inventory (tf_inventory
+--list) from synthetic state files, once the states are loaded:
+
+    legacy:  the previous generate_host_groups, which matched every output
+             ip against every host, and rescanned the resources for the
+             tag groups.
+    indexed: TFInventory.list_inventory, with the ip and tag indexes.
+
+Usage (from the repository root):
+    PYTHONPATH=. python benchmarks/inventory_bench.py --instances 2000 10000
+'''
+
+import os
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import benchmarks.synthetic as synthetic
+import symphony.tf_inventory as tf_inventory
+
+
+def legacy_generate_host_groups(tfobject, inventory):
+    '''
+    The previous TFInventory.generate_host_groups, kept as the reference.
+    '''
+    for env in tfobject.keys():
+        for module in tfobject[env]['modules']:
+            for output in module['outputs'].keys():
+                inventory[output] = {}
+                inventory[output]['hosts'] = []
+                inventory[output]['vars'] = {}
+                inventory[output]['vars']['ipaddrs'] = []
+                for ipaddr in module['outputs'][output]['value']:
+                    for host in inventory['_meta']['hostvars'].keys():
+                        hostobj = inventory['_meta']['hostvars'][host]
+                        if hostobj['ansible_ssh_host'] == ipaddr:
+                            inventory[output]['hosts'].append(host)
+                            inventory[output]['vars']['ipaddrs'].\
+                                append(ipaddr)
+
+            for reskey, resval in module['resources'].items():
+                attributes = resval['primary']['attributes']
+                if resval['type'] != "aws_instance":
+                    continue
+                hostname = attributes['tags.Name']
+                for key in attributes.keys():
+                    if key.startswith("tags."):
+                        hostgroup = "%s=%s" % (key, attributes[key])
+                        if inventory.get(hostgroup, None) is None:
+                            inventory[hostgroup] = {}
+                            inventory[hostgroup]['hosts'] = []
+                        else:
+                            inventory[hostgroup]['hosts'].append(hostname)
+
+
+def legacy_list_inventory(tfinventory):
+    inventory = {'_meta': {'hostvars': {}}}
+    tfinventory.generate_server_info(inventory['_meta']['hostvars'])
+    legacy_generate_host_groups(tfinventory.tfobject, inventory)
+    return inventory
+
+
+def count_groups(inventory):
+    return len([group for group in inventory
+                if group not in ("_meta", "testgroup")])
+
+
+def timeit(func, *args):
+    start = time.time()
+    result = func(*args)
+    return result, time.time() - start
+
+
+def run_benchmark(instance_counts, legacy_max):
+    '''
+    Time both implementations on a state of each size.
+    '''
+    results = []
+    saved_root = os.environ.get('TERRAFORM_STATE_ROOT')
+    for count in instance_counts:
+        staging_dir = tempfile.mkdtemp(prefix="symphony-bench-")
+        try:
+            synthetic.write_state(staging_dir, "env", count)
+            os.environ['TERRAFORM_STATE_ROOT'] = staging_dir
+            tfinventory = tf_inventory.TFInventory()
+
+            inventory, elapsed = timeit(tfinventory.list_inventory)
+            results.append({'instances': count,
+                            'implementation': "indexed",
+                            'groups': count_groups(inventory),
+                            'wall_time': elapsed})
+
+            if count <= legacy_max:
+                inventory, elapsed = timeit(legacy_list_inventory,
+                                            tfinventory)
+                results.append({'instances': count,
+                                'implementation': "legacy",
+                                'groups': count_groups(inventory),
+                                'wall_time': elapsed})
+        finally:
+            shutil.rmtree(staging_dir)
+
+    if saved_root is None:
+        os.environ.pop('TERRAFORM_STATE_ROOT', None)
+    else:
+        os.environ['TERRAFORM_STATE_ROOT'] = saved_root
+
+    return results
+
+
+def print_results(results):
+    print("%-10s %-10s %8s %10s" % ("Instances", "Impl", "Groups", "Wall(s)"))
+    print("-" * 41)
+    for result in results:
+        print("%-10d %-10s %8d %10.3f" %
+              (result['instances'], result['implementation'],
+               result['groups'], result['wall_time']))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="inventory_bench",
+        description="Benchmark the ansible dynamic inventory")
+    parser.add_argument("--instances", type=int, nargs="+",
+                        default=[1000, 2000, 10000],
+                        help="Number of aws_instances per state")
+    parser.add_argument("--legacy-max", type=int, default=10000,
+                        dest="legacy_max",
+                        help="Skip the legacy implementation above this "
+                             "many instances")
+    parser.add_argument("--output",
+                        help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = run_benchmark(args.instances, args.legacy_max)
+    print_results(results)
+    if args.output:
+        with open(args.output, "w") as out_fp:
+            json.dump(results, out_fp, indent=2)
+
+
+if __name__ == '__main__':
+    main()
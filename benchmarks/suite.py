@@ -0,0 +1,398 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Symphony Benchmark Suite:
+-------------------------
+Time each phase of symphony on synthetic inputs, at several scales:
+
+    parse_config:      ConfigParser.parse_cluster_configuration
+    parse_environment: ConfigParser.parse_environment_configuration
+    parse_cached:      both, from the on disk config cache
+    normalize:         ConfigParser.normalize_parsed_configuration
+    render:            the common and cluster templates, compiled from
+                       scratch
+    tfparser_load:     TFParser load of the states, without the cache
+    tfparser_cached:   TFParser load of the states, from the cache
+    inventory:         TFInventory.list_inventory
+    build:             Helper build operation, end to end
+    deploy:            MultiDeploy init, plan and apply of every
+                       environment
+    configure:         the Helper configure playbook schedule
+    configure_batch:   the same, with one playbook per cluster (--batch)
+
+A scale is N clusters x M services, K aws_instances in the states, and E
+environments to deploy. The stand-in terraform and ansible-playbook in
+benchmarks/bin are put first on PATH, so build, deploy and configure
+measure the symphony orchestration only.
+
+The results are written as JSON. With --compare, each phase is compared
+to a previous results file, and the run fails if a phase got slower than
+the threshold.
+
+Usage (from the repository root):
+    PYTHONPATH=. python benchmarks/suite.py --scales small medium \
+        --output results.json --compare baseline.json
+'''
+
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import logging
+import argparse
+import platform
+import tempfile
+import contextlib
+import benchmarks.synthetic as synthetic
+import symphony.config_parser as config_parser
+import symphony.config_cache as config_cache
+import symphony.renderer as renderer
+import symphony.tfparser as tfparser
+import symphony.tf_inventory as tf_inventory
+import symphony.multi_deploy as multi_deploy
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BIN_DIR = os.path.join(REPO_ROOT, "benchmarks", "bin")
+TEMPLATE_DIR = os.path.join(REPO_ROOT, "templates")
+
+SCALES = {
+    'small': {'clusters': 2, 'services': 2, 'instances': 100,
+              'environments': 2},
+    'medium': {'clusters': 10, 'services': 5, 'instances': 2000,
+               'environments': 4},
+    'large': {'clusters': 50, 'services': 10, 'instances': 10000,
+              'environments': 8}
+}
+
+PHASES = ["parse_config", "parse_environment", "parse_cached",
+          "normalize", "render",
+          "tfparser_load", "tfparser_cached", "inventory", "build",
+          "deploy", "configure", "configure_batch"]
+
+
+class PhaseSkipped(Exception):
+    '''
+    Raised by a phase that cannot run in this tree or environment.
+    '''
+    pass
+
+
+def get_helper():
+    '''
+    Return the helper module, or raise PhaseSkipped if it does not import
+    under this interpreter.
+    '''
+    try:
+        import symphony.helper as helper
+    except (ImportError, SyntaxError) as err:
+        raise PhaseSkipped("symphony.helper: %s" % err)
+    return helper
+
+
+class Workload(object):
+    '''
+    The synthetic inputs of a scale, under a work directory.
+    '''
+    def __init__(self, work_dir, scale):
+        self.work_dir = work_dir
+        self.scale = scale
+        self.paths = synthetic.write_configs(work_dir, scale['clusters'],
+                                             scale['services'])
+        self.cfgparser = config_parser.ConfigParser(use_cache=False)
+        with open(self.paths['config']) as config_fp:
+            self.parsed_config = \
+                self.cfgparser.parse_cluster_configuration(config_fp)
+        self.parsed_env = self.cfgparser.parse_environment_configuration(
+            self.paths['environment'], self.parsed_config['environment'])
+        self.normalized_data = self.cfgparser.normalize_parsed_configuration(
+            self.parsed_config, self.parsed_env)
+
+        # The states, split over the environments.
+        self.state_root = os.path.join(work_dir, "states")
+        per_env = max(1, scale['instances'] // scale['environments'])
+        for index in range(scale['environments']):
+            synthetic.write_state(self.state_root, "env%d" % index, per_env,
+                                  clusters=scale['clusters'])
+
+        self.deploy_root = os.path.join(work_dir, "deploy")
+        for index in range(scale['environments']):
+            synthetic.write_tf_environment(self.deploy_root,
+                                           "env%d_bench" % index,
+                                           scale['clusters'])
+
+    def new_dir(self, name):
+        path = tempfile.mkdtemp(prefix=name + "-", dir=self.work_dir)
+        return path
+
+    def parse_config(self):
+        with open(self.paths['config']) as config_fp:
+            self.cfgparser.parse_cluster_configuration(config_fp)
+
+    def parse_environment(self):
+        self.cfgparser.parse_environment_configuration(
+            self.paths['environment'], self.parsed_config['environment'])
+
+    def parse_cached(self):
+        config_cache.ConfigCache.clear_memory()
+        cfgparser = config_parser.ConfigParser()
+        cfgparser.cache.cache_dir = os.path.join(self.work_dir,
+                                                 "config-cache")
+        with open(self.paths['config']) as config_fp:
+            cfgparser.parse_cluster_configuration(config_fp)
+        cfgparser.parse_environment_configuration(
+            self.paths['environment'], self.parsed_config['environment'])
+
+    def normalize(self):
+        self.cfgparser.normalize_parsed_configuration(self.parsed_config,
+                                                      self.parsed_env)
+
+    def render(self):
+        engine = renderer.TemplateEngine(
+            os.path.join(TEMPLATE_DIR, self.normalized_data['cloud_type']))
+        engine.render("common.j2", self.normalized_data)
+        for cluster, cluster_obj in self.normalized_data['clusters'].items():
+            cluster_obj = dict(cluster_obj)
+            cluster_obj['init_script'] = "./scripts/%s.sh" % cluster
+            engine.render(cluster_obj['cluster_template'] + ".j2",
+                          cluster_obj)
+
+    def tfparser_load(self):
+        tfparser.TFParser(self.state_root)
+
+    def tfparser_cached(self):
+        tfparser.TFParser(self.state_root, use_cache=True)
+
+    def inventory(self):
+        os.environ['TERRAFORM_STATE_ROOT'] = self.state_root
+        tf_inventory.TFInventory().list_inventory()
+
+    def build(self):
+        helper = get_helper()
+        with open(self.paths['config']) as config_fp:
+            operobj = {
+                'operation': "build",
+                'config': config_fp,
+                'environment': self.paths['environment'],
+                'staging': self.new_dir("build"),
+                'template': TEMPLATE_DIR,
+                'jobs': 1
+            }
+            helperobj = helper.Helper(operobj)
+            if not helperobj.valid or helperobj.perform_operation():
+                raise RuntimeError("build failed")
+
+    def deploy(self):
+        deploy_root = self.new_dir("deploy")
+        shutil.rmtree(deploy_root)
+        shutil.copytree(self.deploy_root, deploy_root)
+        with open(os.devnull, "w") as devnull:
+            deployer = multi_deploy.MultiDeploy(
+                deploy_root,
+                jobs=self.scale['environments'],
+                stream=devnull,
+                init_options={'plugin_cache_dir': False})
+            results = deployer.run()
+        failed = [env for env in results if results[env]['status'] != "ok"]
+        if not results or failed:
+            raise RuntimeError("deploy failed %s" % failed)
+
+    def configure(self, batch=False):
+        helper = get_helper()
+        with open(self.paths['config']) as config_fp:
+            operobj = {
+                'operation': "configure",
+                'config': config_fp,
+                'environment': self.paths['environment'],
+                'staging': self.state_root,
+                'jobs': self.scale['clusters'],
+                'batch': batch
+            }
+            helperobj = helper.Helper(operobj)
+        helperobj.normalized_data = self.normalized_data
+        dag = helperobj.build_configure_schedule(self.state_root)
+        results = dag.run()
+        failed = [name for name in results
+                  if results[name]['status'] != "ok"]
+        if failed:
+            raise RuntimeError("configure failed %s" % failed)
+
+    def configure_batch(self):
+        self.configure(batch=True)
+
+
+@contextlib.contextmanager
+def quiet():
+    '''
+    Drop the output and the info logs of the code being timed.
+    '''
+    logging.disable(logging.WARNING)
+    saved_stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    try:
+        yield
+    finally:
+        sys.stdout.close()
+        sys.stdout = saved_stdout
+        logging.disable(logging.NOTSET)
+
+
+def time_phase(func, repeat):
+    '''
+    Run a phase repeat times, and return the min, median and max wall
+    time.
+    '''
+    timings = []
+    for _ in range(repeat):
+        start = time.time()
+        with quiet():
+            func()
+        timings.append(time.time() - start)
+    timings.sort()
+
+    return {'min': timings[0],
+            'median': timings[len(timings) // 2],
+            'max': timings[-1]}
+
+
+def run_suite(scale_names, phases, repeat):
+    '''
+    Run the phases at each scale, and return the list of results.
+    '''
+    saved_path = os.environ.get('PATH', "")
+    saved_root = os.environ.get('TERRAFORM_STATE_ROOT')
+    os.environ['PATH'] = BIN_DIR + os.pathsep + saved_path
+
+    results = []
+    try:
+        for scale_name in scale_names:
+            scale = SCALES[scale_name]
+            work_dir = tempfile.mkdtemp(prefix="symphony-suite-")
+            try:
+                with quiet():
+                    workload = Workload(work_dir, scale)
+                for phase in phases:
+                    result = {'scale': scale_name, 'phase': phase}
+                    result.update(scale)
+                    try:
+                        result.update(time_phase(getattr(workload, phase),
+                                                 repeat))
+                        result['status'] = "ok"
+                    except PhaseSkipped as err:
+                        result['status'] = "skipped"
+                        result['reason'] = str(err)
+                    except Exception as err:
+                        result['status'] = "failed"
+                        result['reason'] = "%s: %s" % (type(err).__name__,
+                                                       err)
+                    results.append(result)
+            finally:
+                shutil.rmtree(work_dir)
+    finally:
+        os.environ['PATH'] = saved_path
+        if saved_root is None:
+            os.environ.pop('TERRAFORM_STATE_ROOT', None)
+        else:
+            os.environ['TERRAFORM_STATE_ROOT'] = saved_root
+
+    return results
+
+
+def compare_results(results, baseline, threshold):
+    '''
+    Return (lines, regressions): the median time of each phase against
+    the baseline run, and the phases slower than threshold times the
+    baseline.
+    '''
+    previous = dict([((result['scale'], result['phase']), result)
+                     for result in baseline['results']
+                     if result['status'] == "ok"])
+    lines = []
+    regressions = []
+    lines.append("%-8s %-18s %10s %10s %7s" % ("Scale", "Phase", "Base(s)",
+                                                "Now(s)", "Ratio"))
+    lines.append("-" * 57)
+    for result in results:
+        key = (result['scale'], result['phase'])
+        if result['status'] != "ok" or key not in previous:
+            continue
+        base = previous[key]['median']
+        ratio = result['median'] / base if base else 0.0
+        flag = ""
+        if ratio > threshold:
+            flag = " SLOWER"
+            regressions.append(key)
+        lines.append("%-8s %-18s %10.4f %10.4f %6.2fx%s" %
+                     (key[0], key[1], base, result['median'], ratio, flag))
+
+    return lines, regressions
+
+
+def print_results(results):
+    print("%-8s %-18s %-8s %10s %10s %10s" % ("Scale", "Phase", "Status",
+                                               "Min(s)", "Median(s)",
+                                               "Max(s)"))
+    print("-" * 69)
+    for result in results:
+        if result['status'] != "ok":
+            print("%-8s %-18s %-8s %s" % (result['scale'], result['phase'],
+                                          result['status'],
+                                          result['reason']))
+            continue
+        print("%-8s %-18s %-8s %10.4f %10.4f %10.4f" %
+              (result['scale'], result['phase'], result['status'],
+               result['min'], result['median'], result['max']))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="suite",
+        description="Benchmark the symphony phases on synthetic inputs")
+    parser.add_argument("--scales", nargs="+", default=["small", "medium"],
+                        choices=sorted(SCALES),
+                        help="Scales to run")
+    parser.add_argument("--phases", nargs="+", default=PHASES,
+                        choices=PHASES,
+                        help="Phases to run")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Runs of each phase")
+    parser.add_argument("--output",
+                        help="Write the results as JSON to this file")
+    parser.add_argument("--compare",
+                        help="Compare to the results JSON of a previous run")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="With --compare, fail if a phase is this many "
+                             "times slower")
+    args = parser.parse_args()
+
+    results = run_suite(args.scales, args.phases, args.repeat)
+    print_results(results)
+
+    report = {
+        'created': time.time(),
+        'host': socket.gethostname(),
+        'python': platform.python_version(),
+        'repeat': args.repeat,
+        'results': results
+    }
+    if args.output:
+        with open(args.output, "w") as out_fp:
+            json.dump(report, out_fp, indent=2)
+
+    if args.compare:
+        with open(args.compare) as baseline_fp:
+            baseline = json.load(baseline_fp)
+        lines, regressions = compare_results(results, baseline,
+                                             args.threshold)
+        print("")
+        for line in lines:
+            print(line)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Resource Summary Benchmark:
+---------------------------
+Measure the time to summarize the resources of a state (what list and
+summary do once the states are loaded), on synthetic states with ELBs and
+security groups that have big flattened attribute maps:
+
+    legacy:     the previous terraform_get_environment_summary, which
+                matched two regexes against every ELB attribute.
+    extractors: TFParser.terraform_get_environment_summary, with the
+                tfsummary extractors.
+
+The legacy summary only knows aws_instance and aws_elb, the ELB summaries
+of both are checked to be the same. With --groups, the state also has
+security groups, which only the extractors summarize: that measures the
+cost of the new summaries, not a speedup.
+
+Usage (from the repository root):
+    PYTHONPATH=. python benchmarks/summary_bench.py --instances 100 1000
+'''
+
+import os
+import re
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import benchmarks.synthetic as synthetic
+import symphony.tfparser as tfparser
+
+
+def legacy_get_environment_summary(tfobject):
+    '''
+    The previous TFParser.terraform_get_environment_summary, kept as the
+    reference.
+    '''
+    summary = {}
+    for env in tfobject.keys():
+        summary[env] = {}
+        for module in tfobject[env]['modules']:
+            for reskey, resval in module['resources'].items():
+                attributes = resval['primary']['attributes']
+                restype = resval['type']
+                if summary[env].get(restype, None) is None:
+                    summary[env][restype] = {}
+
+                res_id = attributes['id']
+                summary[env][restype][res_id] = {}
+                obj = summary[env][restype][res_id]
+                if restype == "aws_instance":
+                    obj['ami'] = attributes['ami']
+                    obj['private_ip'] = attributes['private_ip']
+                    obj['instance_state'] = attributes['instance_state']
+                    obj['instance_type'] = attributes['instance_type']
+                    obj['key_name'] = attributes['key_name']
+                if restype == "aws_elb":
+                    obj['name'] = attributes['name']
+                    obj['availability_zones'] = []
+                    obj['instances'] = []
+                    for key, attr in attributes.items():
+                        if re.match(r'availability_zones\.(\d+)',
+                                    key):
+                            obj['availability_zones'].append(attr)
+                        elif re.match(r'instances\.(\d+)',
+                                      key):
+                            obj['instances'].append(attr)
+
+    return summary
+
+
+def timeit(func, *args):
+    start = time.time()
+    result = func(*args)
+    return result, time.time() - start
+
+
+def run_benchmark(instance_counts, num_elbs, num_groups, rules, repeat):
+    '''
+    Time both implementations on a state for each number of instances per
+    ELB.
+    '''
+    results = []
+    for count in instance_counts:
+        staging_dir = tempfile.mkdtemp(prefix="symphony-bench-")
+        try:
+            env_dir = os.path.join(staging_dir, "env")
+            os.makedirs(env_dir)
+            state = synthetic.generate_network_state(num_elbs, count,
+                                                     num_groups, rules)
+            with open(os.path.join(env_dir, "terraform.tfstate"),
+                      "w") as tf_fp:
+                json.dump(state, tf_fp)
+            parser = tfparser.TFParser(staging_dir)
+
+            runs = [timeit(legacy_get_environment_summary, parser.tfobject)
+                    for _ in range(repeat)]
+            legacy = runs[0][0]
+            legacy_time = min([elapsed for _, elapsed in runs])
+
+            runs = [timeit(parser.terraform_get_environment_summary)
+                    for _ in range(repeat)]
+            summary = runs[0][0]
+            extractors_time = min([elapsed for _, elapsed in runs])
+
+            if summary['env'].get('aws_elb') != \
+                    legacy['env'].get('aws_elb'):
+                raise AssertionError("ELB summaries differ with %d "
+                                     "instances" % count)
+
+            for name, elapsed in [("legacy", legacy_time),
+                                  ("extractors", extractors_time)]:
+                results.append({'instances': count,
+                                'implementation': name,
+                                'resources': len(
+                                    state['modules'][0]['resources']),
+                                'wall_time': elapsed})
+        finally:
+            shutil.rmtree(staging_dir)
+
+    return results
+
+
+def print_results(results):
+    print("%-10s %-11s %10s %10s" % ("Instances", "Impl", "Resources",
+                                     "Wall(s)"))
+    print("-" * 44)
+    for result in results:
+        print("%-10d %-11s %10d %10.4f" %
+              (result['instances'], result['implementation'],
+               result['resources'], result['wall_time']))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="summary_bench",
+        description="Benchmark the resource summaries")
+    parser.add_argument("--instances", type=int, nargs="+",
+                        default=[100, 1000, 5000],
+                        help="Number of instances behind each ELB")
+    parser.add_argument("--elbs", type=int, default=20,
+                        help="Number of ELBs")
+    parser.add_argument("--groups", type=int, default=0,
+                        help="Number of security groups")
+    parser.add_argument("--rules", type=int, default=50,
+                        help="Number of ingress rules per security group")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Runs of each implementation, the fastest is "
+                        "kept")
+    parser.add_argument("--output",
+                        help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = run_benchmark(args.instances, args.elbs, args.groups,
+                            args.rules, args.repeat)
+    print_results(results)
+    if args.output:
+        with open(args.output, "w") as out_fp:
+            json.dump(results, out_fp, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,372 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Synthetic data for the symphony benchmarks.
+'''
+
+import os
+import json
+import zlib
+
+
+def generate_instance(index, cluster, extra_attributes=0):
+    '''
+    Return a terraform (0.7 format) aws_instance resource.
+    '''
+    instance_id = "i-%08x" % index
+    private_ip = "10.%d.%d.%d" % ((index >> 16) & 255, (index >> 8) & 255,
+                                  index & 255)
+    attributes = {
+        "id": instance_id,
+        "ami": "ami-xxxxxxx9",
+        "availability_zone": "us-east-1%s" % "bcde"[index % 4],
+        "instance_state": "running",
+        "instance_type": "t2.micro",
+        "key_name": "symphony-key",
+        "private_ip": private_ip,
+        "public_ip": "",
+        "subnet_id": "subnet-%08x" % (index % 4),
+        "root_block_device.#": "1",
+        "root_block_device.0.volume_size": "10",
+        "root_block_device.0.volume_type": "standard",
+        "vpc_security_group_ids.#": "1",
+        "vpc_security_group_ids.1234567": "sg-5xxxxxxx",
+        "tags.%": "4",
+        "tags.Name": "%s-%d" % (cluster, index),
+        "tags.Cluster": cluster,
+        "tags.Environment": "devtest",
+        "tags.Project": "symphony",
+        "user_data": "a" * 40
+    }
+    # Unused attributes, like the block device and network interface
+    # details of real states.
+    for attr in range(extra_attributes):
+        attributes["ebs_block_device.%d.device_name" % attr] = \
+            "/dev/sd%s-%d" % (chr(ord('b') + attr % 20), index)
+
+    return {
+        "type": "aws_instance",
+        "depends_on": ["aws_key_pair.spawn_keypair"],
+        "primary": {
+            "id": instance_id,
+            "attributes": attributes,
+            "meta": {"schema_version": "1"},
+            "tainted": False
+        },
+        "deposed": [],
+        "provider": ""
+    }
+
+
+def generate_state(num_instances, clusters=10, extra_attributes=0):
+    '''
+    Return a terraform state with num_instances aws_instances spread over
+    the clusters, and one output per cluster with its private ips.
+    '''
+    resources = {}
+    outputs = {}
+    for index in range(num_instances):
+        cluster = "cluster%d" % (index % clusters)
+        resource = generate_instance(index, cluster, extra_attributes)
+        reskey = "aws_instance.spawn_instance_%s.%d" % (cluster,
+                                                         index // clusters)
+        resources[reskey] = resource
+        output = outputs.setdefault(cluster, {"sensitive": False,
+                                              "type": "list",
+                                              "value": []})
+        output["value"].append(
+            resource["primary"]["attributes"]["private_ip"])
+
+    return {
+        "version": 3,
+        "terraform_version": "0.7.4",
+        "serial": 1,
+        "lineage": "00000000-0000-0000-0000-000000000000",
+        "modules": [{
+            "path": ["root"],
+            "outputs": outputs,
+            "resources": resources,
+            "depends_on": []
+        }]
+    }
+
+
+def write_state(staging_dir, env_name, num_instances, clusters=10,
+                extra_attributes=0):
+    '''
+    Write a synthetic terraform.tfstate to <staging_dir>/<env_name>.
+    Returns the state file path.
+    '''
+    env_dir = os.path.join(staging_dir, env_name)
+    if not os.path.exists(env_dir):
+        os.makedirs(env_dir)
+    state_file = os.path.join(env_dir, "terraform.tfstate")
+    with open(state_file, "w") as tf_fp:
+        json.dump(generate_state(num_instances, clusters, extra_attributes),
+                  tf_fp, indent=4)
+
+    return state_file
+
+
+def set_hash(*values):
+    '''
+    Return a terraform like set element index for the values.
+    '''
+    return str(zlib.crc32("|".join(values).encode("utf-8")))
+
+
+def generate_elb(index, instance_ids, zones):
+    '''
+    Return a terraform aws_elb resource, with its instances, zones,
+    listeners and tags flattened in its attributes.
+    '''
+    name = "elb-%d" % index
+    attributes = {
+        "id": name,
+        "name": name,
+        "dns_name": "%s.us-east-1.elb.amazonaws.com" % name,
+        "availability_zones.#": str(len(zones)),
+        "instances.#": str(len(instance_ids)),
+        "listener.#": "2",
+        "health_check.#": "1",
+        "health_check.0.target": "HTTP:80/",
+        "health_check.0.interval": "30",
+        "tags.%": "2",
+        "tags.Name": name,
+        "tags.Environment": "devtest"
+    }
+    for zone in zones:
+        attributes["availability_zones.%s" % set_hash(zone)] = zone
+    for instance_id in instance_ids:
+        attributes["instances.%s" % set_hash(instance_id)] = instance_id
+    for port in ["80", "443"]:
+        listener = "listener.%s" % set_hash(name, port)
+        attributes[listener + ".instance_port"] = port
+        attributes[listener + ".lb_port"] = port
+        attributes[listener + ".lb_protocol"] = "http"
+
+    return {"type": "aws_elb",
+            "primary": {"id": name, "attributes": attributes}}
+
+
+def generate_security_group(index, num_rules):
+    '''
+    Return a terraform aws_security_group resource with num_rules ingress
+    rules and one egress rule.
+    '''
+    group_id = "sg-%08x" % index
+    attributes = {
+        "id": group_id,
+        "name": "sg-bench-%d" % index,
+        "vpc_id": "vpc-xxxxxxx1",
+        "description": "Managed by symphony",
+        "ingress.#": str(num_rules),
+        "egress.#": "1",
+        "tags.%": "1",
+        "tags.Name": "sg-bench-%d" % index
+    }
+    rules = [("ingress", str(8000 + rule), "10.%d.0.0/16" % (rule % 256))
+             for rule in range(num_rules)]
+    rules.append(("egress", "0", "0.0.0.0/0"))
+    for direction, port, cidr in rules:
+        rule = "%s.%s" % (direction, set_hash(port, cidr))
+        attributes[rule + ".from_port"] = port
+        attributes[rule + ".to_port"] = port
+        attributes[rule + ".protocol"] = "tcp" if port != "0" else "-1"
+        attributes[rule + ".self"] = "false"
+        attributes[rule + ".cidr_blocks.#"] = "1"
+        attributes[rule + ".cidr_blocks.0"] = cidr
+        attributes[rule + ".security_groups.#"] = "0"
+
+    return {"type": "aws_security_group",
+            "primary": {"id": group_id, "attributes": attributes}}
+
+
+def generate_network_state(num_elbs, instances_per_elb, num_groups,
+                           rules_per_group):
+    '''
+    Return a terraform state with ELBs and security groups that have big
+    flattened attribute maps, a few subnets and a key pair.
+    '''
+    zones = ["us-east-1%s" % zone for zone in "bcde"]
+    resources = {}
+    for index in range(num_elbs):
+        instance_ids = ["i-%08x" % (index * instances_per_elb + instance)
+                        for instance in range(instances_per_elb)]
+        resources["aws_elb.spawn_elb_%d" % index] = \
+            generate_elb(index, instance_ids, zones)
+    for index in range(num_groups):
+        resources["aws_security_group.spawn_sg_%d" % index] = \
+            generate_security_group(index, rules_per_group)
+    for index, zone in enumerate(zones):
+        subnet_id = "subnet-%08x" % index
+        resources["aws_subnet.spawn_subnet_%d" % index] = {
+            "type": "aws_subnet",
+            "primary": {"id": subnet_id, "attributes": {
+                "id": subnet_id,
+                "vpc_id": "vpc-xxxxxxx1",
+                "cidr_block": "10.0.%d.0/24" % index,
+                "availability_zone": zone,
+                "map_public_ip_on_launch": "false",
+                "tags.%": "1",
+                "tags.Name": "subnet-%s" % zone}}}
+    resources["aws_key_pair.spawn_keypair"] = {
+        "type": "aws_key_pair",
+        "primary": {"id": "symphony-key", "attributes": {
+            "id": "symphony-key",
+            "key_name": "symphony-key",
+            "fingerprint": "d7:ff:a6:63:18:64:9c:57:a1:ee:ca:a4:ad:c2:81:62",
+            "public_key": "ssh-rsa AAAA"}}}
+
+    return {
+        "version": 3,
+        "terraform_version": "0.7.4",
+        "serial": 1,
+        "lineage": "00000000-0000-0000-0000-000000000000",
+        "modules": [{
+            "path": ["root"],
+            "outputs": {},
+            "resources": resources,
+            "depends_on": []
+        }]
+    }
+
+
+def generate_cluster_config(num_clusters, num_services, env_name="benchenv",
+                            service_root=None):
+    '''
+    Return a cluster config with num_clusters clusters of num_services
+    services each, like examples/aws/clusters/simpleapp_devtest.yaml.
+    With a service_root, each service uses <service_root>/<service> as its
+    service_dir.
+    '''
+    clusters = {}
+    for cluster_index in range(num_clusters):
+        cluster = "cluster%d" % cluster_index
+        services = {}
+        for service_index in range(num_services):
+            service = "service%d" % service_index
+            service_info = {'version': "1.%d" % service_index}
+            if service_root is not None:
+                service_info['service_dir'] = os.path.join(service_root,
+                                                           service)
+            services[service] = service_info
+
+        clusters[cluster] = {
+            'name': "%s-bench" % cluster,
+            'cluster_size': 3,
+            'cluster_template': "basic_instance",
+            'tags': {
+                'Project': "Bench",
+                'Name': "%s-${count.index}" % cluster,
+                'Cluster': cluster,
+                'Environment': "devtest"
+            },
+            'connection_info': {'username': "ec2-user"},
+            'services': services
+        }
+
+    return {
+        'name': "benchapp",
+        'environment': env_name,
+        'credentials_file': "/tmp/bench/credentials",
+        'profile_name': "default",
+        'public_key_loc': "/tmp/bench/symphonykey.pub",
+        'private_key_loc': "/tmp/bench/symphonykey",
+        'connection_info': {'username': "ec2-user"},
+        'clusters': clusters
+    }
+
+
+def generate_environment(env_name="benchenv"):
+    '''
+    Return an environment config, like
+    examples/aws/environments/myawstestenv_useast1.yaml.
+    '''
+    zones = ["us-east-1b", "us-east-1c", "us-east-1d", "us-east-1e"]
+    return {
+        'name': env_name,
+        'type': "aws",
+        'region': "us-east-1",
+        'amis': {'centos7': "ami-xxxxxxx9", 'ubuntu14': "ami-xxxxxxx4"},
+        'vpc': "vpc-8887777",
+        'subnets': {
+            'private': dict([(zone, "subnet-%08x" % index)
+                             for index, zone in enumerate(zones)]),
+            'public': dict([(zone, "subnet-%08x" % (index + 16))
+                            for index, zone in enumerate(zones)])
+        },
+        'security_groups': {
+            'all': "sg-5xxxxxxx",
+            'http': "sg-5xxxxxxx",
+            'ssh': "sg-xxxxxxx1"
+        }
+    }
+
+
+def write_configs(work_dir, num_clusters, num_services,
+                  env_name="benchenv"):
+    '''
+    Write a synthetic cluster config, environment, and a service dir with
+    a site.yaml for every service, under work_dir. Returns the paths as a
+    dictionary with the keys config, environment and services.
+    '''
+    import yaml
+
+    env_dir = os.path.join(work_dir, "environments")
+    service_root = os.path.join(work_dir, "services")
+    for path in (env_dir, service_root):
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+    for service_index in range(num_services):
+        service_dir = os.path.join(service_root, "service%d" % service_index)
+        if not os.path.exists(service_dir):
+            os.makedirs(service_dir)
+        with open(os.path.join(service_dir, "site.yaml"), "w") as site_fp:
+            site_fp.write("- hosts: \"{{ hosts }}\"\n  tasks: []\n")
+
+    config_file = os.path.join(work_dir, "cluster.yaml")
+    with open(config_file, "w") as config_fp:
+        yaml.safe_dump(generate_cluster_config(num_clusters, num_services,
+                                               env_name=env_name,
+                                               service_root=service_root),
+                       config_fp, default_flow_style=False)
+    with open(os.path.join(env_dir, env_name + ".yaml"), "w") as env_fp:
+        yaml.safe_dump(generate_environment(env_name), env_fp,
+                       default_flow_style=False)
+
+    return {'config': config_file,
+            'environment': env_dir,
+            'services': service_root}
+
+
+def write_tf_environment(staging_dir, env_name, num_clusters):
+    '''
+    Write a terraform environment with one aws_instance resource and
+    output per cluster, like a rendered build. Returns the environment
+    directory.
+    '''
+    env_dir = os.path.join(staging_dir, env_name)
+    if not os.path.exists(env_dir):
+        os.makedirs(env_dir)
+
+    lines = ['provider "aws" {', '    region = "us-east-1"', '}', '']
+    for index in range(num_clusters):
+        cluster = "cluster%d" % index
+        lines.extend([
+            'resource "aws_instance" "spawn_instance_%s" {' % cluster,
+            '    count = "3"',
+            '    instance_type = "t2.micro"',
+            '}',
+            '',
+            'output "%s" {' % cluster,
+            '    value = ["${aws_instance.spawn_instance_%s.*.private_ip}"]'
+            % cluster,
+            '}',
+            ''])
+    with open(os.path.join(env_dir, "main.tf"), "w") as tf_fp:
+        tf_fp.write("\n".join(lines))
+
+    return env_dir
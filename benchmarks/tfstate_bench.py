@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+TF State Loader Benchmark:
+--------------------------
+Compare peak memory (RSS) and wall time of the tfstate loaders on
+synthetic state files:
+
+    json:      json.load of the whole state (the TFParser default)
+    streaming: tfstream.load_state
+    cached:    TFStateCache hit (the state was loaded once before)
+
+Each measurement runs in its own process, so the peak RSS of one loader
+does not hide the others.
+
+Usage (from the repository root):
+    PYTHONPATH=. python benchmarks/tfstate_bench.py --instances 1000 20000
+'''
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import subprocess
+import benchmarks.synthetic as synthetic
+
+
+LOADERS = ["json", "streaming", "cached"]
+
+
+def peak_rss_kb():
+    '''
+    Return the peak RSS of this process in KB. ru_maxrss survives exec on
+    Linux, so a child would report its parent's peak; VmHWM does not.
+    '''
+    try:
+        with open("/proc/self/status", "r") as status_fp:
+            for line in status_fp:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_loader(loader, state_file):
+    '''
+    Load the state with one loader, in this process, and return the
+    measurements.
+    '''
+    import symphony.tfstream as tfstream
+    import symphony.tfstate_cache as tfstate_cache
+
+    staging_dir = os.path.dirname(os.path.dirname(state_file))
+    rss_before = peak_rss_kb()
+    start = time.time()
+    if loader == "json":
+        with open(state_file, "r") as tf_fp:
+            state = json.load(tf_fp)
+    elif loader == "streaming":
+        state = tfstream.load_state(state_file)
+    else:
+        state = tfstate_cache.TFStateCache(staging_dir).load(state_file)
+    elapsed = time.time() - start
+    rss_after = peak_rss_kb()
+
+    return {
+        'loader': loader,
+        'resources': len(state['modules'][0]['resources']),
+        'wall_time': elapsed,
+        'peak_rss_mb': rss_after / 1024.0,
+        'rss_growth_mb': (rss_after - rss_before) / 1024.0
+    }
+
+
+def measure(loader, state_file):
+    '''
+    Run a loader in a child process and return its measurements.
+    '''
+    cmd = [sys.executable, os.path.abspath(__file__),
+           "--run", loader, state_file]
+    if loader == "cached":
+        # Warm the cache in another process, to measure only the hit.
+        subprocess.check_output(cmd)
+    output = subprocess.check_output(cmd)
+    return json.loads(output.decode("utf-8").splitlines()[-1])
+
+
+def run_benchmark(instance_counts, extra_attributes):
+    '''
+    Run every loader on a state file of each size.
+    '''
+    results = []
+    for count in instance_counts:
+        staging_dir = tempfile.mkdtemp(prefix="symphony-bench-")
+        try:
+            state_file = synthetic.write_state(staging_dir, "env", count,
+                                               extra_attributes=extra_attributes)
+            size_mb = os.path.getsize(state_file) / (1024.0 * 1024.0)
+            for loader in LOADERS:
+                result = measure(loader, state_file)
+                result['instances'] = count
+                result['state_size_mb'] = size_mb
+                results.append(result)
+        finally:
+            shutil.rmtree(staging_dir)
+
+    return results
+
+
+def print_results(results):
+    print("%-10s %10s %-10s %10s %12s %12s" %
+          ("Instances", "State(MB)", "Loader", "Wall(s)", "PeakRSS(MB)",
+           "RSSGrow(MB)"))
+    print("-" * 70)
+    for result in results:
+        print("%-10d %10.1f %-10s %10.3f %12.1f %12.1f" %
+              (result['instances'], result['state_size_mb'],
+               result['loader'], result['wall_time'],
+               result['peak_rss_mb'], result['rss_growth_mb']))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="tfstate_bench",
+        description="Benchmark the tfstate loaders")
+    parser.add_argument("--instances", type=int, nargs="+",
+                        default=[1000, 10000],
+                        help="Number of aws_instances per state")
+    parser.add_argument("--extra-attributes", type=int, default=20,
+                        dest="extra_attributes",
+                        help="Unused attributes per instance")
+    parser.add_argument("--output",
+                        help="Write the results as JSON to this file")
+    parser.add_argument("--run", nargs=2, metavar=("LOADER", "STATE"),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        print(json.dumps(run_loader(args.run[0], args.run[1])))
+        return
+
+    results = run_benchmark(args.instances, args.extra_attributes)
+    print_results(results)
+    if args.output:
+        with open(args.output, "w") as out_fp:
+            json.dump(results, out_fp, indent=2)
+
+
+if __name__ == '__main__':
+    main()
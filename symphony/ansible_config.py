@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Ansible Config:
+---------------
+Each ansible-playbook run of the configure step opens its own ssh
+connections to the hosts, and copies every module over before running
+it.
+
+symphony writes <staging>/ansible.cfg, used by the playbooks it runs
+(ANSIBLE_CONFIG), that turns on:
+    - pipelining: modules are run over the ssh session, without copying
+      them to the host first.
+    - ControlMaster/ControlPersist: one master connection per host, that
+      the ssh sessions share, and that stays up CONTROL_PERSIST after the
+      last session.
+
+The control sockets of a staging dir are kept under
+<staging>/.symphony/cp. The ssh readiness probe opens the master
+connections with the same ssh options, so the first playbook finds them
+established.
+
+Pipelining needs `requiretty` to be off in the sudoers of the hosts.
+SYMPHONY_ANSIBLE_PIPELINING=0 turns it off.
+
+With configure --batch, the services of a cluster run as one playbook,
+<staging>/.symphony/playbooks/<cluster>.yaml, that imports the site.yaml
+of each service with the vars of that service.
+'''
+
+import os
+import hashlib
+import tempfile
+import yaml
+
+
+CONFIG_FILE = "ansible.cfg"
+PLAYBOOK_DIR = os.path.join(".symphony", "playbooks")
+CONTROL_PERSIST = "300s"
+
+# A unix socket path is at most 108 bytes, and %C is 40 characters.
+MAX_CONTROL_DIR = 60
+
+
+def pipelining_enabled():
+    return os.environ.get('SYMPHONY_ANSIBLE_PIPELINING', "1") != "0"
+
+
+def get_control_dir(staging_dir):
+    '''
+    Return the directory of the ssh control sockets of a staging dir,
+    <staging>/.symphony/cp, or a directory under the temp dir named by the
+    staging dir hash when that path is too long for a socket.
+    '''
+    staging_dir = os.path.abspath(staging_dir)
+    control_dir = os.path.join(staging_dir, ".symphony", "cp")
+    if len(control_dir) > MAX_CONTROL_DIR:
+        digest = hashlib.sha1(staging_dir.encode("utf-8")).hexdigest()
+        control_dir = os.path.join(tempfile.gettempdir(),
+                                   "symphony-cp-%s" % digest[:12])
+    return control_dir
+
+
+def get_ssh_options(staging_dir):
+    '''
+    Return the ssh options that share the master connections of a
+    staging dir.
+    '''
+    return ["-o", "ControlMaster=auto",
+            "-o", "ControlPersist=%s" % CONTROL_PERSIST,
+            "-o", "ControlPath=%s" % os.path.join(
+                get_control_dir(staging_dir), "%C")]
+
+
+def write_ansible_cfg(staging_dir):
+    '''
+    Write the ansible.cfg of a staging dir, and create its control socket
+    directory. Returns the ansible.cfg path.
+    '''
+    control_dir = get_control_dir(staging_dir)
+    if not os.path.exists(control_dir):
+        os.makedirs(control_dir, 0o700)
+
+    lines = [
+        "# Generated by symphony, changes are overwritten.",
+        "[defaults]",
+        "host_key_checking = False",
+        "",
+        "[ssh_connection]",
+        "pipelining = %s" % pipelining_enabled(),
+        "ssh_args = -C -o ControlMaster=auto -o ControlPersist=%s" %
+        CONTROL_PERSIST,
+        "control_path_dir = %s" % control_dir,
+        "control_path = %(directory)s/%%C",
+        ""
+    ]
+    config_file = os.path.join(staging_dir, CONFIG_FILE)
+    with open(config_file, "w") as cfg_fp:
+        cfg_fp.write("\n".join(lines))
+
+    return config_file
+
+
+def write_cluster_playbook(staging_dir, cluster, imports):
+    '''
+    Write the playbook of a cluster, that runs the service playbooks one
+    after the other. Returns the playbook path.
+
+    :type imports: list
+    :param imports: (playbook path, vars) pairs, in run order. The vars
+                    only apply to the plays of their playbook.
+    '''
+    playbook_dir = os.path.join(staging_dir, PLAYBOOK_DIR)
+    if not os.path.exists(playbook_dir):
+        os.makedirs(playbook_dir)
+
+    plays = []
+    for playbook, play_vars in imports:
+        plays.append({'import_playbook': os.path.abspath(playbook),
+                      'vars': play_vars})
+    playbook_file = os.path.join(playbook_dir, "%s.yaml" % cluster)
+    with open(playbook_file, "w") as playbook_fp:
+        playbook_fp.write("# Generated by symphony, changes are "
+                          "overwritten.\n")
+        yaml.safe_dump(plays, playbook_fp, default_flow_style=False)
+
+    return playbook_file
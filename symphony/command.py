@@ -3,12 +3,85 @@
 
 '''
 Command Handler:
+
+execute_async() and execute_many() run commands on an asyncio event loop.
+stdout and stderr are read concurrently, line by line, and each line is
+passed to a list of sinks (console, log file, ring buffer). Only the last
+lines of each stream are kept in memory, however long the command runs.
 '''
+import os
 import sys
+import time
+import asyncio
+import threading
 import subprocess
+import collections
 import utils.symphony_logger as logger
 
 
+# Lines kept in memory per stream by the async executor.
+DEFAULT_TAIL_LINES = 200
+# Longest line passed to the sinks at once by the async executor.
+LINE_LIMIT = 1 << 20
+CHUNK_SIZE = 1 << 16
+
+
+class ConsoleSink(object):
+    '''
+    Write lines to the console, with an optional prefix. stderr lines go
+    to sys.stderr, unless a stream is given.
+    '''
+    def __init__(self, prefix="", stream=None):
+        self.prefix = prefix
+        self.stream = stream
+        self.lock = threading.Lock()
+
+    def write(self, source, line):
+        stream = self.stream
+        if stream is None:
+            stream = sys.stderr if source == "stderr" else sys.stdout
+        with self.lock:
+            stream.write(self.prefix + line)
+            stream.flush()
+
+    def close(self):
+        pass
+
+
+class LogFileSink(object):
+    '''
+    Append lines to a log file.
+    '''
+    def __init__(self, logfile):
+        logdir = os.path.dirname(logfile)
+        if logdir and not os.path.exists(logdir):
+            os.makedirs(logdir)
+        self.log_fp = open(logfile, "a")
+
+    def write(self, source, line):
+        self.log_fp.write(line)
+
+    def close(self):
+        self.log_fp.close()
+
+
+class RingBufferSink(object):
+    '''
+    Keep the last maxlines lines in memory.
+    '''
+    def __init__(self, maxlines=DEFAULT_TAIL_LINES):
+        self.buffer = collections.deque(maxlen=maxlines)
+
+    def write(self, source, line):
+        self.buffer.append(line)
+
+    def close(self):
+        pass
+
+    def text(self):
+        return "".join(self.buffer)
+
+
 class Command(object):
     '''
     Command Handlerself
@@ -20,7 +93,7 @@ class Command(object):
         cwd = options.get('cwd', None)
         env = options.get('env', None)
         if popen:
-            cmdoutput = ""
+            cmdoutput = []
             sproc = subprocess.Popen(cmd,
                                      env=env,
                                      cwd=cwd,
@@ -29,14 +102,14 @@ class Command(object):
             while True:
                 nextline = sproc.stdout.readline()
                 nextline = nextline.decode("utf-8")
-                cmdoutput += nextline
+                cmdoutput.append(nextline)
                 if nextline == '' and sproc.poll() is not None:
                     break
 
                 sys.stdout.write(nextline)
                 sys.stdout.flush()
 
-            return 0, cmdoutput
+            return 0, "".join(cmdoutput)
 
         try:
             cmdoutput = subprocess.check_output(cmd,
@@ -89,3 +162,111 @@ class Command(object):
             self.slog.logger.error("CMD: %s not found %s",
             cmd, err)
             return err.errno, "", err.__str__()
+
+    async def read_stream(self, source, reader, sinks, tail):
+        '''
+        Read a stream line by line, passing each line to the sinks and
+        keeping the last lines in tail. A line longer than LINE_LIMIT is
+        passed on in pieces.
+        '''
+        def emit(data):
+            line = data.decode("utf-8", "replace")
+            tail.append(line)
+            for sink in sinks:
+                sink.write(source, line)
+
+        pending = b""
+        while True:
+            chunk = await reader.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            lines = (pending + chunk).split(b"\n")
+            pending = lines.pop()
+            for line in lines:
+                emit(line + b"\n")
+            if len(pending) >= LINE_LIMIT:
+                emit(pending)
+                pending = b""
+
+        if pending:
+            emit(pending)
+
+    async def run_async(self, cmd, **kwargs):
+        '''
+        Run a command on the running event loop.
+
+        Keyword arguments:
+            cwd, env: As for subprocess
+            sinks: Objects with write(source, line) and close(), called
+                   with every stdout and stderr line
+            tail_lines: Lines of stdout and stderr kept and returned
+
+        Returns (returncode, stdout tail, stderr tail).
+        '''
+        cwd = kwargs.get('cwd', None)
+        env = kwargs.get('env', None)
+        sinks = kwargs.get('sinks', None) or []
+        tail_lines = kwargs.get('tail_lines', DEFAULT_TAIL_LINES)
+        self.slog.logger.debug("CMD: %s, option: %s", cmd, kwargs)
+
+        stdout_tail = collections.deque(maxlen=tail_lines)
+        stderr_tail = collections.deque(maxlen=tail_lines)
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *cmd,
+                cwd=cwd, env=env,
+                stdin=subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE)
+        except (FileNotFoundError, PermissionError) as err:
+            self.slog.logger.error("CMD: %s not found %s", cmd, err)
+            return err.errno, "", err.__str__()
+
+        await asyncio.gather(
+            self.read_stream("stdout", proc.stdout, sinks, stdout_tail),
+            self.read_stream("stderr", proc.stderr, sinks, stderr_tail))
+        returncode = await proc.wait()
+
+        return returncode, "".join(stdout_tail), "".join(stderr_tail)
+
+    def execute_async(self, cmd, **kwargs):
+        '''
+        Run a single command with the async executor. Takes the keyword
+        arguments of run_async. The sinks are closed when it is done.
+        '''
+        try:
+            return asyncio.run(self.run_async(cmd, **kwargs))
+        finally:
+            for sink in kwargs.get('sinks', None) or []:
+                sink.close()
+
+    def execute_many(self, commands, concurrency=None):
+        '''
+        Run several commands from a single event loop, at most concurrency
+        at the same time (no limit by default).
+
+        :type commands: list
+        :param commands: A list of dictionaries, with the command in 'cmd'
+                         and the keyword arguments of run_async
+
+        Returns a list of (returncode, stdout tail, stderr tail, duration),
+        in the order of the commands.
+        '''
+        async def run_one(semaphore, cmdspec):
+            kwargs = dict(cmdspec)
+            cmd = kwargs.pop('cmd')
+            async with semaphore:
+                start = time.time()
+                try:
+                    ret, stdout, stderr = await self.run_async(cmd, **kwargs)
+                finally:
+                    for sink in kwargs.get('sinks', None) or []:
+                        sink.close()
+                return ret, stdout, stderr, time.time() - start
+
+        async def run_all():
+            semaphore = asyncio.Semaphore(concurrency or len(commands) or 1)
+            return await asyncio.gather(*[run_one(semaphore, cmdspec)
+                                          for cmdspec in commands])
+
+        return list(asyncio.run(run_all()))
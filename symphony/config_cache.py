@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Config Cache:
+-------------
+The cluster and environment files are parsed on every build and
+configure, and the same environment is shared by many cluster configs.
+
+The cache keeps the parsed documents, keyed by the file path and the
+sha256 of its content, in memory for the life of the process and on disk
+under ~/.symphony/config-cache (or $SYMPHONY_CONFIG_CACHE_DIR) for the
+next runs. A changed file has a different hash, so it is parsed again.
+The first run that writes an entry removes the entries of the config
+files that no longer exist, and the older documents of a changed file are
+dropped from memory.
+
+The documents are stored as JSON. A document that does not survive a
+JSON round trip unchanged (dates, non string keys) is not cached.
+SYMPHONY_CONFIG_CACHE=0 disables the cache.
+'''
+
+import os
+import json
+import hashlib
+import threading
+import utils.symphony_logger as logger
+
+
+CONFIG_CACHE_DIR = os.path.expanduser("~/.symphony/config-cache")
+
+
+def get_config_cache_dir(env=None):
+    '''
+    Return the config cache dir, SYMPHONY_CONFIG_CACHE_DIR in env
+    (os.environ by default) or ~/.symphony/config-cache.
+    '''
+    if env is None:
+        env = os.environ
+    return env.get('SYMPHONY_CONFIG_CACHE_DIR', CONFIG_CACHE_DIR)
+
+
+def cache_enabled(env=None):
+    if env is None:
+        env = os.environ
+    return env.get('SYMPHONY_CONFIG_CACHE', "1") != "0"
+
+
+class ConfigCache(object):
+    '''
+    Memory and on disk cache of parsed config documents.
+    '''
+    # Serialized documents, shared by all the caches of the process.
+    documents = {}
+    lock = threading.Lock()
+    # The on disk entries are pruned once per process.
+    pruned = False
+
+    def __init__(self, cache_dir=None, slogger=None):
+        '''
+        :type cache_dir: string
+        :param cache_dir: Where the parsed documents are kept, defaults to
+                          get_config_cache_dir(). With False, only the
+                          process wide memory cache is used.
+        '''
+        if slogger is None:
+            self.slog = logger.Logger(name="ConfigCache")
+        else:
+            self.slog = slogger
+
+        if cache_dir is None:
+            cache_dir = get_config_cache_dir()
+        self.cache_dir = cache_dir or None
+        self.hits = 0
+        self.misses = 0
+
+    def get_entry_file(self, path):
+        '''
+        Return the path of the on disk entry for a config file.
+        '''
+        key = hashlib.sha1(
+            os.path.abspath(path).encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, key + ".json")
+
+    def load(self, path, content, loader):
+        '''
+        Return the parsed document of a config file, from the cache when
+        the content is unchanged, or by calling loader(content).
+
+        :type path: string
+        :param path: The config file path, None if it is not a file. A
+                     document without a path is only cached in memory.
+
+        :type content: string
+        :param content: The content of the config file
+        '''
+        if isinstance(content, bytes):
+            digest = hashlib.sha256(content).hexdigest()
+        else:
+            digest = hashlib.sha256(content.encode("utf-8")).hexdigest()
+        abspath = os.path.abspath(path) if path is not None else None
+        key = (abspath, digest)
+
+        with ConfigCache.lock:
+            serialized = ConfigCache.documents.get(key)
+        if serialized is None and abspath is not None and \
+                self.cache_dir is not None:
+            serialized = self.load_entry(abspath, digest)
+            if serialized is not None:
+                with ConfigCache.lock:
+                    ConfigCache.documents[key] = serialized
+
+        if serialized is not None:
+            self.hits += 1
+            return json.loads(serialized)
+
+        self.misses += 1
+        document = loader(content)
+        try:
+            serialized = json.dumps(document, separators=(",", ":"))
+        except (TypeError, ValueError):
+            return document
+        if json.loads(serialized) != document:
+            return document
+
+        with ConfigCache.lock:
+            if abspath is not None:
+                # The content changed, the older documents are stale.
+                for stale in [stale for stale in ConfigCache.documents
+                              if stale[0] == abspath]:
+                    del ConfigCache.documents[stale]
+            ConfigCache.documents[key] = serialized
+        if abspath is not None and self.cache_dir is not None:
+            self.store_entry(abspath, digest, serialized)
+            if not ConfigCache.pruned:
+                ConfigCache.pruned = True
+                self.prune()
+
+        return document
+
+    def load_entry(self, abspath, digest):
+        '''
+        Return the serialized document of the on disk entry, or None if
+        there is none for this content.
+        '''
+        try:
+            with open(self.get_entry_file(abspath), "r") as entry_fp:
+                entry = json.load(entry_fp)
+            if entry['path'] == abspath and entry['sha256'] == digest:
+                return entry['document']
+        except (IOError, OSError, ValueError, KeyError):
+            pass
+        return None
+
+    def store_entry(self, abspath, digest, serialized):
+        '''
+        Write an on disk entry. Failing to write the cache is not an
+        error.
+        '''
+        entry_file = self.get_entry_file(abspath)
+        entry = {'path': abspath,
+                 'sha256': digest,
+                 'document': serialized}
+        tmpfile = "%s.%d.tmp" % (entry_file, os.getpid())
+        try:
+            if not os.path.exists(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            with open(tmpfile, "w") as entry_fp:
+                json.dump(entry, entry_fp)
+            os.rename(tmpfile, entry_file)
+        except (IOError, OSError) as err:
+            self.slog.logger.error("Failed to write config cache [%s] [%s]",
+                                   entry_file, err)
+
+    def prune(self):
+        '''
+        Remove the on disk entries of config files that no longer exist.
+        '''
+        if self.cache_dir is None or not os.path.isdir(self.cache_dir):
+            return
+
+        for entry in os.listdir(self.cache_dir):
+            if not entry.endswith(".json"):
+                continue
+            entry_file = os.path.join(self.cache_dir, entry)
+            try:
+                with open(entry_file, "r") as entry_fp:
+                    abspath = json.load(entry_fp)['path']
+                if os.path.exists(abspath):
+                    continue
+            except (IOError, OSError, ValueError, KeyError, TypeError):
+                pass
+            try:
+                os.remove(entry_file)
+            except OSError:
+                pass
+
+    @classmethod
+    def clear_memory(cls):
+        with cls.lock:
+            cls.documents = {}
+            cls.pruned = False
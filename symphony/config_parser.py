@@ -5,19 +5,121 @@
 import os
 import yaml
 import utils.symphony_logger as logger
+import symphony.config_cache as config_cache
+import symphony.config_resolver as config_resolver
+
+
+# The libyaml safe loader is much faster, use it when pyyaml was built
+# with it.
+SafeLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+DEFAULTS = {
+    'region': "us-east-1",
+    'type': "aws",
+    'public_key_loc': ".ssh/symphonykey.pub",
+    'private_key_loc': ".ssh/symphonykey",
+    'credentials_file': "~/.aws/credentials",
+    'profile_name': "default",
+    'cluster_size': 1,
+    'instance_type': "t2.micro",
+    'name': "symphony-default-cluster",
+    'network_type': "private"
+}
+
+_ALL = config_resolver.ALL_LAYERS
+_CLUSTER = (config_resolver.CLUSTER,)
+
+# (normalized key, config key, layers it is read from). The environment
+# 'name' is the environment's own name, so it is not a cluster name.
+CONFIG_FIELDS = [
+    ('cluster_name', 'name', (config_resolver.CONFIG,
+                              config_resolver.DEFAULT)),
+    ('cloud_type', 'type', (config_resolver.ENVIRONMENT,
+                            config_resolver.DEFAULT)),
+    ('credentials_file', 'credentials_file', _ALL),
+    ('profile_name', 'profile_name', _ALL),
+    ('region', 'region', _ALL),
+    ('public_key_loc', 'public_key_loc', _ALL),
+    ('private_key_loc', 'private_key_loc', _ALL),
+    ('subnets', 'subnets', _ALL),
+    ('security_groups', 'security_groups', _ALL),
+    ('connection_info', 'connection_info', (config_resolver.CONFIG,))
+]
+
+CLUSTER_FIELDS = [
+    ('region', 'region', _ALL),
+    ('cluster_name', 'name', _CLUSTER),
+    ('cluster_size', 'cluster_size', _ALL),
+    ('instance_type', 'instance_type', _ALL),
+    ('network_type', 'network_type', _ALL),
+    ('public_key_loc', 'public_key_loc', _ALL),
+    ('private_key_loc', 'private_key_loc', _ALL),
+    ('vpc_id', 'vpc', _ALL),
+    ('cluster_template', 'cluster_template', _ALL),
+    ('tags', 'tags', _ALL),
+    ('amis', 'amis', _ALL),
+    ('subnets', 'subnets', _ALL),
+    ('security_groups', 'security_groups', _ALL),
+    ('connection_info', 'connection_info', (config_resolver.CLUSTER,
+                                            config_resolver.CONFIG)),
+    ('user_init_script', 'init_script', _CLUSTER),
+    ('services', 'services', _CLUSTER),
+    # Clusters that must be configured before this one.
+    ('depends_on', 'depends_on', _CLUSTER)
+]
+
+CLUSTER_ONLY_FIELDS = ['user_security_groups', 'loadbalancer']
+
+
+def load_yaml(content):
+    '''
+    Parse a YAML document, like yaml.safe_load.
+    '''
+    return yaml.load(content, Loader=SafeLoader)
 
 
 class ConfigParser(object):
-    def __init__(self):
+    def __init__(self, use_cache=True, env=None):
+        '''
+        :type use_cache: Boolean
+        :param use_cache: Keep the parsed documents in the config cache,
+                          unless SYMPHONY_CONFIG_CACHE=0.
+
+        :type env: dict
+        :param env: The environment with the config cache settings,
+                    os.environ by default
+        '''
         self.slog = logger.Logger(name="Helper")
+        self.cache = None
+        self.provenance = None
+        if use_cache and config_cache.cache_enabled(env):
+            self.cache = config_cache.ConfigCache(
+                cache_dir=config_cache.get_config_cache_dir(env),
+                slogger=self.slog)
         self.slog.logger.info("Symphony Config Parser: Initialized")
 
+    def load_document(self, config_file):
+        '''
+        Parse a YAML file object or string, through the cache.
+        '''
+        path = getattr(config_file, 'name', None)
+        if hasattr(config_file, 'read'):
+            content = config_file.read()
+        else:
+            content = config_file
+            path = None
+
+        if self.cache is None:
+            return load_yaml(content)
+        return self.cache.load(path, content, load_yaml)
+
     def parse_cluster_configuration(self, config_file):
         '''
         Parse the cluster configuration file.
         '''
         try:
-            parsed_data = yaml.safe_load(config_file)
+            parsed_data = self.load_document(config_file)
         except yaml.YAMLError as yamlerror:
             self.slog.logger.error("Failed to parse cluster config [%s] [%s]",
                                    config_file, yamlerror)
@@ -50,11 +152,13 @@ class ConfigParser(object):
             return None
 
         try:
-            parsed_data = yaml.safe_load(envfp)
+            parsed_data = self.load_document(envfp)
         except yaml.YAMLError as yamlerror:
             self.slog.logger.error("Failed to parse env config [%s] [%s]",
                                    envfile, yamlerror)
             return None
+        finally:
+            envfp.close()
 
         return parsed_data
 
@@ -72,139 +176,56 @@ class ConfigParser(object):
 
         Going from high to low, as to where a variable is defined:
 
-        1. Instance level variable
-        2. Cluster level variable
+        1. Cluster level variable
+        2. Config level variable
         3. Environment level variable
         4. Default. (applicable only in some cases)
 
-        To give an example. An environment file can define a 'vpc_id', however
-        if the same variable is defined under cluster config or instance,
+        To give an example. An environment file can define a 'vpc', however
+        if the same variable is defined under cluster config or cluster,
         then that will take precedence.
+
+        get_provenance() returns the layer each value came from.
         '''
         config_required_fields = ['private_key_loc',
                                   'public_key_loc',
                                   'credentials_file',
                                   'profile_name']
 
-        default = {}
-        default['region'] = "us-east-1"
-        default['cloud_type'] = "aws"
-        default['public_key_loc'] = ".ssh/symphonykey.pub"
-        default['private_key_loc'] = ".ssh/symphonykey"
-        default['credentials_file'] = "~/.aws/credentials"
-        default['profile_name'] = "default"
-        default['cluster_size'] = 1
-        default['instance_type'] = "t2.micro"
-        default['cluster_name'] = "symphony-default-cluster"
-        default['network_type'] = "private"
+        shared = config_resolver.LayeredConfig([
+            (config_resolver.CONFIG, parsed_config),
+            (config_resolver.ENVIRONMENT, parsed_env),
+            (config_resolver.DEFAULT, DEFAULTS)])
 
         data = {}
+        config_origins = {}
+        shared.resolve_fields(CONFIG_FIELDS, data, config_origins)
 
-        data['cluster_name'] = parsed_config.get(
-            'name', default['cluster_name'])
-
-        data['cloud_type'] = parsed_env.get('type',
-                                            default['cloud_type'])
-        data['credentials_file'] = \
-            parsed_config.get('credentials_file',
-                              default['credentials_file'])
-        data['profile_name'] = \
-            parsed_config.get('profile_name',
-                              default['profile_name'])
-        data['region'] = parsed_env.get(
-            'region', default['region'])
-
-        data['public_key_loc'] = \
-            parsed_config.get('public_key_loc',
-                              default['public_key_loc'])
-
-        data['private_key_loc'] = \
-            parsed_config.get('private_key_loc',
-                              default['private_key_loc'])
-
-        data['subnets'] = \
-            parsed_config.get('subnets',
-                              parsed_env.get('subnets',
-                                             None))
-        data['security_groups'] = \
-            parsed_config.get('subnets',
-                              parsed_env.get('security_groups',
-                                             None))
-
-        data['connection_info'] = parsed_config.get('connection_info')
-
+        # The fields of every cluster are resolved through the shared
+        # layers once, each cluster then only looks up its own fields.
         data['clusters'] = {}
-        for cluster in parsed_config['clusters'].keys():
-            data['clusters'][cluster] = {}
-            cobj = parsed_config['clusters'][cluster]
-
-            data['clusters'][cluster]['region'] = parsed_env.get(
-                'region',
-                default['region'])
-            data['clusters'][cluster]['cluster_name'] = \
-                cobj.get('name', cluster)
-            data['clusters'][cluster]['cluster_size'] = \
-                cobj.get('cluster_size', default['cluster_size'])
-            data['clusters'][cluster]['instance_type'] = \
-                cobj.get('instance_type', default['instance_type'])
-            data['clusters'][cluster]['network_type'] = \
-                cobj.get('network_type', default['network_type'])
-            data['clusters'][cluster]['public_key_loc'] = \
-                cobj.get('public_key_loc',
-                         parsed_config.get('public_key_loc',
-                                           default['public_key_loc']))
-
-            data['clusters'][cluster]['vpc_id'] = \
-                parsed_config.get('vpc',
-                                  parsed_env.get('vpc',
-                                                 None))
-
-            data['clusters'][cluster]['private_key_loc'] = \
-                cobj.get('private_key_loc',
-                         parsed_config.get('private_key_loc',
-                                           default['private_key_loc']))
-            data['clusters'][cluster]['cluster_template'] = \
-                cobj.get('cluster_template',
-                         parsed_config.get('cluster_template',
-                                           None))
-
-            data['clusters'][cluster]['tags'] = \
-                cobj.get('tags', parsed_config.get('tags', None))
-
-            data['clusters'][cluster]['amis'] = \
-                cobj.get('amis',
-                         parsed_config.get(
-                             'amis',
-                             parsed_env.get('amis', None)))
-
-            data['clusters'][cluster]['subnets'] = parsed_config.get(
-                'subnets',
-                parsed_env.get('subnets', None))
-
-            # parse and save preconfigured security groups and
-            # user provided security groups.
-            data['clusters'][cluster]['security_groups'] = \
-                parsed_config.get('security_groups',
-                                  parsed_env.get(
-                                      'security_groups', None))
-
-            # Check to see if user specific security group rules.
-            if cobj.get('user_security_groups', None) is not None:
-                user_sg_info = cobj.get('user_security_groups')
-                data['clusters'][cluster]['user_security_groups'] = \
-                    user_sg_info
-
-            # Check to see if loadbalancer config is specified.
-            if cobj.get('loadbalancer', None) is not None:
-                lb_info = cobj.get('loadbalancer')
-                data['clusters'][cluster]['loadbalancer'] = lb_info
-
-            data['clusters'][cluster]['user_init_script'] = \
-                cobj.get('init_script', None)
-
-            data['clusters'][cluster]['services'] = \
-                cobj.get('services',
-                         None)
+        resolver = config_resolver.LayerResolver(shared, CLUSTER_FIELDS,
+                                                 config_resolver.CLUSTER)
+        cluster_keys = {}
+        for cluster, cobj in parsed_config['clusters'].items():
+            cobj = cobj or {}
+            cluster_data, keys = resolver.resolve(cobj)
+
+            # The cluster name defaults to the cluster key.
+            if cluster_data['cluster_name'] is None:
+                cluster_data['cluster_name'] = cluster
+
+            # Only set when the cluster defines them: user specific
+            # security group rules, and the loadbalancer config.
+            for key in CLUSTER_ONLY_FIELDS:
+                if cobj.get(key, None) is not None:
+                    cluster_data[key] = cobj[key]
+                    keys += (key,)
+
+            data['clusters'][cluster] = cluster_data
+            cluster_keys[cluster] = keys
+
+        self.provenance = (config_origins, resolver, cluster_keys)
 
         # Validate normalized data.
         for item in config_required_fields:
@@ -214,3 +235,15 @@ class ConfigParser(object):
 
         return data
 
+    def get_provenance(self, key, cluster=None):
+        '''
+        Return the layer (cluster, config, environment or default) the
+        normalized value of a key came from, for the config or for a
+        cluster, as of the last normalize_parsed_configuration.
+        '''
+        if self.provenance is None:
+            return None
+        config_origins, resolver, cluster_keys = self.provenance
+        if cluster is None:
+            return config_origins.get(key)
+        return resolver.get_origin(key, cluster_keys[cluster])
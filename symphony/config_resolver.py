@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Config Resolver:
+----------------
+A setting can be given at several levels of the configuration, and the
+most specific one wins:
+
+    cluster > config > environment > default
+
+LayeredConfig looks a key up through named layers, highest precedence
+first, and returns the value with the name of the layer it came from.
+
+The upper layers (config, environment, defaults) are shared by all the
+clusters. LayerResolver resolves the fields through them once, so each
+cluster only costs a lookup of the fields in its own layer.
+'''
+
+import collections
+
+
+CLUSTER = "cluster"
+CONFIG = "config"
+ENVIRONMENT = "environment"
+DEFAULT = "default"
+
+ALL_LAYERS = (CLUSTER, CONFIG, ENVIRONMENT, DEFAULT)
+
+
+class LayeredConfig(object):
+    '''
+    Lookup of a key through named layers, highest precedence first.
+    '''
+    def __init__(self, layers):
+        '''
+        :type layers: list
+        :param layers: (name, mapping) pairs, highest precedence first. A
+                       None mapping is an empty layer.
+        '''
+        self.names = tuple([name for name, _ in layers])
+        self.chain = collections.ChainMap(
+            *[mapping if mapping is not None else {}
+              for _, mapping in layers])
+
+    def new_child(self, name, mapping):
+        '''
+        Return a LayeredConfig with a new highest precedence layer, that
+        shares the layers of this one.
+        '''
+        child = LayeredConfig.__new__(LayeredConfig)
+        child.names = (name,) + self.names
+        child.chain = self.chain.new_child(
+            mapping if mapping is not None else {})
+        return child
+
+    def resolve(self, key, layers=ALL_LAYERS, default=None):
+        '''
+        Return (value, layer name) for a key, looking only at the given
+        layers. A key set to None in a layer still wins over the lower
+        layers. Returns (default, DEFAULT) if no layer has the key.
+        '''
+        for name, mapping in zip(self.names, self.chain.maps):
+            if name in layers and key in mapping:
+                return mapping[key], name
+        return default, DEFAULT
+
+    def resolve_fields(self, fields, data, provenance):
+        '''
+        Resolve the fields into data, and record the layer each value came
+        from in provenance.
+
+        :type fields: list
+        :param fields: (normalized key, source key, layers) tuples
+        '''
+        for key, source, layers in fields:
+            data[key], provenance[key] = self.resolve(source, layers)
+
+
+class LayerResolver(object):
+    '''
+    Resolves fields for any number of mappings of one layer, put on top
+    of shared layers. Same result as shared.new_child(layer, mapping), but
+    the shared layers are only looked at once.
+    '''
+    def __init__(self, shared, fields, layer):
+        '''
+        :type shared: LayeredConfig
+        :param shared: The layers below this layer
+
+        :type fields: list
+        :param fields: (normalized key, source key, layers) tuples
+
+        :type layer: string
+        :param layer: The name of the layer of the mappings
+        '''
+        self.layer = layer
+        self.values = {}
+        self.origins = {}
+        shared.resolve_fields(fields, self.values, self.origins)
+        self.overrides = [(key, source) for key, source, layers in fields
+                          if layer in layers]
+
+    def resolve(self, mapping):
+        '''
+        Return (data, keys) for a mapping of the layer: the resolved
+        fields, and the tuple of the keys set by the mapping. The other
+        keys came from self.origins.
+        '''
+        data = dict(self.values)
+        keys = []
+        for key, source in self.overrides:
+            if source in mapping:
+                data[key] = mapping[source]
+                keys.append(key)
+
+        return data, tuple(keys)
+
+    def get_origin(self, key, keys):
+        '''
+        Return the layer a key came from, given the keys set by the
+        mapping.
+        '''
+        if key in keys:
+            return self.layer
+        return self.origins.get(key)
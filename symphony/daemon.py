@@ -0,0 +1,510 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Symphony Daemon:
+----------------
+Every symphony run pays for the interpreter startup, the imports, and
+parsing the configs, templates and terraform states again. The daemon is
+a long running symphony process that keeps them warm, and serves the
+build, list, summary and inventory operations over a Unix domain socket:
+
+    python -m symphony.symphony daemon [--socket PATH]
+
+The warm caches are the process wide ones:
+    - the parsed config documents (ConfigCache), keyed by the content
+      hash of the config files.
+    - the jinja2 template engines, which reload a template when its file
+      changes.
+    - the digested terraform states (TFStateCache), and the inventories,
+      used while the state file fingerprints are unchanged.
+
+The symphony CLI and the dynamic inventory send these operations to the
+daemon when one is listening, and run them in process otherwise. The
+socket is ~/.symphony/daemon.sock, or $SYMPHONY_DAEMON_SOCKET.
+SYMPHONY_DAEMON=0 makes the clients always run in process.
+
+The client sends a request as one JSON line:
+
+    {"operation": "list", "args": {"staging": ...}, "cwd": ...,
+     "env": {...}}
+
+and the daemon answers with JSON lines: {"output": ...} for what the
+operation prints, and {"log": ...} for what it logs at INFO and above, as
+they come, and a last {"exit": ..., "result": ...}. The client writes the
+logs to its stderr. The operations get the environment of the client,
+and their paths are relative to its working directory.
+
+The list, summary and inventory reads are served as they come, from the
+in memory caches. The build operation prints through sys.stdout, so the
+builds run one at a time, without holding up the reads.
+'''
+
+import os
+import sys
+import json
+import time
+import socket
+import logging
+import socketserver
+import threading
+import utils.symphony_logger as logger
+import utils.symphony_timer as symphony_timer
+import utils.lazy_import as lazy_import
+
+# Only the daemon runs the operations, the clients do not import these.
+helper = lazy_import.LazyModule("symphony.helper")
+tf_inventory = lazy_import.LazyModule("symphony.tf_inventory")
+config_cache = lazy_import.LazyModule("symphony.config_cache")
+renderer = lazy_import.LazyModule("symphony.renderer")
+tfstate_cache = lazy_import.LazyModule("symphony.tfstate_cache")
+tfparser = lazy_import.LazyModule("symphony.tfparser")
+
+
+DAEMON_SOCKET = os.path.expanduser("~/.symphony/daemon.sock")
+
+# The CLI operations run by the daemon.
+HELPER_OPERATIONS = ["build", "list", "summary"]
+# The operations that only read the states, served without the operation
+# lock.
+READ_OPERATIONS = ["list", "summary", "inventory"]
+# The operation arguments holding paths, relative to the client cwd.
+PATH_ARGS = ['staging', 'config', 'environment', 'template']
+
+
+def get_socket_path():
+    '''
+    Return the daemon socket path, SYMPHONY_DAEMON_SOCKET or
+    ~/.symphony/daemon.sock.
+    '''
+    return os.environ.get('SYMPHONY_DAEMON_SOCKET', DAEMON_SOCKET)
+
+
+def daemon_enabled():
+    return os.environ.get('SYMPHONY_DAEMON', "1") != "0"
+
+
+def send(wfile, message):
+    '''
+    Write a message as a JSON line.
+    '''
+    wfile.write((json.dumps(message) + "\n").encode("utf-8"))
+    wfile.flush()
+
+
+class OutputWriter(object):
+    '''
+    File like object, that sends what is written to the client.
+    '''
+    def __init__(self, wfile):
+        self.wfile = wfile
+
+    def write(self, data):
+        if data:
+            send(self.wfile, {'output': data})
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+class LogForwarder(logging.Handler):
+    '''
+    Logging handler, that sends the log records to the client. Requests
+    run concurrently, accept selects the records of this one.
+    '''
+    def __init__(self, wfile, accept):
+        super(LogForwarder, self).__init__(level=logging.INFO)
+        self.wfile = wfile
+        self.accept = accept
+        self.setFormatter(logging.Formatter(
+            '[%(asctime)s %(levelname)5s %(name)s]:  %(message)s',
+            datefmt="%m-%d-%y %H:%M"))
+
+    def emit(self, record):
+        if not self.accept(record):
+            return
+        try:
+            send(self.wfile, {'log': self.format(record) + "\n"})
+        except (IOError, OSError, ValueError):
+            # The client went away, the daemon log still has the record.
+            pass
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    '''
+    Reads a request, and hands it to the daemon.
+    '''
+    def handle(self):
+        daemon = self.server.symphony
+        try:
+            request = json.loads(self.rfile.readline().decode("utf-8"))
+            if not isinstance(request, dict):
+                raise ValueError("request is not an object")
+        except ValueError as err:
+            daemon.slog.logger.error("Invalid daemon request [%s]", err)
+            send(self.wfile, {'exit': 1, 'error': "Invalid request"})
+            return
+
+        try:
+            daemon.handle_request(request, self.wfile)
+        except (IOError, OSError) as err:
+            daemon.slog.logger.error("Daemon client went away [%s]", err)
+
+
+class SymphonyDaemon(object):
+    '''
+    The symphony daemon.
+    '''
+    def __init__(self, socket_path=None, slogger=None):
+        '''
+        :type socket_path: string
+        :param socket_path: The socket to listen on, defaults to
+                            get_socket_path()
+        '''
+        if slogger is None:
+            self.slog = logger.Logger(name="SymphonyDaemon")
+        else:
+            self.slog = slogger
+
+        self.socket_path = socket_path or get_socket_path()
+        self.server = None
+        self.started = None
+        self.requests = 0
+        # (state root, USE_PRIVATE_IP): (fingerprints, inventory)
+        self.inventories = {}
+        # Guards the request count and the inventories.
+        self.index_lock = threading.Lock()
+        # The helper operations print through sys.stdout, so they run one
+        # at a time.
+        self.lock = threading.Lock()
+        # The threads serving reads, their logs are not the operation's.
+        self.readers = set()
+
+    def start(self):
+        '''
+        Bind the socket. Returns False if another daemon is listening on
+        it.
+        '''
+        if is_running(self.socket_path):
+            self.slog.logger.error("A daemon is already running on [%s]",
+                                   self.socket_path)
+            return False
+
+        # A socket left by a daemon that did not exit cleanly.
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        socket_dir = os.path.dirname(os.path.abspath(self.socket_path))
+        if not os.path.exists(socket_dir):
+            os.makedirs(socket_dir)
+
+        self.server = socketserver.ThreadingUnixStreamServer(
+            self.socket_path, RequestHandler)
+        self.server.daemon_threads = True
+        self.server.symphony = self
+        self.started = time.time()
+        self.slog.logger.info("Symphony daemon listening on [%s]",
+                              self.socket_path)
+        return True
+
+    def serve_forever(self):
+        '''
+        Serve requests until stopped.
+        '''
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            self.slog.logger.info("Symphony daemon stopped")
+
+    def stop(self):
+        '''
+        Stop serving. Does not wait, so it can be called by a request.
+        '''
+        threading.Thread(target=self.server.shutdown).start()
+
+    def handle_request(self, request, wfile):
+        '''
+        Run a request, and send its output and exit code to wfile.
+        '''
+        operation = request.get('operation')
+        args = request.get('args') or {}
+        self.slog.logger.info("Daemon request: %s %s", operation, args)
+
+        if operation == "status":
+            send(wfile, {'exit': 0, 'result': self.get_status()})
+            return
+        if operation == "stop":
+            send(wfile, {'exit': 0, 'result': None})
+            self.stop()
+            return
+        if operation not in HELPER_OPERATIONS and operation != "inventory":
+            send(wfile, {'exit': 1,
+                         'error': "Unknown operation %s" % operation})
+            return
+
+        with self.index_lock:
+            self.requests += 1
+        cwd = request.get('cwd') or os.getcwd()
+        env = request.get('env')
+        if env is None:
+            env = dict(os.environ)
+        args = dict(args)
+        for key in PATH_ARGS:
+            if args.get(key):
+                args[key] = os.path.join(cwd, args[key])
+
+        result = None
+        root_logger = logging.getLogger()
+        # --timings uses the process wide timer, like the helper operations.
+        if operation in READ_OPERATIONS and not args.get('timings'):
+            thread = threading.get_ident()
+            forwarder = LogForwarder(
+                wfile, lambda record: record.thread == thread)
+            root_logger.addHandler(forwarder)
+            self.readers.add(thread)
+            try:
+                ret, result = self.run_read(operation, args, cwd, env,
+                                            OutputWriter(wfile))
+            except Exception as err:
+                # A failed operation must not take the daemon down.
+                self.slog.logger.exception("Daemon %s failed [%s]",
+                                           operation, err)
+                ret = 1
+            finally:
+                self.readers.discard(thread)
+                root_logger.removeHandler(forwarder)
+            send(wfile, {'exit': ret, 'result': result})
+            return
+
+        with self.lock:
+            stdout = sys.stdout
+            forwarder = LogForwarder(
+                wfile, lambda record: record.thread not in self.readers)
+            root_logger.addHandler(forwarder)
+            try:
+                sys.stdout = OutputWriter(wfile)
+                ret = self.run_helper(operation, args, env)
+            except Exception as err:
+                self.slog.logger.exception("Daemon %s failed [%s]",
+                                           operation, err)
+                ret = 1
+            finally:
+                sys.stdout = stdout
+                root_logger.removeHandler(forwarder)
+
+        send(wfile, {'exit': ret, 'result': result})
+
+    def run_read(self, operation, args, cwd, env, out):
+        '''
+        Run a list, summary or inventory read, writing its output to out.
+        Returns (exit code, result).
+        '''
+        if operation == "inventory":
+            return 0, self.get_inventory(args, cwd, env)
+
+        if not args.get('staging'):
+            self.slog.logger.error("Missing attribute staging")
+            return 1, None
+        streaming = tfparser.streaming_enabled(env)
+        if operation == "list":
+            tags = [tfparser.parse_tag(tag)
+                    for tag in args.get('list_tags') or []]
+            tfparser.write_environments(
+                args['staging'],
+                list_format=args.get('list_format') or "table",
+                environments=args.get('list_envs'),
+                types=args.get('list_types'),
+                tags=tags,
+                streaming=streaming,
+                out=out,
+                slogger=self.slog)
+        else:
+            tfparser.write_summary(args['staging'], streaming=streaming,
+                                   out=out, slogger=self.slog)
+        return 0, None
+
+    def run_helper(self, operation, args, env):
+        '''
+        Run a CLI operation with the helper, in the environment env.
+        Returns the exit code.
+        '''
+        operobj = dict(args)
+        operobj['operation'] = operation
+        operobj['env'] = env
+        config_fp = None
+        if 'config' in operobj:
+            config_fp = open(operobj['config'], "r")
+            operobj['config'] = config_fp
+
+        try:
+            helperobj = helper.Helper(operobj)
+            if not helperobj.valid:
+                print("Helper Initialization Failed.")
+                return 1
+            return helperobj.perform_operation()
+        finally:
+            if config_fp is not None:
+                config_fp.close()
+            # --timings enables the process wide timer, the next request
+            # starts with a clean one.
+            timer = symphony_timer.get_timer()
+            timer.disable()
+            timer.reset()
+
+    def get_inventory(self, args, cwd, env):
+        '''
+        Return the inventory of a state root, kept in memory while the
+        state files are unchanged.
+        '''
+        tf_root = os.path.normpath(args.get('staging') or cwd)
+        priv_ip_flag = args.get('priv_ip_flag', "True")
+        cache = tf_inventory.InventoryCache(tf_root, priv_ip_flag,
+                                            slogger=self.slog)
+        fingerprints = cache.get_fingerprints()
+        key = (tf_root, priv_ip_flag)
+        with self.index_lock:
+            entry = self.inventories.get(key)
+        if entry is not None and entry[0] == fingerprints:
+            return entry[1]
+
+        inventory = tf_inventory.get_inventory(tf_root=tf_root,
+                                               priv_ip_flag=priv_ip_flag,
+                                               env=env)
+        with self.index_lock:
+            self.inventories[key] = (fingerprints, inventory)
+        return inventory
+
+    def get_status(self):
+        '''
+        Return the daemon status, and the size of its caches.
+        '''
+        return {
+            'pid': os.getpid(),
+            'socket': self.socket_path,
+            'uptime': time.time() - self.started,
+            'requests': self.requests,
+            'config_documents': len(config_cache.ConfigCache.documents),
+            'template_engines': len(renderer._engines),
+            'tfstates': len(tfstate_cache.TFStateCache.states),
+            'inventories': len(self.inventories)
+        }
+
+
+def is_running(socket_path=None):
+    '''
+    Return True if a daemon is listening on the socket.
+    '''
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path or get_socket_path())
+        return True
+    except (IOError, OSError):
+        return False
+    finally:
+        sock.close()
+
+
+def call(operation, args=None, socket_path=None, output=None,
+         errors=None, env=None):
+    '''
+    Send a request to the daemon. What the operation prints is written to
+    output (sys.stdout by default), and what it logs to errors
+    (sys.stderr by default), as it comes. The operation runs with env,
+    os.environ by default.
+
+    Returns (exit code, result), or None if no daemon is listening.
+    '''
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path or get_socket_path())
+    except (IOError, OSError):
+        sock.close()
+        return None
+
+    if output is None:
+        output = sys.stdout
+    if errors is None:
+        errors = sys.stderr
+    if env is None:
+        env = dict(os.environ)
+    request = {'operation': operation,
+               'args': args or {},
+               'cwd': os.getcwd(),
+               'env': env}
+    try:
+        sock.sendall((json.dumps(request) + "\n").encode("utf-8"))
+        with sock.makefile("rb") as rfile:
+            for line in rfile:
+                message = json.loads(line.decode("utf-8"))
+                if 'output' in message:
+                    output.write(message['output'])
+                    output.flush()
+                elif 'log' in message:
+                    errors.write(message['log'])
+                    errors.flush()
+                elif 'exit' in message:
+                    if message.get('error'):
+                        output.write("Symphony daemon: %s\n" %
+                                     message['error'])
+                    return message['exit'], message.get('result')
+    except (IOError, OSError, ValueError) as err:
+        output.write("Symphony daemon: %s\n" % err)
+    finally:
+        sock.close()
+
+    # The daemon went away before the end of the operation.
+    return 1, None
+
+
+def run_operation(operobj, socket_path=None):
+    '''
+    Run a CLI operation on the daemon. Returns the exit code, or None if
+    the daemon does not serve the operation or is not running.
+    '''
+    operation = operobj['operation']
+    if operation not in HELPER_OPERATIONS or not daemon_enabled():
+        return None
+
+    args = {}
+    for key, value in operobj.items():
+        if key == 'operation':
+            continue
+        if key == 'config':
+            # The open config file, the daemon opens it again.
+            value = os.path.abspath(value.name)
+        args[key] = value
+
+    reply = call(operation, args, socket_path=socket_path)
+    if reply is None:
+        return None
+    return reply[0]
+
+
+def run_daemon(operobj):
+    '''
+    The daemon CLI operation: serve, or stop or query the running daemon.
+    Returns the exit code.
+    '''
+    socket_path = operobj.get('socket') or get_socket_path()
+    if operobj.get('stop') or operobj.get('status'):
+        operation = "stop" if operobj.get('stop') else "status"
+        reply = call(operation, socket_path=socket_path)
+        if reply is None:
+            print("No symphony daemon running on %s" % socket_path)
+            return 1
+        if reply[1] is not None:
+            print(json.dumps(reply[1], indent=2, sort_keys=True))
+        return reply[0]
+
+    daemon = SymphonyDaemon(socket_path=socket_path)
+    if not daemon.start():
+        return 1
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+    return 0
@@ -11,15 +11,33 @@ build, deploy, configure operations for symphony.
 
 import sys
 import os
-import time
+import shutil
 import subprocess
-import socket
 import json
-import paramiko
-import jinja2
 import utils.symphony_logger as logger
-import main.config_parser as config_parser
-import main.tfparser as tfparser
+import utils.symphony_timer as symphony_timer
+import utils.lazy_import as lazy_import
+
+# Each operation only uses some of these, and they pull in yaml, jinja2,
+# prettytable and asyncio. They are imported on first use, so an
+# operation does not pay for the modules of the others.
+futures = lazy_import.LazyModule("concurrent.futures")
+config_parser = lazy_import.LazyModule("symphony.config_parser")
+renderer = lazy_import.LazyModule("symphony.renderer")
+manifest = lazy_import.LazyModule("symphony.manifest")
+ssh_probe = lazy_import.LazyModule("symphony.ssh_probe")
+scheduler = lazy_import.LazyModule("symphony.scheduler")
+tfparser = lazy_import.LazyModule("symphony.tfparser")
+tf_inventory = lazy_import.LazyModule("symphony.tf_inventory")
+multi_deploy = lazy_import.LazyModule("symphony.multi_deploy")
+terraform = lazy_import.LazyModule("symphony.terraform")
+command = lazy_import.LazyModule("symphony.command")
+tf_events = lazy_import.LazyModule("symphony.tf_events")
+ansible_config = lazy_import.LazyModule("symphony.ansible_config")
+
+# The dynamic inventory, run by ansible-playbook as a script.
+TF_DYNAMIC_INVENTORY = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "tf_inventory.py")
 
 
 class Helper(object):
@@ -46,10 +64,34 @@ class Helper(object):
         self.template_path = None
         self.normalized_data = None
         self.operation = operobj['operation']
+        self.jobs = operobj.get('jobs', 1)
+        self.incremental = operobj.get('incremental', False)
+        self.manifest = None
+        self.build_summary = None
+        self.ssh_concurrency = operobj.get('ssh_concurrency', 20)
+        self.batch = operobj.get('batch', False)
+        self.ssh_report = None
+        self.ansible_cfg = None
+        self.deploy_all = operobj.get('all', False)
+        self.plugin_mirror = operobj.get('plugin_mirror', None)
+        self.targeted = operobj.get('targeted', False)
+        self.auto_approve = operobj.get('auto_approve', False)
+        self.json_events = operobj.get('json_events', False)
+        self.timings = operobj.get('timings', False)
+        self.list_format = operobj.get('list_format') or "table"
+        self.list_envs = operobj.get('list_envs')
+        self.list_types = operobj.get('list_types')
+        self.list_tags = operobj.get('list_tags')
+        # The environment of the operation, the client's one when run by
+        # the daemon.
+        self.env = operobj.get('env') or os.environ
+        if self.timings:
+            symphony_timer.enable()
 
         self.slog = logger.Logger(name="Helper")
-        self.cfgparser = config_parser.ConfigParser()
-        self.valid = self.__populate_params(operobj)
+        self.cfgparser = None
+        with symphony_timer.span("setup"):
+            self.valid = self.__populate_params(operobj)
         self.slog.logger.info("Symphony Helper: Initialized")
 
     def __populate_params(self, operobj):
@@ -61,7 +103,8 @@ class Helper(object):
             'configure': ['config', 'environment', 'staging'],
             'deploy': ['staging'],
             'destroy': ['staging'],
-            'list': ['staging']
+            'list': ['staging'],
+            'summary': ['staging']
         }
         operation = operobj['operation']
         for key in required_params[operation]:
@@ -79,11 +122,13 @@ class Helper(object):
 
             elif key == 'config':
                 self.cluster_config = operobj[key]
+                self.cfgparser = config_parser.ConfigParser(env=self.env)
                 # Parse the cluster config.
-                self.parsed_config = \
-                    self.cfgparser.parse_cluster_configuration(
-                        self.cluster_config)
-                print "Parsed config: ", self.parsed_config
+                with symphony_timer.span("parse_config"):
+                    self.parsed_config = \
+                        self.cfgparser.parse_cluster_configuration(
+                            self.cluster_config)
+                print("Parsed config: ", self.parsed_config)
                 if self.parsed_config is None:
                     self.slog.logger.error("Failed to parse [%s]",
                                            self.cluster_config)
@@ -100,9 +145,10 @@ class Helper(object):
                     self.slog.logger.error(
                         "Parsed config does not have `environment` key")
                     return False
-                self.parsed_env = \
-                    self.cfgparser.parse_environment_configuration(
-                        self.env_path, env_name)
+                with symphony_timer.span("parse_environment"):
+                    self.parsed_env = \
+                        self.cfgparser.parse_environment_configuration(
+                            self.env_path, env_name)
                 if self.parsed_env is None:
                     self.slog.logger.error("Failed to parse [%s]",
                                            self.env_path)
@@ -122,20 +168,54 @@ class Helper(object):
 
     def perform_operation(self):
         '''
-        Perform the build, deploy, configure, destroy or list operation.
+        Perform the build, deploy, configure, destroy, list or summary
+        operation.
+        With timings, the time spent in each phase is shown at the end and
+        written to a report under the staging directory.
         '''
         if self.operation is None:
             self.slog.logger.error("Operation not set. Cannot perform task")
             return 1
 
+        with symphony_timer.span(self.operation):
+            ret = self.run_operation()
+
+        if self.timings:
+            self.report_timings()
+
+        return ret
+
+    def report_timings(self):
+        '''
+        Print the timing tree of the run, and write it as a JSON report.
+        '''
+        timer = symphony_timer.get_timer()
+        print("")
+        for line in timer.format_tree():
+            print(line)
+
+        if self.tf_staging is None or not os.path.isdir(self.tf_staging):
+            return
+        report_file = symphony_timer.get_report_file(self.tf_staging,
+                                                     self.operation)
+        timer.write_report(report_file,
+                           operation=self.operation,
+                           argv=sys.argv)
+        print("Timings report: %s" % report_file)
+
+    def run_operation(self):
+        '''
+        Run the operation, returns the exit code.
+        '''
         if self.operation == "build":
             # Build Operation.
 
             # Normalize our parsed configuration.
-            self.normalized_data = \
-                self.cfgparser.normalize_parsed_configuration(
-                    self.parsed_config, self.parsed_env)
-            print "Build operation"
+            with symphony_timer.span("normalize"):
+                self.normalized_data = \
+                    self.cfgparser.normalize_parsed_configuration(
+                        self.parsed_config, self.parsed_env)
+            print("Build operation")
             if not os.path.exists(self.template_path) or \
                     not os.path.isdir(self.template_path):
                 self.slog.logger.error("Invalid path to templates [%s]",
@@ -147,47 +227,229 @@ class Helper(object):
             if ret != 0:
                 return ret
 
+            # With an incremental build, clusters whose inputs have not
+            # changed since the last build are skipped.
+            if self.incremental:
+                self.manifest = manifest.BuildManifest(
+                    self.tf_cluster_staging, slogger=self.slog)
+
             # Render the common template.
-            self.render_symphony_template("common",
-                                          "common",
-                                          self.tf_cluster_staging,
-                                          self.normalized_data)
+            try:
+                with symphony_timer.span("build_common"):
+                    rendered = self.build_common(self.tf_cluster_staging,
+                                                 self.normalized_data)
+            except IOError as err:
+                self.slog.logger.error("Common build failed [%s]", err)
+                return 1
 
             # Render templates for cluster specific.
-            for cluster in self.normalized_data['clusters'].keys():
-                obj = self.normalized_data['clusters'][cluster]
-                templatename = obj['cluster_template']
-                tf_filename = obj['cluster_name']
-                obj['init_script'] = "./scripts/%s.sh" % tf_filename
-                self.render_symphony_template(templatename,
-                                              tf_filename,
-                                              self.tf_cluster_staging,
-                                              obj)
-
-                # Now that we have taken care of rendering the template,
-                # check if user has provided init script and set that as well.
-                self.generate_init_script(tf_filename,
-                                          self.tf_cluster_staging,
-                                          obj['user_init_script'])
+            with symphony_timer.span("build_clusters", jobs=self.jobs):
+                errors = self.build_cluster_templates(
+                    self.tf_cluster_staging,
+                    self.normalized_data,
+                    jobs=self.jobs)
+            if rendered:
+                self.build_summary['rebuilt'] += 1
+            else:
+                self.build_summary['skipped'] += 1
+            print("Build: %d rebuilt, %d skipped, %d failed" %
+                (self.build_summary['rebuilt'],
+                 self.build_summary['skipped'],
+                 len(errors)))
+
+            if self.manifest is not None:
+                names = ["common"] + list(self.normalized_data['clusters'])
+                with symphony_timer.span("save_manifest"):
+                    self.manifest.save(names=names)
+            engine = renderer.get_template_engine(
+                os.path.join(self.template_path,
+                             self.normalized_data['cloud_type']),
+                cache_dir=self.get_template_cache_dir())
+            self.slog.logger.info("Template cache: %s", engine.stats())
+            if errors:
+                return 1
         elif self.operation == "deploy":
-            print "Deploy operation"
-            self.deploy_terraform_environment(self.tf_staging)
+            print("Deploy operation")
+            if self.deploy_all:
+                return self.deploy_all_environments(self.tf_staging)
+            return self.deploy_terraform_environment(self.tf_staging)
         elif self.operation == "configure":
-            print "Configure operation"
-            self.normalized_data = \
-                self.cfgparser.normalize_parsed_configuration(
-                    self.parsed_config, self.parsed_env)
-            self.configure_terraform_environment(self.tf_staging)
+            print("Configure operation")
+            with symphony_timer.span("normalize"):
+                self.normalized_data = \
+                    self.cfgparser.normalize_parsed_configuration(
+                        self.parsed_config, self.parsed_env)
+            return self.configure_terraform_environment(self.tf_staging)
         elif self.operation == "destroy":
-            print "Destroy operation"
+            print("Destroy operation")
             self.destroy_terraform_environment(self.tf_staging)
         elif self.operation == "list":
             self.display_terraform_environment(self.tf_staging)
+        elif self.operation == "summary":
+            self.display_terraform_summary(self.tf_staging)
+
+        return 0
+
+    def build_cluster_templates(self,
+                                tf_cluster_staging,
+                                normalized_data,
+                                jobs=1):
+        '''
+        Render the terraform template and init script for every cluster.
+
+        Clusters are independent of each other, so with jobs > 1 they are
+        rendered concurrently by a pool of at most `jobs` workers. A failure
+        in one cluster does not stop the others. Returns a dictionary of
+        cluster name to error, which is empty when all clusters rendered.
+        '''
+        clusters = sorted(normalized_data['clusters'].keys())
+        errors = {}
+        rebuilt = {}
+
+        if jobs is None or jobs <= 1:
+            for cluster in clusters:
+                try:
+                    rebuilt[cluster] = self.build_cluster(
+                        cluster,
+                        tf_cluster_staging,
+                        normalized_data['clusters'][cluster])
+                except Exception as err:
+                    errors[cluster] = err
+        else:
+            with futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+                pending = {}
+                for cluster in clusters:
+                    pending[cluster] = executor.submit(
+                        self.build_cluster,
+                        cluster,
+                        tf_cluster_staging,
+                        normalized_data['clusters'][cluster])
+
+            for cluster in clusters:
+                err = pending[cluster].exception()
+                if err is not None:
+                    errors[cluster] = err
+                else:
+                    rebuilt[cluster] = pending[cluster].result()
+
+        # Report in cluster order, so the output does not depend on
+        # which worker finished first.
+        for cluster in clusters:
+            if cluster in errors:
+                self.slog.logger.error("Cluster [%s] build failed [%s]",
+                                       cluster, errors[cluster])
+            elif rebuilt[cluster]:
+                self.slog.logger.info("Cluster [%s] build done", cluster)
+            else:
+                self.slog.logger.info("Cluster [%s] unchanged, skipped",
+                                      cluster)
+
+        self.build_summary = {
+            'rebuilt': len([x for x in rebuilt.values() if x]),
+            'skipped': len([x for x in rebuilt.values() if not x])
+        }
+        self.slog.logger.info("Build: %d clusters, %d rebuilt, %d skipped, "
+                              "%d failed", len(clusters),
+                              self.build_summary['rebuilt'],
+                              self.build_summary['skipped'], len(errors))
+        return errors
+
+    def build_common(self, tf_cluster_staging, normalized_data):
+        '''
+        Render the common template. Returns True if it was rendered, and
+        False if an incremental build found it unchanged. Raises IOError if
+        the render failed.
+        '''
+        digest = None
+        if self.manifest is not None:
+            template_file = self.get_template_file("common")
+            if os.path.exists(template_file):
+                digest = self.manifest.compute_digest(normalized_data,
+                                                      template_file,
+                                                      None)
+                outputs = [os.path.join(tf_cluster_staging, "common.tf")]
+                if self.manifest.is_current("common", digest, outputs):
+                    return False
+
+        ret = self.render_symphony_template("common",
+                                            "common",
+                                            tf_cluster_staging,
+                                            normalized_data)
+        if ret == 1:
+            raise IOError("Failed to render the common template")
+        if digest is not None:
+            self.manifest.update("common", digest)
+
+        return True
+
+    def build_cluster(self, cluster, tf_cluster_staging, cluster_obj):
+        '''
+        Render the terraform template and init script for a single cluster.
+        Returns True if the cluster was rendered, and False if an
+        incremental build found it unchanged.
+        '''
+        with symphony_timer.span("build_cluster", cluster=cluster):
+            return self.__build_cluster(cluster, tf_cluster_staging,
+                                        cluster_obj)
+
+    def __build_cluster(self, cluster, tf_cluster_staging, cluster_obj):
+        templatename = cluster_obj['cluster_template']
+        tf_filename = cluster_obj['cluster_name']
+        cluster_obj['init_script'] = "./scripts/%s.sh" % tf_filename
+        with symphony_timer.span("read_init_script"):
+            script_data = self.get_init_script_data(
+                cluster_obj['user_init_script'])
+
+        digest = None
+        if self.manifest is not None:
+            template_file = self.get_template_file(templatename)
+            if os.path.exists(template_file):
+                with symphony_timer.span("manifest_digest"):
+                    digest = self.manifest.compute_digest(cluster_obj,
+                                                          template_file,
+                                                          script_data)
+                outputs = [
+                    os.path.join(tf_cluster_staging, tf_filename + ".tf"),
+                    os.path.join(tf_cluster_staging, "scripts",
+                                 tf_filename + ".sh")]
+                if self.manifest.is_current(cluster, digest, outputs):
+                    return False
+
+        with symphony_timer.span("render", template=templatename):
+            ret = self.render_symphony_template(templatename,
+                                                tf_filename,
+                                                tf_cluster_staging,
+                                                cluster_obj)
+        if ret == 1:
+            raise IOError("Failed to render template [%s] for cluster [%s]" %
+                          (templatename, cluster))
+
+        # Now that we have taken care of rendering the template,
+        # check if user has provided init script and set that as well.
+        with symphony_timer.span("init_script"):
+            self.generate_init_script(tf_filename,
+                                      tf_cluster_staging,
+                                      cluster_obj['user_init_script'],
+                                      script_data=script_data)
+
+        if digest is not None:
+            self.manifest.update(cluster, digest)
+
+        return True
+
+    def get_template_file(self, template_name):
+        '''
+        Return the path to a template for the configured cloud type.
+        '''
+        return os.path.join(self.template_path,
+                            self.normalized_data['cloud_type'],
+                            template_name) + ".j2"
 
     def generate_init_script(self,
                              tf_filename,
                              tf_cluster_staging,
-                             user_init_script):
+                             user_init_script,
+                             script_data=None):
         '''
         Generate the init script.
         '''
@@ -200,6 +462,16 @@ class Helper(object):
                                    scripts_dir)
             os.mkdir(scripts_dir)
 
+        if script_data is None:
+            script_data = self.get_init_script_data(user_init_script)
+
+        manifest.write_if_changed(scripts_file, script_data)
+
+    def get_init_script_data(self, user_init_script):
+        '''
+        Return the init script content: our common.sh followed by the
+        user provided init script.
+        '''
         # Read our common.sh script.
         filep = open("./scripts/common.sh", "r")
         common_data = filep.read()
@@ -217,12 +489,9 @@ class Helper(object):
                 for line in userdata.splitlines():
                     if line.startswith("#!"):
                         continue
-                    filep.close()
                     common_data += "\n" + line
 
-        filep = open(scripts_file, "w")
-        filep.write(common_data)
-        filep.close()
+        return common_data
 
     def render_symphony_template(self,
                                  template_name,
@@ -250,29 +519,35 @@ class Helper(object):
                                                     template_path,
                                                     normalized_data)
 
-        print "Rendered data: \n", rendered_data
+        self.slog.logger.debug("Rendered data: \n%s", rendered_data)
 
         tf_filename = tf_filename + ".tf"
 
         tf_filepath = os.path.join(staging_dir, tf_filename)
-        tf_fp = open(tf_filepath, "w")
-        tf_fp.write(rendered_data)
-        tf_fp.close()
+        manifest.write_if_changed(tf_filepath, rendered_data)
 
     def render_jinja2_template(self, templatefile, searchpath, obj):
         '''
-        Render a jinja2 template and return the rendered string
+        Render a jinja2 template and return the rendered string.
+
+        The jinja2 environment for the search path is shared across all
+        the clusters, and compiled templates are cached under the staging
+        directory, so repeat builds skip template compilation.
         '''
-        rendered_data = None
-        template_loader = jinja2.FileSystemLoader(searchpath=searchpath)
-        env = jinja2.Environment(loader=template_loader,
-                                 trim_blocks=False,
-                                 lstrip_blocks=False)
-        template = env.get_template(templatefile)
-        rendered_data = template.render(obj)
+        engine = renderer.get_template_engine(
+            searchpath, cache_dir=self.get_template_cache_dir())
+        rendered_data = engine.render(templatefile, obj)
 
         return rendered_data
 
+    def get_template_cache_dir(self):
+        '''
+        Return the path for the template bytecode cache.
+        '''
+        if self.tf_staging is None:
+            return None
+        return os.path.join(self.tf_staging, ".symphony", "jinja2")
+
     def build_cluster_staging_directory(self, userenv_dir):
         '''
         Create a new terraform staging folder. Generate a terraform
@@ -312,7 +587,13 @@ class Helper(object):
 
     def deploy_terraform_environment(self, cluster_staging_dir):
         '''
-        Deploy the terraform environment
+        Deploy the terraform environment. The plan is saved to a plan
+        file, and apply applies that exact plan, once confirmed, or right
+        away with auto_approve. With targeted, only the resources of
+        the .tf files changed since the last successful apply are planned.
+        With json_events, terraform writes its JSON event stream, and the
+        resource timings are shown and written to tf_events.REPORT_FILE.
+        Returns the exit code.
         '''
         self.slog.logger.info("Cluster Staging Dir: %s",
                               cluster_staging_dir)
@@ -320,35 +601,111 @@ class Helper(object):
         if not os.path.exists(cluster_staging_dir):
             self.slog.logger.error("Staging Dir %s does not exist",
                                    cluster_staging_dir)
-            return
+            return 1
 
-        # Terraform plan
-        tf_plan_cmd = ["terraform", "plan"]
-        sproc = subprocess.Popen(tf_plan_cmd,
-                                 cwd=cluster_staging_dir,
-                                 stdout=subprocess.PIPE)
+        tfobj = terraform.Terraform(cluster_staging_dir, slogger=self.slog)
+        sinks = [command.ConsoleSink()]
+        if self.json_events:
+            events = tf_events.EventSink(console=sinks[0])
+            sinks = [events]
 
-        while True:
-            nextline = sproc.stdout.readline()
-            if nextline == "" and sproc.poll() is not None:
-                break
+        targets = None
+        if self.targeted:
+            with symphony_timer.span("find_targets"):
+                targets = terraform.find_changed_targets(cluster_staging_dir)
+            self.slog.logger.info("Targets: %s",
+                                  targets if targets else "all resources")
 
-            sys.stdout.write(nextline)
-            sys.stdout.flush()
+        # Terraform plan
+        with symphony_timer.span("terraform_plan"):
+            ret, _, _ = tfobj.terraform_plan(cluster_staging_dir,
+                                             plan_file=terraform.PLAN_FILE,
+                                             targets=targets,
+                                             json_events=self.json_events,
+                                             sinks=sinks)
+        if ret == 0 and not self.auto_approve and \
+                not self.confirm_apply():
+            terraform.remove_file(os.path.join(cluster_staging_dir,
+                                               terraform.PLAN_FILE))
+            ret = 1
 
         # Terraform apply.
-        tf_apply_cmd = ["terraform", "apply"]
-        sproc = subprocess.Popen(tf_apply_cmd,
-                                 cwd=cluster_staging_dir,
-                                 stdout=subprocess.PIPE)
+        if ret == 0:
+            with symphony_timer.span("terraform_apply"):
+                ret, _, _ = tfobj.terraform_apply(
+                    cluster_staging_dir,
+                    plan_file=terraform.PLAN_FILE,
+                    json_events=self.json_events,
+                    sinks=sinks)
+
+        if self.json_events:
+            report_file = os.path.join(cluster_staging_dir,
+                                       tf_events.REPORT_FILE)
+            events.timings.write_report(report_file)
+            for line in events.timings.summary():
+                print(line)
+            print("Report: %s" % report_file)
+
+        return ret
+
+    def confirm_apply(self):
+        '''
+        Ask for confirmation before applying the plan shown.
+        '''
+        confirm_msg = "Do you want to apply this plan?\n"
+        confirm_msg_fmt = logger.stringc(confirm_msg, "bold")
 
-        while True:
-            nextline = sproc.stdout.readline()
-            if nextline == "" and sproc.poll() is not None:
-                break
+        confirm_msg_fmt += "   Terraform will perform the actions" \
+            " described above.\n" \
+            "   Only 'yes' will be accepted to approve.\n"
+        print(confirm_msg_fmt)
 
-            sys.stdout.write(nextline)
-            sys.stdout.flush()
+        try:
+            option = input("Enter a value:")
+        except EOFError:
+            option = ""
+        if option != "yes":
+            print("Apply cancelled")
+            return False
+        return True
+
+    def deploy_all_environments(self, staging_root):
+        '''
+        Deploy every environment under the staging root, with at most
+        self.jobs environments deployed concurrently. The plans are
+        applied without confirmation, so this needs auto_approve. Returns
+        1 if any environment failed.
+        '''
+        self.slog.logger.info("Staging root: %s", staging_root)
+        if not self.auto_approve:
+            self.slog.logger.error("deploy --all applies the plans without "
+                                   "confirmation, use --auto-approve")
+            return 1
+        if not os.path.isdir(staging_root):
+            self.slog.logger.error("Staging Dir %s does not exist",
+                                   staging_root)
+            return 1
+
+        init_options = {}
+        if self.plugin_mirror is not None:
+            init_options['plugin_mirror'] = self.plugin_mirror
+        deployer = multi_deploy.MultiDeploy(staging_root,
+                                            jobs=self.jobs,
+                                            init_options=init_options,
+                                            targeted=self.targeted,
+                                            json_events=self.json_events,
+                                            slogger=self.slog)
+        results = deployer.run()
+        if not results:
+            return 1
+
+        for line in multi_deploy.format_deploy_summary(results):
+            print(line)
+
+        failed = [env for env in results if results[env]['status'] != "ok"]
+        if failed:
+            return 1
+        return 0
 
     def destroy_terraform_environment(self, cluster_staging_dir):
         '''
@@ -369,18 +726,19 @@ class Helper(object):
         confirm_msg_fmt += "   Terraform will delete all your" \
             " mapped infrastructure.\n" \
             "   There is no undo. Only 'yes' will be accepted to confirm.\n"
-        print confirm_msg_fmt
+        print(confirm_msg_fmt)
 
-        option = raw_input("Enter a value:")
+        option = input("Enter a value:")
         if option != "yes":
-            print "Only \"yes\" will delete"
+            print("Only \"yes\" will delete")
             return
 
         # Terraform destroy
         tf_destroy_cmd = ["terraform", "destroy", "-force"]
         sproc = subprocess.Popen(tf_destroy_cmd,
                                  cwd=cluster_staging_dir,
-                                 stdout=subprocess.PIPE)
+                                 stdout=subprocess.PIPE,
+                                 universal_newlines=True)
         while True:
             nextline = sproc.stdout.readline()
             if nextline == "" and sproc.poll() is not None:
@@ -392,11 +750,25 @@ class Helper(object):
     def display_terraform_environment(self, cluster_staging_dir):
         '''
         Given the path to staging dir, walk through the directory
-        and display the resources created for each environment
+        and display the resources created for each environment, as tables
+        or as json, jsonl or csv rows.
         '''
+        tags = [tfparser.parse_tag(tag) for tag in self.list_tags or []]
+        tfparser.write_environments(
+            cluster_staging_dir,
+            list_format=self.list_format,
+            environments=self.list_envs,
+            types=self.list_types,
+            tags=tags,
+            streaming=tfparser.streaming_enabled(self.env))
 
-        parserobj = tfparser.TFParser(cluster_staging_dir)
-        parserobj.terraform_display_environments()
+    def display_terraform_summary(self, cluster_staging_dir):
+        '''
+        Print the summary of the resources of each environment under the
+        staging dir, as JSON.
+        '''
+        tfparser.write_summary(cluster_staging_dir,
+                               streaming=tfparser.streaming_enabled(self.env))
 
     def configure_terraform_environment(self, cluster_staging_dir):
         '''
@@ -406,56 +778,233 @@ class Helper(object):
                 not os.path.isdir(cluster_staging_dir):
             self.slog.logger.error("Staging dir %s does not exist",
                                    cluster_staging_dir)
-            return
+            return 1
 
-        print "Configure"
-        ssh_failure = self.wait_for_ssh_connectivity(
-            cluster_staging_dir,
-            self.parsed_config['connection_info']['username'],
-            self.parsed_config['private_key_loc'])
+        print("Configure")
+        # The playbooks share ssh master connections, that the readiness
+        # probe opens.
+        self.ansible_cfg = ansible_config.write_ansible_cfg(
+            cluster_staging_dir)
+        with symphony_timer.span("ssh_wait"):
+            ssh_failure = self.wait_for_ssh_connectivity(
+                cluster_staging_dir,
+                self.get_ssh_username(),
+                self.normalized_data['private_key_loc'])
         if not ssh_failure:
-            print "Failed to connect to hosts."
-            return
+            print("Failed to connect to hosts.")
+            return 1
 
         # Now that we are able to reach all hosts.
-        # We can start configuring services.
-        for cluster in self.normalized_data['clusters'].keys():
-            services = self.normalized_data['clusters'][cluster]['services']
-            print "%s: Services: %s " % (cluster, services)
+        # We can start configuring services. Each service is a playbook
+        # job (each cluster with --batch), and jobs that do not depend on
+        # each other run concurrently.
+        try:
+            dag = self.build_configure_schedule(cluster_staging_dir)
+            with symphony_timer.span("playbooks", jobs=self.jobs):
+                results = dag.run()
+        except ValueError as err:
+            self.slog.logger.error("Invalid service dependencies [%s]", err)
+            return 1
 
-            default_hosts = \
-                self.normalized_data['clusters'][cluster]['cluster_name']
+        print("")
+        for line in scheduler.format_summary(results, order=dag.order):
+            print(line)
+
+        failed = [name for name in results
+                  if results[name]['status'] != "ok"]
+        if failed:
+            return 1
+        return 0
 
+    def build_configure_schedule(self, cluster_staging_dir):
+        '''
+        Build the DAG of ansible playbook runs for the configure step.
+
+        The services of a cluster run one after the other, in the order
+        they are defined. Clusters are independent of each other, unless
+        a cluster or service sets 'depends_on':
+            - A cluster 'depends_on' lists clusters, whose services must
+              all complete before any service of this cluster starts.
+            - A service 'depends_on' lists a service of the same cluster,
+              a cluster, or a 'cluster/service'.
+
+        With batch, each cluster is a single job instead, that runs the
+        playbook generated by add_cluster_playbook.
+        '''
+        dag = scheduler.DagScheduler(max_workers=self.jobs,
+                                     slogger=self.slog)
+        log_dir = os.path.join(cluster_staging_dir, ".symphony", "logs")
+        if not os.path.exists(log_dir):
+            os.makedirs(log_dir)
+
+        clusters = self.normalized_data['clusters']
+        cluster_jobs = {}
+        for cluster in clusters.keys():
+            services = clusters[cluster]['services'] or {}
+            if self.batch:
+                cluster_jobs[cluster] = [cluster] if services else []
+            else:
+                cluster_jobs[cluster] = ["%s/%s" % (cluster, service)
+                                         for service in services.keys()]
+
+        for cluster in clusters.keys():
+            services = clusters[cluster]['services'] or {}
+            print("%s: Services: %s " % (cluster, services))
+            if self.batch:
+                if services:
+                    self.add_cluster_playbook(dag, cluster,
+                                              cluster_staging_dir,
+                                              log_dir, cluster_jobs)
+                continue
+
+            default_hosts = clusters[cluster]['cluster_name']
+
+            previous = None
             for service in services.keys():
-                kwargs = {}
-                print "service: ", service
-                print services[service]
+                name = "%s/%s" % (cluster, service)
+                service_info = services[service] or {}
+
+                depends_on = []
+                if previous is not None:
+                    depends_on.append(previous)
+                for dep in as_list(clusters[cluster].get('depends_on')):
+                    depends_on.extend(cluster_jobs.get(dep, [dep]))
+                for dep in as_list(service_info.get('depends_on')):
+                    if dep in services:
+                        depends_on.append("%s/%s" % (cluster, dep))
+                    else:
+                        depends_on.extend(cluster_jobs.get(dep, [dep]))
+
+                kwargs = self.get_playbook_kwargs(cluster,
+                                                  cluster_staging_dir)
                 default_service_dir = os.path.join("./services", service)
-                kwargs['username'] = \
-                    self.normalized_data['connection_info']['username']
-                kwargs['private_key'] = self.normalized_data['private_key_loc']
-                kwargs['tf_staging'] = cluster_staging_dir
-                kwargs['use_private_ip'] = \
-                    self.normalized_data['connection_info'].get(
-                        'use_private_ip',
-                        "True")
-
-                if services[service] is not None:
-                    service_dir = services[service].get(
-                        'service_dir', default_service_dir)
-                    kwargs['hosts'] = services[service].get(
-                        'hosts', default_hosts)
-                    kwargs['service_vars'] = services[service]
-                else:
-                    service_dir = default_service_dir
-                    kwargs['hosts'] = default_hosts
-                    kwargs['service_vars'] = {}
-
+                service_dir = service_info.get('service_dir',
+                                               default_service_dir)
+                kwargs['hosts'] = service_info.get('hosts', default_hosts)
+                kwargs['service_vars'] = dict(
+                    (key, value) for key, value in service_info.items()
+                    if key != 'depends_on')
+                kwargs['log_file'] = os.path.join(
+                    log_dir, "%s_%s.log" % (cluster, service))
+                kwargs['job_name'] = name
+                if self.jobs > 1:
+                    kwargs['prefix'] = "[%s] " % name
 
                 default_playbook_name = "site.yaml"
-                self.execute_ansible_playbook(service_dir,
-                                              default_playbook_name,
-                                              **kwargs)
+                dag.add_job(name,
+                            self.execute_ansible_playbook,
+                            depends_on=depends_on,
+                            args=(service_dir, default_playbook_name),
+                            kwargs=kwargs)
+                previous = name
+
+        return dag
+
+    def get_playbook_kwargs(self, cluster, cluster_staging_dir):
+        '''
+        Return the execute_ansible_playbook kwargs shared by the services
+        of a cluster.
+        '''
+        # connection_info and the private key can be set per cluster, or
+        # for the whole config.
+        cluster_obj = self.normalized_data['clusters'][cluster]
+        connection_info = cluster_obj['connection_info'] or {}
+        kwargs = {}
+        kwargs['username'] = connection_info.get('username')
+        kwargs['private_key'] = cluster_obj['private_key_loc']
+        kwargs['tf_staging'] = cluster_staging_dir
+        kwargs['ansible_cfg'] = self.ansible_cfg
+        kwargs['use_private_ip'] = \
+            str(connection_info.get('use_private_ip', "True"))
+        return kwargs
+
+    def add_cluster_playbook(self, dag, cluster, cluster_staging_dir,
+                             log_dir, cluster_jobs):
+        '''
+        Add the job that configures all the services of a cluster with one
+        ansible-playbook run.
+
+        The generated playbook imports the site.yaml of each service, in
+        the order they are defined, with the service vars and hosts as
+        vars of the import. The run evaluates the inventory and gathers
+        the facts of the hosts once for the cluster.
+
+        The service vars are play vars of their import, where they are
+        extra vars when each service runs on its own: the role vars and
+        facts set by the playbook with the same name win over them.
+        '''
+        clusters = self.normalized_data['clusters']
+        services = clusters[cluster]['services']
+        default_hosts = clusters[cluster]['cluster_name']
+
+        depends_on = []
+        for dep in as_list(clusters[cluster].get('depends_on')):
+            depends_on.extend(cluster_jobs.get(dep, [dep]))
+
+        imports = []
+        done = []
+        for service in services.keys():
+            service_info = services[service] or {}
+            for dep in as_list(service_info.get('depends_on')):
+                dep_cluster, _, dep_service = dep.rpartition("/")
+                if not dep_cluster:
+                    dep_cluster, dep_service = cluster, dep
+                    if dep not in services:
+                        dep_cluster = dep
+                if dep_cluster != cluster:
+                    depends_on.extend(cluster_jobs.get(dep_cluster, [dep]))
+                elif dep_service not in done:
+                    # The imports run in order, a service can only depend
+                    # on the services defined before it.
+                    raise ValueError("Service [%s/%s] depends on [%s], "
+                                     "which does not run before it" %
+                                     (cluster, service, dep))
+
+            default_service_dir = os.path.join("./services", service)
+            service_dir = service_info.get('service_dir',
+                                           default_service_dir)
+            service_vars = dict(
+                (key, value) for key, value in service_info.items()
+                if key != 'depends_on')
+            service_vars['hosts'] = service_info.get('hosts', default_hosts)
+            imports.append((os.path.join(service_dir, "site.yaml"),
+                            service_vars))
+            done.append(service)
+
+        playbook_file = ansible_config.write_cluster_playbook(
+            cluster_staging_dir, cluster, imports)
+
+        kwargs = self.get_playbook_kwargs(cluster, cluster_staging_dir)
+        kwargs['log_file'] = os.path.join(log_dir, "%s.log" % cluster)
+        kwargs['job_name'] = cluster
+        if self.jobs > 1:
+            kwargs['prefix'] = "[%s] " % cluster
+
+        unique_depends_on = []
+        for dep in depends_on:
+            if dep not in unique_depends_on:
+                unique_depends_on.append(dep)
+        dag.add_job(cluster,
+                    self.execute_ansible_playbook,
+                    depends_on=unique_depends_on,
+                    args=(os.path.dirname(playbook_file),
+                          os.path.basename(playbook_file)),
+                    kwargs=kwargs)
+
+    def get_ssh_username(self):
+        '''
+        Return the ssh username, from the config connection_info, or else
+        from the first cluster that sets one.
+        '''
+        connection_info = self.normalized_data['connection_info'] or {}
+        if connection_info.get('username') is not None:
+            return connection_info['username']
+        clusters = self.normalized_data['clusters']
+        for cluster in sorted(clusters):
+            connection_info = clusters[cluster]['connection_info'] or {}
+            if connection_info.get('username') is not None:
+                return connection_info['username']
+        return None
 
     def wait_for_ssh_connectivity(self,
                                   cluster_staging_dir,
@@ -463,48 +1012,88 @@ class Helper(object):
                                   private_key_loc):
         '''
         Wait for SSH Connectivity to the hosts.
-        '''
-        print "privkey loc: ", private_key_loc
-
-        parseobj = tfparser.TFParser(cluster_staging_dir)
-        instinfo = parseobj.parser_get_aws_instance_info()
-
-        ssh = paramiko.SSHClient()
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-
-        ssh_hosts = []
-        for env in instinfo:
-            for _, resval in instinfo[env].items():
-                ssh_hosts.append(resval['private_ip'])
-
-        retry_count = 0
-        while retry_count < 10:
-            no_ssh_failure = True
-            for ssh_host in ssh_hosts:
-                try:
-                    print "Try connection to [%s: %d]" % \
-                        (ssh_host, retry_count)
-                    ssh.connect(ssh_host,
-                                username=username,
-                                key_filename=private_key_loc,
-                                timeout=5,
-                                banner_timeout=5)
-                    print "Connection Success: [%s: %d]" % \
-                        (ssh_host, retry_count)
-                except socket.error as sockerr:
-                    print "Socket error: ", sockerr
-                    no_ssh_failure = False
-                except paramiko.ssh_exception.SSHException as paramikoerr:
-                    print "Paramiko ssh error ", paramikoerr
-                    no_ssh_failure = False
-
-            if no_ssh_failure:
-                break
-
-            retry_count += 1
-            time.sleep(10)
 
-        return no_ssh_failure
+        All hosts are probed concurrently, and only the hosts that are not
+        reachable yet are retried. Returns True if all hosts are ready.
+        Each host is probed as ansible connects to it (get_ssh_targets),
+        username and private_key_loc are for the hosts of no cluster.
+        '''
+        print("privkey loc: ", private_key_loc)
+
+        with symphony_timer.span("read_state"):
+            credentials = self.get_ssh_targets(cluster_staging_dir,
+                                               username,
+                                               private_key_loc)
+        ssh_hosts = sorted(credentials)
+
+        # With the ssh client, the probe leaves the master connections
+        # up for the playbooks.
+        ssh_options = None
+        if shutil.which("ssh") is not None:
+            ssh_options = ansible_config.get_ssh_options(cluster_staging_dir)
+        probe = ssh_probe.SSHProbe(username,
+                                   private_key_loc,
+                                   concurrency=self.ssh_concurrency,
+                                   ssh_options=ssh_options,
+                                   credentials=credentials,
+                                   slogger=self.slog)
+        with symphony_timer.span("probe",
+                                 hosts=len(ssh_hosts)) as probe_span:
+            report = probe.wait_for_hosts(ssh_hosts)
+            savings = ssh_probe.connection_savings(report)
+            probe_span.set(**savings)
+        for line in ssh_probe.format_report(report):
+            print(line)
+        if savings:
+            print("SSH connection setup: %.1fms, over the master: %.1fms, "
+                  "%.1fms saved per connection" %
+                  (savings['setup_ms'], savings['reuse_ms'],
+                   savings['saved_ms']))
+
+        self.ssh_report = report
+        return all([status['ready'] for status in report.values()])
+
+    def get_ssh_targets(self, cluster_staging_dir, username,
+                        private_key_loc):
+        '''
+        Return {address: (username, private key)} of the hosts to probe.
+
+        The hosts of a cluster group are addressed as the inventory gives
+        them to its playbooks, with its use_private_ip, and get the user
+        and key of the cluster. The ssh master connections are only
+        reused by ansible for the same user and address. The other hosts
+        of the inventory get username and private_key_loc, at their
+        private ip.
+        '''
+        clusters = self.normalized_data['clusters']
+        inventories = {}
+
+        def get_inventory(priv_ip_flag):
+            if priv_ip_flag not in inventories:
+                inventories[priv_ip_flag] = tf_inventory.get_inventory(
+                    tf_root=cluster_staging_dir, priv_ip_flag=priv_ip_flag)
+            return inventories[priv_ip_flag]
+
+        targets = {}
+        claimed = set()
+        for cluster in sorted(clusters):
+            kwargs = self.get_playbook_kwargs(cluster, cluster_staging_dir)
+            inventory = get_inventory(kwargs['use_private_ip'])
+            hostvars = inventory['_meta']['hostvars']
+            group = inventory.get(clusters[cluster]['cluster_name'], {})
+            for host in group.get('hosts', []):
+                claimed.add(host)
+                targets.setdefault(hostvars[host]['ansible_ssh_host'],
+                                   (kwargs['username'],
+                                    kwargs['private_key']))
+
+        hostvars = get_inventory("True")['_meta']['hostvars']
+        for host in hostvars:
+            if host not in claimed:
+                targets.setdefault(hostvars[host]['ansible_ssh_host'],
+                                   (username, private_key_loc))
+
+        return targets
 
     def execute_ansible_playbook(self,
                                  playbook_path,
@@ -513,40 +1102,76 @@ class Helper(object):
         '''
         Execute the ansible playbook
         '''
-        print "playbook [%s, %s] hosts: %s" % \
-            (playbook_path, playbook_name, kwargs['hosts'])
-
-        #tf_dynamic_inventory = "../../../tf_ansible/terraform.py"
-        tf_dynamic_inventory = "../../main/tf_inventory.py"
-
-        # Set Ansible Options.
-        extra_vars = "username=%s hosts=%s" % \
-            (kwargs['username'], kwargs['hosts'])
+        with symphony_timer.span("playbook",
+                                 job=kwargs.get('job_name', playbook_path)):
+            return self.__execute_ansible_playbook(playbook_path,
+                                                   playbook_name,
+                                                   **kwargs)
+
+    def __execute_ansible_playbook(self,
+                                   playbook_path,
+                                   playbook_name,
+                                   **kwargs):
+        print("playbook [%s, %s] hosts: %s" %
+            (playbook_path, playbook_name, kwargs.get('hosts')))
+
+        tf_dynamic_inventory = TF_DYNAMIC_INVENTORY
+
+        # Set Ansible Options. A cluster playbook sets the hosts and the
+        # service vars per import, extra vars would override them.
+        extra_vars = "username=%s" % kwargs['username']
+        if kwargs.get('hosts') is not None:
+            extra_vars += " hosts=%s" % kwargs['hosts']
         private_key_option = "--private-key=%s" % kwargs['private_key']
 
-        # Set the Additional variables in cluster info.
-        service_vars = kwargs['service_vars']
-        service_vars = json.dumps(service_vars)
-
-        # Set environment variables.
-        os.environ['TERRAFORM_STATE_ROOT'] = kwargs['tf_staging']
-        os.environ['ANSIBLE_HOST_KEY_CHECKING'] = "False"
-        os.environ['USE_PRIVATE_IP'] = kwargs['use_private_ip']
+        # Set environment variables. The playbooks can run concurrently,
+        # so each gets its own copy of the environment.
+        env = os.environ.copy()
+        env['TERRAFORM_STATE_ROOT'] = kwargs['tf_staging']
+        env['ANSIBLE_HOST_KEY_CHECKING'] = "False"
+        env['USE_PRIVATE_IP'] = kwargs['use_private_ip']
+        if kwargs.get('ansible_cfg') is not None:
+            env['ANSIBLE_CONFIG'] = kwargs['ansible_cfg']
 
         ansible_cmd = ["ansible-playbook", "-i", tf_dynamic_inventory,
-                       playbook_name, "-e", extra_vars,
-                       "-e", service_vars,
-                       private_key_option]
+                       playbook_name, "-e", extra_vars]
+        # Set the Additional variables in cluster info.
+        if kwargs.get('service_vars') is not None:
+            ansible_cmd.extend(["-e", json.dumps(kwargs['service_vars'])])
+        ansible_cmd.append(private_key_option)
+
+        log_fp = None
+        if kwargs.get('log_file', None) is not None:
+            log_fp = open(kwargs['log_file'], "w")
+        prefix = kwargs.get('prefix', "")
 
         sproc = subprocess.Popen(ansible_cmd,
                                  cwd=playbook_path,
-                                 stdout=subprocess.PIPE)
+                                 env=env,
+                                 stdout=subprocess.PIPE,
+                                 universal_newlines=True)
         while True:
             nextline = sproc.stdout.readline()
             if nextline == "" and sproc.poll() is not None:
                 break
 
-            sys.stdout.write(nextline)
+            if log_fp is not None:
+                log_fp.write(nextline)
+            sys.stdout.write(prefix + nextline)
             sys.stdout.flush()
 
+        if log_fp is not None:
+            log_fp.close()
 
+        return sproc.returncode
+
+
+def as_list(value):
+    '''
+    Return a config value that can be a single item or a list, as a list.
+    '''
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [value]
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Build Manifest:
+---------------
+The build manifest records a content hash for every rendered cluster in a
+staging directory. The hash covers the normalized cluster inputs, the
+template source and the init script content, so a cluster whose hash has
+not changed since the last build does not need to be rendered again.
+
+The template source is the template and the templates it includes,
+imports or extends, recursively. When a template refers to another one
+by a computed name, which cannot be followed, every template of the
+search path is hashed instead.
+'''
+
+import os
+import json
+import hashlib
+import threading
+import jinja2
+import jinja2.meta
+import utils.symphony_logger as logger
+
+
+class BuildManifest(object):
+    '''
+    Content hash manifest for a cluster staging directory.
+    '''
+    MANIFEST_DIR = ".symphony"
+    MANIFEST_FILE = "build_manifest.json"
+
+    def __init__(self, staging_dir, slogger=None):
+        '''
+        Initialize the manifest, loading the previous one if present.
+
+        :type staging_dir: string
+        :param staging_dir: The cluster staging directory
+        '''
+        if slogger is None:
+            self.slog = logger.Logger(name="BuildManifest")
+        else:
+            self.slog = slogger
+
+        self.manifest_file = os.path.join(staging_dir,
+                                          BuildManifest.MANIFEST_DIR,
+                                          BuildManifest.MANIFEST_FILE)
+        self.entries = {}
+        self.template_digests = {}
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        '''
+        Load the manifest from the staging directory.
+        '''
+        if not os.path.exists(self.manifest_file):
+            return
+
+        try:
+            with open(self.manifest_file, "r") as manifest_fp:
+                self.entries = json.load(manifest_fp).get('clusters', {})
+        except (IOError, ValueError) as err:
+            self.slog.logger.error("Ignoring invalid manifest [%s] [%s]",
+                                   self.manifest_file, err)
+            self.entries = {}
+
+    def save(self, names=None):
+        '''
+        Write the manifest. If names is given, entries for any other
+        clusters (removed from the config) are dropped.
+        '''
+        with self.lock:
+            if names is not None:
+                self.entries = dict((name, entry) for name, entry in
+                                    self.entries.items() if name in names)
+            data = {'clusters': self.entries}
+
+        manifest_dir = os.path.dirname(self.manifest_file)
+        if not os.path.exists(manifest_dir):
+            os.makedirs(manifest_dir)
+
+        tmpfile = self.manifest_file + ".tmp"
+        with open(tmpfile, "w") as manifest_fp:
+            json.dump(data, manifest_fp, indent=2, sort_keys=True)
+        os.rename(tmpfile, self.manifest_file)
+
+    def compute_digest(self, normalized_data, template_file, script_data):
+        '''
+        Return the content hash for a cluster.
+
+        :type normalized_data: dict
+        :param normalized_data: The normalized data the template renders
+
+        :type template_file: string
+        :param template_file: Path to the jinja2 template
+
+        :type script_data: string
+        :param script_data: The generated init script, or None
+        '''
+        digest = hashlib.sha256()
+        digest.update(json.dumps(normalized_data, sort_keys=True,
+                                 default=str).encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(self.get_template_digest(template_file).encode("utf-8"))
+        digest.update(b"\0")
+        if script_data is not None:
+            digest.update(script_data.encode("utf-8"))
+
+        return digest.hexdigest()
+
+    def get_template_digest(self, template_file):
+        '''
+        Return the content hash of a template and the templates it
+        depends on. The hash is computed once per template and manifest,
+        the templates do not change during a build.
+
+        :type template_file: string
+        :param template_file: Path to the jinja2 template, the other
+                              templates are looked up in its directory
+        '''
+        with self.lock:
+            template_digest = self.template_digests.get(template_file)
+        if template_digest is not None:
+            return template_digest
+
+        searchpath = os.path.dirname(template_file)
+        names = find_template_closure(searchpath,
+                                      os.path.basename(template_file))
+        if names is None:
+            names = []
+            for dirpath, _, filenames in os.walk(searchpath):
+                for filename in filenames:
+                    names.append(os.path.relpath(
+                        os.path.join(dirpath, filename), searchpath))
+
+        digest = hashlib.sha256()
+        for name in sorted(names):
+            digest.update(name.encode("utf-8"))
+            digest.update(b"\0")
+            try:
+                with open(os.path.join(searchpath, name), "rb") as tmpl_fp:
+                    digest.update(tmpl_fp.read())
+            except (IOError, OSError):
+                # The render fails on a missing template.
+                digest.update(b"missing")
+            digest.update(b"\0")
+
+        template_digest = digest.hexdigest()
+        with self.lock:
+            self.template_digests[template_file] = template_digest
+        return template_digest
+
+    def is_current(self, name, digest, outputs):
+        '''
+        Return True if the cluster was built with the same digest and
+        all its output files are still present.
+        '''
+        with self.lock:
+            entry = self.entries.get(name, None)
+
+        if entry is None or entry.get('digest') != digest:
+            return False
+
+        for output in outputs:
+            if not os.path.exists(output):
+                return False
+
+        return True
+
+    def update(self, name, digest):
+        '''
+        Record the digest for a cluster that was just built.
+        '''
+        with self.lock:
+            self.entries[name] = {'digest': digest}
+
+
+def find_template_closure(searchpath, template_name):
+    '''
+    Return the names of a template and of the templates it includes,
+    imports or extends, recursively, relative to the search path. Returns
+    None if a template refers to a template by a computed name.
+    '''
+    env = jinja2.Environment()
+    names = set()
+    pending = [template_name]
+    while pending:
+        name = pending.pop()
+        if name in names:
+            continue
+        names.add(name)
+        try:
+            with open(os.path.join(searchpath, name), "r") as tmpl_fp:
+                source = tmpl_fp.read()
+            ast = env.parse(source)
+        except (IOError, OSError, jinja2.TemplateSyntaxError):
+            # Missing or broken, the render reports it.
+            continue
+        for reference in jinja2.meta.find_referenced_templates(ast):
+            if reference is None:
+                return None
+            pending.append(reference)
+
+    return names
+
+
+def write_if_changed(filepath, data):
+    '''
+    Write data to filepath, unless the file already has that content.
+    Leaving unchanged files alone keeps their mtime, so downstream tools
+    do not see them as modified. Returns True if the file was written.
+    '''
+    if os.path.exists(filepath):
+        with open(filepath, "r") as filep:
+            if filep.read() == data:
+                return False
+
+    with open(filepath, "w") as filep:
+        filep.write(data)
+
+    return True
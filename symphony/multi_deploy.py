@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Multi Environment Deploy:
+-------------------------
+Deploy every environment under a staging root. The build operation
+renders each cluster config into <staging>/<name>_<environment>; this
+runs terraform init, plan and apply in each of those directories, with
+at most `jobs` environments deployed at the same time. The plan is saved
+to terraform.PLAN_FILE and apply applies that exact plan.
+
+The output of each terraform step is captured and written out once the
+step is done, with every line prefixed by the environment name, so the
+output of concurrent environments does not interleave. The run ends
+with a table of the exit code and duration of every environment.
+'''
+
+import os
+import sys
+import time
+import threading
+import utils.symphony_logger as logger
+import utils.symphony_timer as symphony_timer
+import symphony.command as command
+import symphony.terraform as terraform
+import symphony.scheduler as scheduler
+import symphony.tf_events as tf_events
+
+
+DEPLOY_STEPS = ["init", "plan", "apply"]
+
+
+def find_environments(staging_root):
+    '''
+    Return the staging subdirectories holding terraform files, in name
+    order. Hidden directories (.symphony, .terraform) are ignored.
+    '''
+    environments = []
+    for name in sorted(os.listdir(staging_root)):
+        env_dir = os.path.join(staging_root, name)
+        if name.startswith(".") or not os.path.isdir(env_dir):
+            continue
+        if [tf for tf in os.listdir(env_dir) if tf.endswith(".tf")]:
+            environments.append(name)
+
+    return environments
+
+
+class MultiDeploy(object):
+    '''
+    Concurrent terraform deploy of the environments under a staging root.
+    '''
+    def __init__(self, staging_root, jobs=1, stream=None, init_options=None,
+                 targeted=False, json_events=False, slogger=None):
+        '''
+        :type staging_root: string
+        :param staging_root: The staging directory holding the
+                             <name>_<environment> subdirectories
+
+        :type jobs: int
+        :param jobs: Max environments deployed concurrently
+
+        :type stream: file
+        :param stream: Where the prefixed output is written, defaults to
+                       sys.stdout
+
+        :type init_options: dict
+        :param init_options: Keyword arguments for terraform_init, like
+                             plugin_mirror
+
+        :type targeted: Boolean
+        :param targeted: Only plan the resources of the .tf files changed
+                         since the last successful apply
+
+        :type json_events: Boolean
+        :param json_events: Run plan and apply with the terraform JSON
+                            event stream, and write the resource timings
+                            to tf_events.REPORT_FILE in each environment
+        '''
+        if slogger is None:
+            self.slog = logger.Logger(name="MultiDeploy")
+        else:
+            self.slog = slogger
+
+        self.staging_root = staging_root
+        self.jobs = jobs
+        self.stream = stream if stream is not None else sys.stdout
+        self.init_options = init_options or {}
+        self.targeted = targeted
+        self.json_events = json_events
+        self.output_lock = threading.Lock()
+        self.steps = {}
+
+    def write_output(self, env_name, step, output):
+        '''
+        Write the captured output of a step, prefixed by the environment.
+        '''
+        prefix = "[%s] " % env_name
+        lines = [prefix + "terraform %s" % step]
+        lines.extend([prefix + line for line in output.splitlines()])
+        with self.output_lock:
+            self.stream.write("\n".join(lines) + "\n")
+            self.stream.flush()
+
+    def deploy_environment(self, env_name):
+        '''
+        Run terraform init, plan and apply in an environment, stopping at
+        the first step that fails. Returns the exit code of the last step
+        run.
+        '''
+        with symphony_timer.span("deploy_environment",
+                                 environment=env_name):
+            return self.__deploy_environment(env_name)
+
+    def __deploy_environment(self, env_name):
+        env_dir = os.path.join(self.staging_root, env_name)
+        tfobj = terraform.Terraform(env_dir, slogger=self.slog)
+        self.steps[env_name] = None
+
+        targets = None
+        if self.targeted:
+            targets = terraform.find_changed_targets(env_dir)
+            self.write_output(env_name, "targets",
+                              "\n".join(targets or ["(all resources)"]))
+
+        # With the event stream, plan and apply output is streamed as it
+        # comes, through the event parser.
+        sinks = None
+        if self.json_events:
+            console = command.ConsoleSink(prefix="[%s] " % env_name,
+                                          stream=self.stream)
+            events = tf_events.EventSink(console=console)
+            sinks = [events]
+
+        ret = 0
+        for step in DEPLOY_STEPS:
+            self.steps[env_name] = step
+            step_func = getattr(tfobj, "terraform_%s" % step)
+            if step == "init":
+                with symphony_timer.span("terraform_init"):
+                    ret, stdout, stderr = step_func(env_dir,
+                                                    **self.init_options)
+                self.write_output(env_name, step, stdout + stderr)
+            else:
+                with symphony_timer.span("terraform_%s" % step):
+                    ret, stdout, stderr = step_func(
+                        env_dir, plan_file=terraform.PLAN_FILE,
+                        targets=targets, json_events=self.json_events,
+                        sinks=sinks)
+                if sinks is None:
+                    self.write_output(env_name, step, stdout + stderr)
+            if ret != 0:
+                self.slog.logger.error("[%s] terraform %s failed [%d]",
+                                       env_name, step, ret)
+                break
+
+        if sinks is not None:
+            events.timings.write_report(os.path.join(env_dir,
+                                                     tf_events.REPORT_FILE))
+            self.write_output(env_name, "timings",
+                              "\n".join(events.timings.summary()))
+
+        return ret
+
+    def run(self):
+        '''
+        Deploy all the environments. Returns the scheduler results, keyed
+        by environment name.
+        '''
+        environments = find_environments(self.staging_root)
+        if not environments:
+            self.slog.logger.error("No environments found under [%s]",
+                                   self.staging_root)
+            return {}
+
+        dag = scheduler.DagScheduler(max_workers=self.jobs,
+                                     slogger=self.slog)
+        for env_name in environments:
+            dag.add_job(env_name, self.deploy_environment, args=(env_name,))
+
+        start = time.time()
+        with symphony_timer.span("deploy_environments", jobs=self.jobs):
+            results = dag.run()
+        for env_name in environments:
+            if results[env_name]['status'] == "failed":
+                results[env_name]['step'] = self.steps.get(env_name)
+        self.slog.logger.info("Deployed %d environments in %.1fs",
+                              len(environments), time.time() - start)
+
+        return results
+
+
+def format_deploy_summary(results):
+    '''
+    Return the deploy summary as printable lines, with the failed step of
+    each failed environment.
+    '''
+    lines = scheduler.format_summary(results)
+    failed = [name for name in sorted(results)
+              if results[name].get('step') is not None]
+    for name in failed:
+        lines.append("%s: terraform %s failed" % (name,
+                                                   results[name]['step']))
+
+    return lines
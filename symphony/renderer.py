@@ -1,17 +1,113 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import os
+import threading
 import jinja2
 
 
-def render_j2_template(templatefile, searchpath, obj):
+class CountingBytecodeCache(jinja2.FileSystemBytecodeCache):
+    '''
+    Filesystem bytecode cache that counts how often compiled bytecode
+    was found on disk.
+    '''
+    def __init__(self, directory):
+        super(CountingBytecodeCache, self).__init__(directory=directory)
+        self.hits = 0
+        self.misses = 0
+
+    def load_bytecode(self, bucket):
+        super(CountingBytecodeCache, self).load_bytecode(bucket)
+        if bucket.code is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+
+class TemplateEngine(object):
+    '''
+    A jinja2 environment for a single template search path.
+
+    Templates are loaded and compiled once, and reused for every render
+    while the template file is unchanged. When a cache_dir is given the
+    compiled bytecode is also kept on disk, so the next process can skip
+    compiling the templates.
+    '''
+    def __init__(self, searchpath, cache_dir=None):
+        self.searchpath = searchpath
+        self.bytecode_cache = None
+        if cache_dir is not None:
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+            self.bytecode_cache = CountingBytecodeCache(cache_dir)
+
+        template_loader = jinja2.FileSystemLoader(searchpath=searchpath)
+        self.environment = jinja2.Environment(
+            loader=template_loader, trim_blocks=False, lstrip_blocks=False,
+            bytecode_cache=self.bytecode_cache
+        )
+        self.templates = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get_template(self, templatefile):
+        """Return the compiled template, loading it if it changed"""
+        with self.lock:
+            template = self.templates.get(templatefile, None)
+            if template is not None and template.is_up_to_date:
+                self.hits += 1
+                return template
+
+            self.misses += 1
+            template = self.environment.get_template(templatefile)
+            self.templates[templatefile] = template
+            return template
+
+    def render(self, templatefile, obj):
+        """Render a template and return the rendered string"""
+        template = self.get_template(templatefile)
+        return template.render(obj)
+
+    def stats(self):
+        """Return the template and bytecode cache hit/miss counters"""
+        stats = {
+            'hits': self.hits,
+            'misses': self.misses,
+            'bytecode_hits': 0,
+            'bytecode_misses': 0
+        }
+        if self.bytecode_cache is not None:
+            stats['bytecode_hits'] = self.bytecode_cache.hits
+            stats['bytecode_misses'] = self.bytecode_cache.misses
+
+        return stats
+
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def get_template_engine(searchpath, cache_dir=None):
+    """
+    Return the process wide template engine for a search path and
+    bytecode cache dir
+    """
+    if cache_dir is not None:
+        cache_dir = os.path.abspath(cache_dir)
+    key = (os.path.abspath(searchpath), cache_dir)
+    with _engines_lock:
+        engine = _engines.get(key, None)
+        if engine is None:
+            engine = TemplateEngine(searchpath, cache_dir=cache_dir)
+            _engines[key] = engine
+
+    return engine
+
+
+def render_j2_template(templatefile, searchpath, obj, cache_dir=None):
     """Render a Jinja2 template and return the rendered string"""
-    rendered_data = None
-    template_loader = jinja2.FileSystemLoader(searchpath=searchpath)
-    env = jinja2.Environment(
-        loader=template_loader, trim_blocks=False, lstrip_blocks=False
-    )
-    template = env.get_template(templatefile)
-    rendered_data = template.render(obj)
+    engine = get_template_engine(searchpath, cache_dir=cache_dir)
+    rendered_data = engine.render(templatefile, obj)
 
     return rendered_data
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+DAG Scheduler:
+--------------
+Run a set of jobs with dependencies between them. A job starts as soon as
+all the jobs it depends on have succeeded, with at most max_workers jobs
+running at the same time. If a job fails, the jobs that depend on it
+(directly or not) are skipped, while independent jobs carry on.
+'''
+
+import time
+from concurrent import futures
+import utils.symphony_logger as logger
+
+
+class Job(object):
+    '''
+    A unit of work for the scheduler. The callable returns 0 on success.
+    '''
+    def __init__(self, name, func, depends_on=None, args=None, kwargs=None):
+        self.name = name
+        self.func = func
+        self.depends_on = list(depends_on or [])
+        self.args = args or ()
+        self.kwargs = kwargs or {}
+
+
+class DagScheduler(object):
+    '''
+    Dependency aware job scheduler.
+    '''
+    def __init__(self, max_workers=1, slogger=None):
+        self.max_workers = max(1, max_workers or 1)
+        self.jobs = {}
+        self.order = []
+        if slogger is None:
+            self.slog = logger.Logger(name="DagScheduler")
+        else:
+            self.slog = slogger
+
+    def add_job(self, name, func, depends_on=None, args=None, kwargs=None):
+        '''
+        Add a job. Jobs are started in the order they were added, when
+        more than one job is ready.
+        '''
+        if name in self.jobs:
+            raise ValueError("Duplicate job [%s]" % name)
+        self.jobs[name] = Job(name, func, depends_on=depends_on,
+                              args=args, kwargs=kwargs)
+        self.order.append(name)
+
+    def validate(self):
+        '''
+        Check that all dependencies exist and that there are no cycles.
+        Raises ValueError otherwise.
+        '''
+        for name in self.order:
+            for dep in self.jobs[name].depends_on:
+                if dep not in self.jobs:
+                    raise ValueError("Job [%s] depends on unknown job [%s]" %
+                                     (name, dep))
+
+        # Depth first search, with the current path kept in 'visiting'.
+        visited = set()
+        visiting = []
+
+        def visit(name):
+            if name in visiting:
+                cycle = visiting[visiting.index(name):] + [name]
+                raise ValueError("Dependency cycle: %s" % " -> ".join(cycle))
+            if name in visited:
+                return
+            visiting.append(name)
+            for dep in self.jobs[name].depends_on:
+                visit(dep)
+            visiting.pop()
+            visited.add(name)
+
+        for name in self.order:
+            visit(name)
+
+    def run_job(self, job):
+        '''
+        Run a single job, returning its result record.
+        '''
+        result = {'start': time.time(), 'error': None}
+        try:
+            ret = job.func(*job.args, **job.kwargs)
+        except Exception as err:
+            self.slog.logger.error("Job [%s] raised [%s]", job.name, err)
+            ret = 1
+            result['error'] = str(err)
+
+        result['returncode'] = ret if ret is not None else 0
+        result['duration'] = time.time() - result['start']
+        result['status'] = "ok" if result['returncode'] == 0 else "failed"
+        return result
+
+    def run(self):
+        '''
+        Run all the jobs. Returns a dictionary of job name to a result
+        with 'status' (ok, failed or skipped), 'returncode', 'duration'
+        and 'error'.
+        '''
+        self.validate()
+
+        results = {}
+        pending = list(self.order)
+        running = {}
+
+        with futures.ThreadPoolExecutor(max_workers=self.max_workers) as \
+                executor:
+            while pending or running:
+                # Skip jobs whose dependencies did not succeed.
+                for name in list(pending):
+                    deps = self.jobs[name].depends_on
+                    failed = [dep for dep in deps if dep in results and
+                              results[dep]['status'] != "ok"]
+                    if failed:
+                        self.slog.logger.error("Job [%s] skipped, [%s] "
+                                               "did not succeed",
+                                               name, failed[0])
+                        results[name] = {'status': "skipped",
+                                         'returncode': None,
+                                         'duration': 0.0,
+                                         'error': "dependency %s failed" %
+                                                  failed[0]}
+                        pending.remove(name)
+
+                # Start every job that is ready, while workers are free.
+                for name in list(pending):
+                    if len(running) >= self.max_workers:
+                        break
+                    deps = self.jobs[name].depends_on
+                    if all([dep in results for dep in deps]):
+                        self.slog.logger.info("Job [%s] started", name)
+                        future = executor.submit(self.run_job,
+                                                 self.jobs[name])
+                        running[future] = name
+                        pending.remove(name)
+
+                if not running:
+                    continue
+
+                done, _ = futures.wait(list(running.keys()),
+                                       return_when=futures.FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    results[name] = future.result()
+                    self.slog.logger.info("Job [%s] %s in %.1fs", name,
+                                          results[name]['status'],
+                                          results[name]['duration'])
+
+        return results
+
+
+def format_summary(results, order=None):
+    '''
+    Return the run summary as printable lines.
+    '''
+    if order is None:
+        order = sorted(results.keys())
+
+    lines = []
+    lines.append("%-40s %-8s %6s %9s" % ("Job", "Status", "Return",
+                                         "Duration"))
+    lines.append("-" * 66)
+    for name in order:
+        result = results[name]
+        returncode = result['returncode']
+        if returncode is None:
+            returncode = "-"
+        lines.append("%-40s %-8s %6s %8.1fs" % (name, result['status'],
+                                                returncode,
+                                                result['duration']))
+    failed = [name for name in order if results[name]['status'] != "ok"]
+    lines.append("-" * 66)
+    lines.append("%d jobs, %d failed or skipped" % (len(order), len(failed)))
+
+    return lines
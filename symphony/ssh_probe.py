@@ -0,0 +1,312 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+SSH Readiness Probe:
+--------------------
+Wait for a set of hosts to accept ssh connections.
+
+All hosts are probed concurrently, up to a concurrency limit. Each host
+first gets a cheap TCP connect to the ssh port, and only when that
+succeeds the full ssh handshake. A host that fails is retried after an
+exponential backoff with jitter, until max_wait has passed since the
+first attempt, and a host that succeeded is never probed again. The
+default max_wait is the 100s the probe used to wait (10 attempts 10s
+apart), so slow booting instances get at least as long as before.
+
+With ssh_options, the handshake is made with the ssh client instead of
+paramiko. Options that set up a ControlMaster with ControlPersist leave
+the master connection of each ready host up, for ansible to reuse. The
+probe then also times a second session over the master, to measure what
+reusing it saves. The master is only shared with the ansible connections
+that have the same user, address and port, so credentials gives the user
+of each host.
+'''
+
+import time
+import random
+import socket
+import asyncio
+import tempfile
+import subprocess
+from concurrent import futures
+import utils.symphony_logger as logger
+
+
+class SSHProbe(object):
+    '''
+    Concurrent ssh readiness probe.
+    '''
+    def __init__(self, username, private_key_loc, **kwargs):
+        '''
+        Initialize the probe.
+
+        :type username: string
+        :param username: The ssh user, of the hosts not in credentials
+
+        :type private_key_loc: string
+        :param private_key_loc: Path to the ssh private key, of the hosts
+                                not in credentials
+
+        Optional keyword arguments:
+            concurrency: Max hosts probed at the same time (default 20)
+            max_wait: Seconds from the first attempt of a host before
+                giving up on it (default 100). The last attempt is made at
+                the deadline.
+            max_attempts: Attempts per host before giving up, even before
+                max_wait (default no limit)
+            base_delay: Backoff base delay in seconds (default 1)
+            max_delay: Backoff delay cap in seconds (default 30)
+            timeout: TCP connect and ssh handshake timeout (default 5)
+            port: ssh port (default 22)
+            handshake: callable(host) that performs the ssh handshake and
+                raises on failure. Defaults to a paramiko connect, or an
+                ssh client run with ssh_options.
+            ssh_options: ssh client options, eg the ControlMaster ones of
+                ansible_config.get_ssh_options()
+            measure_reuse: Time a second handshake of the ready hosts.
+                Defaults to True with ssh_options.
+            credentials: {host: (username, private_key_loc)}, for the
+                hosts with their own user or key.
+        '''
+        self.username = username
+        self.private_key_loc = private_key_loc
+        self.credentials = kwargs.get('credentials', None) or {}
+        self.concurrency = kwargs.get('concurrency', 20)
+        self.max_wait = kwargs.get('max_wait', 100.0)
+        self.max_attempts = kwargs.get('max_attempts', None)
+        self.base_delay = kwargs.get('base_delay', 1.0)
+        self.max_delay = kwargs.get('max_delay', 30.0)
+        self.timeout = kwargs.get('timeout', 5)
+        self.port = kwargs.get('port', 22)
+        self.ssh_options = kwargs.get('ssh_options', None)
+        self.measure_reuse = kwargs.get('measure_reuse',
+                                        self.ssh_options is not None)
+        self.handshake = kwargs.get('handshake', None)
+        if self.handshake is None:
+            if self.ssh_options is not None:
+                self.handshake = self.openssh_handshake
+            else:
+                self.handshake = self.ssh_handshake
+
+        slogger = kwargs.get('slogger', None)
+        if slogger is None:
+            self.slog = logger.Logger(name="SSHProbe")
+        else:
+            self.slog = slogger
+
+    def backoff_delay(self, attempt):
+        '''
+        Return the delay before the next attempt. Exponential backoff
+        with equal jitter: at least half the backoff, so the retries do
+        not come too soon, and a random other half, so hosts that fail
+        together do not all retry at the same moment.
+        '''
+        ceiling = min(self.max_delay, self.base_delay * (2 ** attempt))
+        return ceiling / 2.0 + random.uniform(0, ceiling / 2.0)
+
+    def get_credentials(self, host):
+        '''
+        Return the (username, private_key_loc) of a host.
+        '''
+        return self.credentials.get(host, (self.username,
+                                           self.private_key_loc))
+
+    def ssh_handshake(self, host):
+        '''
+        Perform a full ssh handshake and authentication with the host.
+        '''
+        import paramiko
+
+        username, private_key_loc = self.get_credentials(host)
+        ssh = paramiko.SSHClient()
+        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        try:
+            ssh.connect(host,
+                        port=self.port,
+                        username=username,
+                        key_filename=private_key_loc,
+                        timeout=self.timeout,
+                        banner_timeout=self.timeout)
+        finally:
+            ssh.close()
+
+    def get_ssh_command(self, host):
+        '''
+        Return the ssh client command of the handshake.
+        '''
+        command = ["ssh", "-o", "BatchMode=yes",
+                   "-o", "StrictHostKeyChecking=no",
+                   "-o", "UserKnownHostsFile=/dev/null",
+                   "-o", "ConnectTimeout=%d" % self.timeout,
+                   "-p", str(self.port)]
+        username, private_key_loc = self.get_credentials(host)
+        if private_key_loc:
+            command += ["-i", private_key_loc]
+        if username:
+            command += ["-l", username]
+        command += self.ssh_options or []
+        return command + [host, "true"]
+
+    def openssh_handshake(self, host):
+        '''
+        Run a command on the host with the ssh client.
+        '''
+        # A master started with ControlPersist keeps the inherited stderr
+        # open, so it goes to a file rather than a pipe that would never
+        # reach EOF.
+        with tempfile.TemporaryFile() as err_fp:
+            ret = subprocess.call(self.get_ssh_command(host),
+                                  stdin=subprocess.DEVNULL,
+                                  stdout=subprocess.DEVNULL,
+                                  stderr=err_fp,
+                                  timeout=self.timeout * 4)
+            if ret != 0:
+                err_fp.seek(0)
+                message = err_fp.read().decode("utf-8", "replace").strip()
+                raise Exception(message.splitlines()[-1] if message
+                                else "ssh exited with %d" % ret)
+
+    async def tcp_check(self, host):
+        '''
+        Check that the ssh port accepts TCP connections.
+        '''
+        _, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, self.port), timeout=self.timeout)
+        writer.close()
+
+    async def probe_host(self, host, semaphore, executor, report):
+        '''
+        Probe a single host until it is ready, or max_wait has passed or
+        it is out of attempts. The blocking handshakes run in executor.
+        '''
+        loop = asyncio.get_running_loop()
+        start = time.monotonic()
+        deadline = start + self.max_wait
+        status = report[host]
+
+        attempt = 0
+        while True:
+            status['attempts'] = attempt + 1
+            async with semaphore:
+                try:
+                    await self.tcp_check(host)
+                    handshake_start = time.monotonic()
+                    await loop.run_in_executor(executor, self.handshake,
+                                               host)
+                    status['ready'] = True
+                    status['error'] = None
+                    status['time_to_ready'] = time.monotonic() - start
+                    status['handshake_time'] = \
+                        time.monotonic() - handshake_start
+                    if self.measure_reuse:
+                        await self.time_reuse(host, executor, status)
+                    self.slog.logger.info("[%s] ssh ready after %d attempts "
+                                          "(%.1fs)", host, attempt + 1,
+                                          status['time_to_ready'])
+                    return
+                except (asyncio.TimeoutError, socket.error) as err:
+                    status['error'] = "tcp: %s" % (str(err) or
+                                                   type(err).__name__)
+                except Exception as err:
+                    status['error'] = "ssh: %s" % (str(err) or
+                                                   type(err).__name__)
+
+            self.slog.logger.debug("[%s] attempt %d failed [%s]",
+                                   host, attempt + 1, status['error'])
+            remaining = deadline - time.monotonic()
+            attempt += 1
+            if remaining <= 0 or (self.max_attempts is not None and
+                                  attempt >= self.max_attempts):
+                break
+            await asyncio.sleep(min(self.backoff_delay(attempt - 1),
+                                    remaining))
+
+        self.slog.logger.error("[%s] ssh not ready after %d attempts "
+                               "(%.1fs) [%s]", host, attempt,
+                               time.monotonic() - start, status['error'])
+
+    async def time_reuse(self, host, executor, status):
+        '''
+        Time a second handshake, over the master connection of the first
+        one. A failure only means there is no measure.
+        '''
+        loop = asyncio.get_running_loop()
+        reuse_start = time.monotonic()
+        try:
+            await loop.run_in_executor(executor, self.handshake, host)
+            status['reuse_time'] = time.monotonic() - reuse_start
+        except Exception as err:
+            self.slog.logger.debug("[%s] reuse check failed [%s]", host, err)
+
+    async def probe_hosts(self, hosts):
+        '''
+        Probe all the hosts concurrently.
+        '''
+        semaphore = asyncio.Semaphore(self.concurrency)
+        report = {}
+        for host in hosts:
+            report[host] = {
+                'ready': False,
+                'attempts': 0,
+                'time_to_ready': None,
+                'handshake_time': None,
+                'reuse_time': None,
+                'error': None
+            }
+        # The default executor has fewer threads than the concurrency
+        # limit, the handshakes get their own pool of that size.
+        with futures.ThreadPoolExecutor(
+                max_workers=self.concurrency) as executor:
+            await asyncio.gather(*[self.probe_host(host, semaphore,
+                                                   executor, report)
+                                   for host in report])
+        return report
+
+    def wait_for_hosts(self, hosts):
+        '''
+        Wait for ssh connectivity to the hosts. Returns a per host report
+        with 'ready', 'attempts', 'time_to_ready', 'handshake_time',
+        'reuse_time' and 'error'.
+        '''
+        return asyncio.run(self.probe_hosts(hosts))
+
+
+def format_report(report):
+    '''
+    Return the readiness report as printable lines, in host order.
+    '''
+    lines = []
+    for host in sorted(report.keys()):
+        status = report[host]
+        if status['ready']:
+            lines.append("%-20s ready      %6.1fs  attempts: %d" %
+                         (host, status['time_to_ready'],
+                          status['attempts']))
+        else:
+            lines.append("%-20s not ready          attempts: %d  [%s]" %
+                         (host, status['attempts'], status['error']))
+
+    return lines
+
+
+def connection_savings(report):
+    '''
+    Return the average handshake time of a new connection and of a
+    connection over the master, in ms, and what reusing the master saves
+    per connection, over the hosts with both measures. Empty without any.
+    '''
+    measures = [(status['handshake_time'], status['reuse_time'])
+                for status in report.values()
+                if status.get('handshake_time') is not None and
+                status.get('reuse_time') is not None]
+    if not measures:
+        return {}
+
+    setup = 1000.0 * sum([measure[0] for measure in measures]) / \
+        len(measures)
+    reuse = 1000.0 * sum([measure[1] for measure in measures]) / \
+        len(measures)
+    return {'setup_ms': round(setup, 1),
+            'reuse_ms': round(reuse, 1),
+            'saved_ms': round(setup - reuse, 1)}
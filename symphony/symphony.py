@@ -4,13 +4,33 @@
 '''
 Symphony:
 ---------
+The symphony CLI. Run it from the repository root:
 
-
+    python -m symphony.symphony <operation> [options]
 '''
 
 import sys
 import argparse
-import main.helper as helper
+import utils.lazy_import as lazy_import
+
+# The helper is only imported once the CLI is parsed, so -h and an
+# invalid command line do not pay for it.
+helper = lazy_import.LazyModule("symphony.helper")
+daemon = lazy_import.LazyModule("symphony.daemon")
+
+# tfparser.LIST_FORMATS, without importing tfparser for every operation.
+LIST_FORMATS = ["table", "json", "jsonl", "csv"]
+
+
+def tag_filter(tag):
+    '''
+    argparse type of a --tag key=value filter.
+    '''
+    key, sep, _ = tag.partition("=")
+    if not sep or not key:
+        raise argparse.ArgumentTypeError(
+            "invalid tag filter %s, expected key=value" % tag)
+    return tag
 
 
 class SymphonyCli(object):
@@ -64,6 +84,22 @@ class SymphonyCli(object):
                                     dest="skip_deploy",
                                     action="store_true",
                                     help="Skip Deploy step (tf apply/plan)")
+                parser.add_argument("--jobs",
+                                    required=False,
+                                    type=int,
+                                    default=1,
+                                    help="Number of clusters to render "
+                                    "concurrently")
+                parser.add_argument("--incremental",
+                                    required=False,
+                                    action="store_true",
+                                    help="Skip clusters unchanged since the "
+                                    "last build")
+                parser.add_argument("--timings",
+                                    required=False,
+                                    action="store_true",
+                                    help="Show the time spent in each phase, "
+                                    "and write a JSON report")
             elif operation == "deploy":
                 # Deploy Operation Option.
                 parser = argparse.ArgumentParser(
@@ -74,6 +110,44 @@ class SymphonyCli(object):
                 parser.add_argument("--staging",
                                     required=True,
                                     help="Path to terraform staging directory")
+                parser.add_argument("--all",
+                                    required=False,
+                                    action="store_true",
+                                    help="Deploy every environment under the "
+                                    "staging directory")
+                parser.add_argument("--jobs",
+                                    required=False,
+                                    type=int,
+                                    default=1,
+                                    help="Number of environments to deploy "
+                                    "concurrently (with --all)")
+                parser.add_argument("--plugin-mirror",
+                                    required=False,
+                                    dest="plugin_mirror",
+                                    help="Local directory to install the "
+                                    "terraform providers from (with --all)")
+                parser.add_argument("--targeted",
+                                    required=False,
+                                    action="store_true",
+                                    help="Only apply the resources of the "
+                                    "clusters changed since the last apply")
+                parser.add_argument("--json-events",
+                                    required=False,
+                                    dest="json_events",
+                                    action="store_true",
+                                    help="Run terraform with JSON output and "
+                                    "report per resource timings")
+                parser.add_argument("--auto-approve",
+                                    required=False,
+                                    dest="auto_approve",
+                                    action="store_true",
+                                    help="Apply the plan without asking for "
+                                    "confirmation (required with --all)")
+                parser.add_argument("--timings",
+                                    required=False,
+                                    action="store_true",
+                                    help="Show the time spent in each phase, "
+                                    "and write a JSON report")
             elif operation == "configure":
                 # Configure Operation Option.
                 parser = argparse.ArgumentParser(
@@ -91,6 +165,29 @@ class SymphonyCli(object):
                 parser.add_argument("--staging",
                                     required=True,
                                     help="Path to terraform staging directory")
+                parser.add_argument("--ssh-concurrency",
+                                    required=False,
+                                    dest="ssh_concurrency",
+                                    type=int,
+                                    default=20,
+                                    help="Max hosts probed concurrently when "
+                                    "waiting for ssh")
+                parser.add_argument("--jobs",
+                                    required=False,
+                                    type=int,
+                                    default=1,
+                                    help="Number of playbooks to run "
+                                    "concurrently")
+                parser.add_argument("--batch",
+                                    required=False,
+                                    action="store_true",
+                                    help="Run the services of each cluster "
+                                    "as one playbook")
+                parser.add_argument("--timings",
+                                    required=False,
+                                    action="store_true",
+                                    help="Show the time spent in each phase, "
+                                    "and write a JSON report")
             elif operation == "destroy":
                 # Destroy Operation.
                 parser = argparse.ArgumentParser(
@@ -111,6 +208,61 @@ class SymphonyCli(object):
                 parser.add_argument("--staging",
                                     required=True,
                                     help="Path to terraform staging directory")
+                parser.add_argument("--format",
+                                    required=False,
+                                    dest="list_format",
+                                    choices=LIST_FORMATS,
+                                    default="table",
+                                    help="Output format (default table)")
+                parser.add_argument("--env",
+                                    required=False,
+                                    dest="list_envs",
+                                    action="append",
+                                    help="Only list this environment, can "
+                                    "be repeated")
+                parser.add_argument("--type",
+                                    required=False,
+                                    dest="list_types",
+                                    action="append",
+                                    help="Only list this resource type, can "
+                                    "be repeated")
+                parser.add_argument("--tag",
+                                    required=False,
+                                    dest="list_tags",
+                                    action="append",
+                                    type=tag_filter,
+                                    help="Only list the resources with this "
+                                    "key=value tag, can be repeated")
+            elif operation == "summary":
+                # Summary Operation.
+                parser = argparse.ArgumentParser(
+                    prog="symphony",
+                    formatter_class=argparse.RawTextHelpFormatter,
+                    description=self.show_summary_help())
+
+                parser.add_argument("--staging",
+                                    required=True,
+                                    help="Path to terraform staging directory")
+            elif operation == "daemon":
+                # Daemon Operation.
+                parser = argparse.ArgumentParser(
+                    prog="symphony",
+                    formatter_class=argparse.RawTextHelpFormatter,
+                    description=self.show_daemon_help())
+
+                parser.add_argument("--socket",
+                                    required=False,
+                                    help="Unix socket path (default "
+                                    "~/.symphony/daemon.sock)")
+                parser.add_argument("--stop",
+                                    required=False,
+                                    action="store_true",
+                                    help="Stop the running daemon")
+                parser.add_argument("--status",
+                                    required=False,
+                                    action="store_true",
+                                    help="Show the status of the running "
+                                    "daemon")
 
             else:
                 operation = None
@@ -143,7 +295,32 @@ class SymphonyCli(object):
             " staging: Location where terraform files are generated.\n"
         msg += "\n"
         msg += "The deploy step runs the terraform apply on the rendered\n" \
-            "terraform definitions in the staging location\n"
+            "terraform definitions in the staging location. The plan is\n" \
+            "shown, and applied once confirmed with 'yes', or right away\n" \
+            "with --auto-approve.\n"
+        msg += "\n"
+        msg += "With --all, staging is the staging root, and terraform init,\n" \
+            "plan and apply run in every <name>_<environment> directory\n" \
+            "under it, --jobs N at a time. The output of each environment\n" \
+            "is prefixed with its name, and a summary of exit codes and\n" \
+            "durations is shown at the end. The plans are applied without\n" \
+            "confirmation, --all needs --auto-approve.\n"
+        msg += "\n"
+        msg += "terraform init uses a shared provider plugin cache,\n" \
+            "~/.symphony/plugin-cache (or $SYMPHONY_PLUGIN_CACHE_DIR),\n" \
+            "and is skipped when the providers, modules and backend are\n" \
+            "unchanged since the last init. --plugin-mirror <dir> installs\n" \
+            "the providers from a local directory instead of downloading.\n"
+        msg += "\n"
+        msg += "With --targeted, only the resources defined in the cluster\n" \
+            ".tf files changed since the last successful apply are planned\n" \
+            "and applied (terraform -target). A change to common.tf, or to\n" \
+            "provider or variable definitions, still applies everything.\n"
+        msg += "\n"
+        msg += "With --json-events (terraform 0.15.3+), plan and apply run\n" \
+            "with -json. The slowest resources and the time spent per\n" \
+            "resource type are shown at the end, and the timings of every\n" \
+            "resource are written to <staging>/terraform_report.json\n"
 
         return msg
 
@@ -160,6 +337,21 @@ class SymphonyCli(object):
         msg += "\n"
         msg += "The configure step runs through the ansible playbooks for\n" \
             "configuring the required services as asked by the user.\n"
+        msg += "\n"
+        msg += "With --jobs N, playbooks for independent clusters run\n" \
+            "concurrently. Use 'depends_on' on a cluster or service to\n" \
+            "order them. Playbook logs are written to\n" \
+            "<staging>/.symphony/logs/<cluster>_<service>.log\n"
+        msg += "\n"
+        msg += "With --batch, the services of each cluster run as one\n" \
+            "playbook, <staging>/.symphony/playbooks/<cluster>.yaml, that\n" \
+            "imports the site.yaml of each service with its vars. The\n" \
+            "inventory and the facts are loaded once per cluster. Logs go\n" \
+            "to <staging>/.symphony/logs/<cluster>.log\n"
+        msg += "\n"
+        msg += "--timings shows the time spent in each phase at the end,\n" \
+            "and writes it to <staging>/.symphony/timings/<operation>-\n" \
+            "<time>.json, to compare runs (build and deploy too).\n"
 
         return msg
 
@@ -189,6 +381,43 @@ class SymphonyCli(object):
         msg += "\n"
         msg += "The list operation parsers through the staging location\n" \
             "to display a tabular list of resources generated per cluster.\n"
+        msg += "\n"
+        msg += " format: table (default), or json, jsonl or csv with a row\n" \
+            " per resource, written as the states are scanned.\n"
+        msg += " env, type, tag: Only list the resources of an environment,\n" \
+            " of a resource type, or with a key=value tag. Each can be\n" \
+            " repeated, a resource must match all the tags.\n"
+
+        return msg
+
+    def show_summary_help(self):
+        '''
+        Display help for Summary operation
+        '''
+        msg = self.__print_banner()
+        msg += "Operation: Summary\n"
+        msg += "summary operation takes the following user inputs:\n" \
+            " staging: Location where the terraform files are generated.\n"
+        msg += "\n"
+        msg += "The summary operation prints the resources of each\n" \
+            "environment under the staging location as JSON.\n"
+
+        return msg
+
+    def show_daemon_help(self):
+        '''
+        Display help for Daemon operation
+        '''
+        msg = self.__print_banner()
+        msg += "Operation: Daemon\n"
+        msg += "The daemon is a long running symphony process, that keeps\n" \
+            "the parsed configs, templates and terraform states in memory.\n"
+        msg += "While it runs, build, list, summary and the dynamic\n" \
+            "inventory are run by the daemon, and in process otherwise.\n"
+        msg += "\n"
+        msg += " socket: The unix socket of the daemon, defaults to\n" \
+            " $SYMPHONY_DAEMON_SOCKET or ~/.symphony/daemon.sock.\n"
+        msg += " SYMPHONY_DAEMON=0 runs the operations in process.\n"
 
         return msg
 
@@ -213,26 +442,36 @@ class SymphonyCli(object):
         msg += " symphony will generate the terraform file based on the\n" \
             " configuration specified in the config file.\n" \
             " A templates are located under templates/ folder\n"
+        msg += "\n"
+        msg += " jobs: Number of clusters rendered concurrently (default 1).\n" \
+            " Errors are reported per cluster at the end of the build.\n"
+        msg += "\n"
+        msg += " incremental: Only render clusters whose config, template or\n" \
+            " init script changed since the last build. Hashes are kept in\n" \
+            " <staging>/<name>_<environment>/.symphony/build_manifest.json\n"
 
         return msg
 
     def show_help(self):
         '''
-        Display Help
+        Display Help, on stderr so it does not mix with the output of
+        the list formats.
         '''
-        print self.__print_banner()
-        print "\nUsage: symphony <operation> [options]"
-        print "\nOperation Types:"
-        print "-" * 40
-        print "build"
-        print "deploy"
-        print "configure"
-        print "destroy"
-        print "list"
-        print "\n"
-        print "To display command specific help:"
-        print "symphony <operation> -h"
-        print ""
+        print(self.__print_banner(), file=sys.stderr)
+        print("\nUsage: symphony <operation> [options]", file=sys.stderr)
+        print("\nOperation Types:", file=sys.stderr)
+        print("-" * 40, file=sys.stderr)
+        print("build", file=sys.stderr)
+        print("deploy", file=sys.stderr)
+        print("configure", file=sys.stderr)
+        print("destroy", file=sys.stderr)
+        print("list", file=sys.stderr)
+        print("summary", file=sys.stderr)
+        print("daemon", file=sys.stderr)
+        print("\n", file=sys.stderr)
+        print("To display command specific help:", file=sys.stderr)
+        print("symphony <operation> -h", file=sys.stderr)
+        print("", file=sys.stderr)
 
     def generate_operation_object(self, cli_namespace):
         '''
@@ -266,6 +505,71 @@ class SymphonyCli(object):
         except AttributeError:
             pass
 
+        try:
+            obj['jobs'] = cli_namespace.jobs
+        except AttributeError:
+            pass
+
+        try:
+            obj['incremental'] = cli_namespace.incremental
+        except AttributeError:
+            pass
+
+        try:
+            obj['ssh_concurrency'] = cli_namespace.ssh_concurrency
+        except AttributeError:
+            pass
+
+        try:
+            obj['batch'] = cli_namespace.batch
+        except AttributeError:
+            pass
+
+        try:
+            obj['all'] = cli_namespace.all
+        except AttributeError:
+            pass
+
+        try:
+            obj['plugin_mirror'] = cli_namespace.plugin_mirror
+        except AttributeError:
+            pass
+
+        try:
+            obj['targeted'] = cli_namespace.targeted
+        except AttributeError:
+            pass
+
+        try:
+            obj['json_events'] = cli_namespace.json_events
+        except AttributeError:
+            pass
+
+        try:
+            obj['auto_approve'] = cli_namespace.auto_approve
+        except AttributeError:
+            pass
+
+        try:
+            obj['timings'] = cli_namespace.timings
+        except AttributeError:
+            pass
+
+        try:
+            obj['list_format'] = cli_namespace.list_format
+            obj['list_envs'] = cli_namespace.list_envs
+            obj['list_types'] = cli_namespace.list_types
+            obj['list_tags'] = cli_namespace.list_tags
+        except AttributeError:
+            pass
+
+        try:
+            obj['socket'] = cli_namespace.socket
+            obj['stop'] = cli_namespace.stop
+            obj['status'] = cli_namespace.status
+        except AttributeError:
+            pass
+
         return obj
 
 
@@ -276,7 +580,7 @@ def main():
     Parse the CLI, and invoke the helper to perform the operation.
     '''
     clihandler = SymphonyCli(sys.argv)
-    print "Namespace: ", clihandler.namespace
+    print("Namespace: ", clihandler.namespace, file=sys.stderr)
 
     # If the operation is not set, exit here.
     if clihandler.namespace.operation is None:
@@ -285,15 +589,23 @@ def main():
     # From the parse object generated a dictionary which can be
     # passed to the helper class.
     operobj = clihandler.generate_operation_object(clihandler.namespace)
-    print operobj
+    print(operobj, file=sys.stderr)
+
+    if operobj['operation'] == "daemon":
+        sys.exit(daemon.run_daemon(operobj))
+
+    # Let the symphony daemon run the operation when one is running.
+    ret = daemon.run_operation(operobj)
+    if ret is not None:
+        sys.exit(ret)
 
     helperobj = helper.Helper(operobj)
-    print helperobj.valid
+    print(helperobj.valid, file=sys.stderr)
     if not helperobj.valid:
-        print "Helper Initialization Failed."
-        sys.exit()
+        print("Helper Initialization Failed.")
+        sys.exit(1)
 
-    helperobj.perform_operation()
+    sys.exit(helperobj.perform_operation())
 
 
 
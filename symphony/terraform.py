@@ -3,21 +3,288 @@
 
 '''
 Handle Terraforrm operations
+
+terraform init installs the provider plugins of every staging dir into
+its own .terraform/. Symphony points all of them at a shared plugin cache
+(TF_PLUGIN_CACHE_DIR), so each provider version is downloaded and stored
+once, and can install from a local mirror instead of downloading.
+terraform does not support concurrent inits writing to the same plugin
+cache. An init that has to add a provider to the cache holds its lock
+alone, the inits finding all their providers in it share the lock and
+run together.
+
+Init is skipped in a staging dir when its terraform, provider and module
+blocks, the providers of its resource and data types, the lock file and
+the init options are the same as at the last successful init there. The hash is kept in <staging>/.symphony/.
 '''
 import os
+import re
 import sys
+import json
+import fcntl
 import asyncio
+import hashlib
+import contextlib
 import subprocess
 import utils.symphony_logger as logger
 import symphony.command as command
 
 
+PLUGIN_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".symphony",
+                                "plugin-cache")
+INIT_STATE_DIR = ".symphony"
+INIT_HASH_FILE = "terraform_init.sha256"
+PLAN_FILE = "symphony.tfplan"
+APPLIED_FILE = "terraform_applied.json"
+LOCK_FILE = ".terraform.lock.hcl"
+PLUGIN_CACHE_LOCK = ".symphony-init.lock"
+INIT_BLOCK_RE = re.compile(r'^(terraform|provider|module)\b[^{\n]*\{', re.M)
+TYPE_BLOCK_RE = re.compile(r'^(?:resource|data)\s+"([a-z0-9-]+)_', re.M)
+PROVIDER_BLOCK_RE = re.compile(r'^provider\s+"([^"]+)"', re.M)
+LOCK_PROVIDER_RE = re.compile(r'^provider\s+"([^"]+)"\s*\{([^}]*)\}', re.M)
+LOCK_VERSION_RE = re.compile(r'^\s*version\s*=\s*"([^"]+)"', re.M)
+PLUGIN_BINARY_RE = re.compile(
+    r'^terraform-provider-([a-z0-9-]+?)(?:_v([^_]+)(?:_.*)?)?$')
+ADDRESS_BLOCK_RE = re.compile(
+    r'^(resource|data|module)\s+"([^"]+)"(?:\s+"([^"]+)")?', re.M)
+TOP_LEVEL_RE = re.compile(r'^([A-Za-z_][A-Za-z0-9_]*)[\s"{]', re.M)
+# Changes to files with only these blocks can be applied with -target.
+TARGETABLE_BLOCKS = frozenset(["resource", "data", "module", "output"])
+
+
+def get_plugin_cache_dir():
+    '''
+    Return the shared plugin cache dir, SYMPHONY_PLUGIN_CACHE_DIR or
+    ~/.symphony/plugin-cache.
+    '''
+    return os.environ.get('SYMPHONY_PLUGIN_CACHE_DIR', PLUGIN_CACHE_DIR)
+
+
+@contextlib.contextmanager
+def plugin_cache_lock(plugin_cache_dir, shared=False):
+    '''
+    Hold the lock of a plugin cache, across threads and processes. Shared
+    for the inits only reading the cache, else exclusive.
+    '''
+    lock_file = os.path.join(plugin_cache_dir, PLUGIN_CACHE_LOCK)
+    with open(lock_file, "a") as lock_fp:
+        fcntl.flock(lock_fp, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_fp, fcntl.LOCK_UN)
+
+
+def extract_init_blocks(text):
+    '''
+    Return the top level terraform, provider and module blocks of a .tf
+    file, the parts that terraform init depends on.
+    '''
+    blocks = []
+    for match in INIT_BLOCK_RE.finditer(text):
+        depth = 0
+        for idx in range(match.end() - 1, len(text)):
+            if text[idx] == "{":
+                depth += 1
+            elif text[idx] == "}":
+                depth -= 1
+                if depth == 0:
+                    break
+        blocks.append(text[match.start():idx + 1])
+
+    return blocks
+
+
+def find_type_providers(text):
+    '''
+    Return the providers of the resource and data types of a .tf file,
+    the prefix of the type. terraform init installs them even without a
+    provider block.
+    '''
+    return set(TYPE_BLOCK_RE.findall(text))
+
+
+def find_cached_plugins(plugin_cache_dir):
+    '''
+    Return the versions of every provider in a plugin cache, by name. The
+    version is None when the plugin binary name has none.
+    '''
+    plugins = {}
+    for _, _, files in os.walk(plugin_cache_dir):
+        for name in files:
+            match = PLUGIN_BINARY_RE.match(name)
+            if match is not None:
+                plugins.setdefault(match.group(1), set()).add(match.group(2))
+
+    return plugins
+
+
+def needs_cache_fill(staging_dir, plugin_cache_dir):
+    '''
+    Return True if init in a staging dir would add a provider to the
+    plugin cache: a provider of its provider blocks, resource and data
+    types, or a version pinned in its lock file, is not in the cache.
+    '''
+    required = {}
+    for tf_file in os.listdir(staging_dir):
+        if not tf_file.endswith(".tf"):
+            continue
+        with open(os.path.join(staging_dir, tf_file), "r") as tf_fp:
+            text = tf_fp.read()
+        for provider in set(PROVIDER_BLOCK_RE.findall(text)) | \
+                find_type_providers(text):
+            required.setdefault(provider, None)
+
+    lock_file = os.path.join(staging_dir, LOCK_FILE)
+    if os.path.exists(lock_file):
+        with open(lock_file, "r") as lock_fp:
+            for address, body in LOCK_PROVIDER_RE.findall(lock_fp.read()):
+                version = LOCK_VERSION_RE.search(body)
+                required[address.split("/")[-1]] = \
+                    version.group(1) if version else None
+
+    cached = find_cached_plugins(plugin_cache_dir)
+    for provider, version in required.items():
+        versions = cached.get(provider, set())
+        if not versions:
+            return True
+        if version is not None and version not in versions and \
+                None not in versions:
+            return True
+
+    return False
+
+
+def compute_init_hash(staging_dir, options):
+    '''
+    Return the hash of what terraform init depends on in a staging dir.
+    '''
+    digest = hashlib.sha256()
+    digest.update(json.dumps(options, sort_keys=True).encode("utf-8"))
+    providers = set()
+    for tf_file in sorted(os.listdir(staging_dir)):
+        if not tf_file.endswith(".tf"):
+            continue
+        with open(os.path.join(staging_dir, tf_file), "r") as tf_fp:
+            text = tf_fp.read()
+        digest.update(tf_file.encode("utf-8"))
+        for block in extract_init_blocks(text):
+            digest.update(block.encode("utf-8"))
+        providers.update(find_type_providers(text))
+    digest.update(json.dumps(sorted(providers)).encode("utf-8"))
+
+    lock_file = os.path.join(staging_dir, LOCK_FILE)
+    if os.path.exists(lock_file):
+        with open(lock_file, "rb") as lock_fp:
+            digest.update(lock_fp.read())
+
+    return digest.hexdigest()
+
+
+def describe_tf_file(text):
+    '''
+    Return the resource addresses defined in a .tf file, and whether a
+    change to the file can be applied by targeting them. Files with
+    provider, variable, locals or terraform blocks, or anything not
+    understood, affect more than their own resources.
+    '''
+    addresses = []
+    for match in ADDRESS_BLOCK_RE.finditer(text):
+        kind, first, second = match.groups()
+        if kind == "resource":
+            addresses.append("%s.%s" % (first, second))
+        elif kind == "data":
+            addresses.append("data.%s.%s" % (first, second))
+        else:
+            addresses.append("module.%s" % first)
+
+    keywords = set(TOP_LEVEL_RE.findall(text))
+    return addresses, keywords.issubset(TARGETABLE_BLOCKS)
+
+
+def snapshot_tf_files(staging_dir):
+    '''
+    Return the digest, resource addresses and targetability of every .tf
+    file in a staging dir. A cluster init script (scripts/<name>.sh) is
+    part of the digest of <name>.tf, which loads it.
+    '''
+    snapshot = {}
+    for tf_file in sorted(os.listdir(staging_dir)):
+        if not tf_file.endswith(".tf"):
+            continue
+        with open(os.path.join(staging_dir, tf_file), "r") as tf_fp:
+            text = tf_fp.read()
+        digest = hashlib.sha256(text.encode("utf-8"))
+        script = os.path.join(staging_dir, "scripts", tf_file[:-3] + ".sh")
+        if os.path.exists(script):
+            with open(script, "rb") as script_fp:
+                digest.update(script_fp.read())
+
+        addresses, targetable = describe_tf_file(text)
+        snapshot[tf_file] = {'digest': digest.hexdigest(),
+                             'addresses': addresses,
+                             'targetable': targetable}
+
+    return snapshot
+
+
+def find_changed_targets(staging_dir):
+    '''
+    Return the resource addresses of the .tf files changed, added or
+    removed since the last successful apply, for -target. Returns None
+    when a full apply is needed: there is no record of a previous apply,
+    nothing changed, or a changed file is not targetable.
+    '''
+    applied_file = os.path.join(staging_dir, INIT_STATE_DIR, APPLIED_FILE)
+    try:
+        with open(applied_file, "r") as applied_fp:
+            applied = json.load(applied_fp)
+    except (IOError, OSError, ValueError):
+        return None
+
+    current = snapshot_tf_files(staging_dir)
+    targets = set()
+    for tf_file in set(applied) | set(current):
+        old = applied.get(tf_file)
+        new = current.get(tf_file)
+        if old is not None and new is not None and \
+                old['digest'] == new['digest']:
+            continue
+        for entry in [old, new]:
+            if entry is None:
+                continue
+            if not entry['targetable']:
+                return None
+            targets.update(entry['addresses'])
+
+    if not targets:
+        return None
+    return sorted(targets)
+
+
+def record_applied(staging_dir):
+    '''
+    Record the .tf files of a successful apply, for find_changed_targets.
+    '''
+    applied_file = os.path.join(staging_dir, INIT_STATE_DIR, APPLIED_FILE)
+    if not os.path.exists(os.path.dirname(applied_file)):
+        os.makedirs(os.path.dirname(applied_file))
+    with open(applied_file, "w") as applied_fp:
+        json.dump(snapshot_tf_files(staging_dir), applied_fp, indent=2)
+
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
 class Terraform(object):
     '''
     Terraform handler
     '''
     def __init__(self, tf_staging_dir, slogger=None):
-        print("Terraform class init")
         self.initialized = False
         self.cmdobj = command.Command()
         if slogger is None:
@@ -43,6 +310,10 @@ class Terraform(object):
         lock = kwargs.get("lock", True)
         var_file = kwargs.get("var_file", None)
         auto_approve = kwargs.get("auto_approve", True)
+        plugin_mirror = kwargs.get("plugin_mirror", None)
+        plan_file = kwargs.get("plan_file", None)
+        targets = kwargs.get("targets", None) or []
+        json_events = kwargs.get("json_events", False)
 
 
         if operation == "init":
@@ -50,47 +321,159 @@ class Terraform(object):
                 command.append("-get-plugins=false")
             if not lock:
                 command.append("-lock=false")
+            if plugin_mirror is not None:
+                command.append("-plugin-dir=%s" % plugin_mirror)
         elif operation == "plan":
+            if json_events:
+                command.append("-json")
             if var_file is not None:
                 cmdoption = "-var-file=%s" % var_file
                 command.append(cmdoption)
+            for target in targets:
+                command.append("-target=%s" % target)
+            if plan_file is not None:
+                command.append("-out=%s" % plan_file)
         elif operation == "apply":
+            if json_events:
+                command.append("-json")
             if auto_approve:
                 command.append("-auto-approve")
-            if var_file is not None:
-                cmdoption = "-var-file=%s" % var_file
-                command.append(cmdoption)
+            # The variables are in the saved plan, terraform rejects
+            # them when applying it.
+            if plan_file is not None:
+                command.append(plan_file)
+            else:
+                if var_file is not None:
+                    cmdoption = "-var-file=%s" % var_file
+                    command.append(cmdoption)
+                for target in targets:
+                    command.append("-target=%s" % target)
 
         return command
 
+    def run_command(self, cmd, staging_dir, env=None, sinks=None):
+        '''
+        Run a terraform command, returning (ret, stdout, stderr). With
+        sinks, the output is streamed to them as it comes, and only its
+        tail is returned.
+        '''
+        if sinks:
+            return self.cmdobj.execute_async(cmd, cwd=staging_dir, env=env,
+                                             sinks=sinks)
+        return self.cmdobj.execute_run(cmd, cwd=staging_dir, env=env)
+
     def terraform_init(self, staging_dir, **kwargs):
-        ''' Handle Terraform init '''
+        ''' Handle Terraform init
+
+        Besides the init options, takes:
+            plugin_cache_dir: The shared plugin cache, defaults to
+                get_plugin_cache_dir(). False to not use a cache.
+            plugin_mirror: A local dir holding the provider plugins, to
+                install them from instead of downloading.
+            force: Run init even if nothing changed since the last init.
+        '''
+        plugin_cache_dir = kwargs.get("plugin_cache_dir", None)
+        if plugin_cache_dir is None:
+            plugin_cache_dir = get_plugin_cache_dir()
+
+        options = {
+            'get_plugins': kwargs.get("get_plugins", True),
+            'lock': kwargs.get("lock", True),
+            'plugin_mirror': kwargs.get("plugin_mirror", None),
+            'plugin_cache_dir': plugin_cache_dir or None
+        }
+        init_hash = compute_init_hash(staging_dir, options)
+        hash_file = os.path.join(staging_dir, INIT_STATE_DIR, INIT_HASH_FILE)
+        if not kwargs.get("force", False) and \
+                os.path.isdir(os.path.join(staging_dir, ".terraform")) and \
+                self.read_hash(hash_file) == init_hash:
+            self.slog.logger.info("Skipping terraform init in [%s], "
+                                  "providers unchanged", staging_dir)
+            return 0, "Terraform init skipped, providers unchanged\n", ""
+
+        env = None
+        if plugin_cache_dir:
+            if not os.path.exists(plugin_cache_dir):
+                os.makedirs(plugin_cache_dir)
+            env = dict(os.environ, TF_PLUGIN_CACHE_DIR=plugin_cache_dir)
+
         self.slog.logger.info("Executing terraform init")
         init_cmd = self.generate_terraform_command("init", **kwargs)
-        ret, stdout, stderr = self.cmdobj.execute_run(init_cmd, cwd=staging_dir)
+        with contextlib.ExitStack() as stack:
+            if plugin_cache_dir:
+                shared = not needs_cache_fill(staging_dir, plugin_cache_dir)
+                stack.enter_context(plugin_cache_lock(plugin_cache_dir,
+                                                      shared=shared))
+            ret, stdout, stderr = self.run_command(
+                init_cmd, staging_dir, env=env, sinks=kwargs.get("sinks"))
         if ret != 0:
-            print("Failed to execute terraform init")
+            self.slog.logger.error("Failed to execute terraform init")
+        else:
+            # init writes the lock file, hash what the next init sees.
+            self.write_hash(hash_file,
+                            compute_init_hash(staging_dir, options))
         self.slog.logger.debug("Stdout: %s, Stderr: %s", stdout, stderr)
         return ret, stdout, stderr
 
+    def read_hash(self, hash_file):
+        try:
+            with open(hash_file, "r") as hash_fp:
+                return hash_fp.read().strip()
+        except (IOError, OSError):
+            return None
+
+    def write_hash(self, hash_file, init_hash):
+        try:
+            if not os.path.exists(os.path.dirname(hash_file)):
+                os.makedirs(os.path.dirname(hash_file))
+            with open(hash_file, "w") as hash_fp:
+                hash_fp.write(init_hash + "\n")
+        except (IOError, OSError) as err:
+            self.slog.logger.error("Failed to write [%s] [%s]",
+                                   hash_file, err)
+
     def terraform_plan(self, staging_dir, **kwargs):
-        '''Handling terraform plan command'''
+        '''Handling terraform plan command
+
+        With plan_file, the plan is saved to that file (relative to the
+        staging dir), for terraform_apply to apply. There is no plan skip,
+        the state may have changed since the last plan, in a remote
+        backend too.
+
+        With targets, only those resource addresses (and what they depend
+        on) are planned.
+        '''
         self.slog.logger.info("Executing terraform plan")
         plan_cmd = self.generate_terraform_command("plan", **kwargs)
-        print("Plan cmd: ", plan_cmd)
-        ret, stdout, stderr = self.cmdobj.execute_run(plan_cmd, cwd=staging_dir)
+        self.slog.logger.debug("Plan cmd: %s", plan_cmd)
+        ret, stdout, stderr = self.run_command(plan_cmd, staging_dir,
+                                               sinks=kwargs.get("sinks"))
         if ret != 0:
             self.slog.logger.error("Plan %s failed", plan_cmd)
 
         return ret, stdout, stderr
 
     def terraform_apply(self, staging_dir, **kwargs):
-        '''Handling terraform apply command'''
+        '''Handling terraform apply command
+
+        With plan_file, the saved plan is applied and then removed, as the
+        state it was made from is gone. A successful apply records the .tf
+        files, for find_changed_targets.
+        '''
+        plan_file = kwargs.get("plan_file", None)
         self.slog.logger.info("Executing terraform apply")
         apply_cmd = self.generate_terraform_command("apply", **kwargs)
-        print("apply cmd: ", apply_cmd)
-        ret, stdout, stderr = self.cmdobj.execute_run(apply_cmd, cwd=staging_dir)
+        self.slog.logger.debug("apply cmd: %s", apply_cmd)
+        ret, stdout, stderr = self.run_command(apply_cmd, staging_dir,
+                                               sinks=kwargs.get("sinks"))
         if ret != 0:
             self.slog.logger.error("apply %s failed", apply_cmd)
+        else:
+            record_applied(staging_dir)
+
+        # After a failed apply the state may have changed, and terraform
+        # refuses a stale plan, so the plan file is not kept either way.
+        if plan_file is not None:
+            remove_file(os.path.join(staging_dir, plan_file))
 
         return ret, stdout, stderr
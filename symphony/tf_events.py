@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Terraform Event Stream:
+-----------------------
+With -json, terraform plan and apply write their UI as a stream of JSON
+events, one per line (terraform 0.15.3 and later). The events of
+interest here are the per resource hooks:
+
+    refresh_start, refresh_complete
+    apply_start, apply_progress, apply_complete, apply_errored
+
+EventSink parses the stream as it comes, as a command output sink, and
+keeps the start, finish and duration of every resource operation. The
+human readable @message of each event is passed on to the console.
+'''
+
+import json
+import datetime
+import threading
+
+
+REPORT_FILE = "terraform_report.json"
+
+
+def parse_timestamp(timestamp):
+    '''
+    Return an event @timestamp as seconds since the epoch, or None.
+    '''
+    if not timestamp:
+        return None
+    try:
+        parsed = datetime.datetime.fromisoformat(
+            timestamp.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return parsed.timestamp()
+
+
+class ResourceTimings(object):
+    '''
+    Start, finish and duration of each resource operation, from the
+    terraform events.
+    '''
+    def __init__(self):
+        self.operations = {}
+        self.order = []
+        self.diagnostics = []
+        self.change_summary = None
+        self.lock = threading.Lock()
+
+    def get_operation(self, phase, resource):
+        key = (phase, resource['addr'])
+        if key not in self.operations:
+            self.operations[key] = {
+                'address': resource['addr'],
+                'type': resource.get('resource_type'),
+                'phase': phase,
+                'action': None,
+                'start': None,
+                'finish': None,
+                'duration': None,
+                'status': "running"
+            }
+            self.order.append(key)
+        return self.operations[key]
+
+    def handle_event(self, event):
+        '''
+        Update the timings with one event.
+        '''
+        event_type = event.get('type')
+        hook = event.get('hook') or {}
+        resource = hook.get('resource')
+        timestamp = parse_timestamp(event.get('@timestamp'))
+
+        with self.lock:
+            if event_type == "diagnostic":
+                self.diagnostics.append(event.get('diagnostic', {}))
+                return
+            if event_type == "change_summary":
+                self.change_summary = event.get('changes')
+                return
+            if resource is None or 'addr' not in resource:
+                return
+
+            phase = "refresh" if event_type.startswith("refresh_") \
+                else "apply"
+            if event_type in ("apply_start", "refresh_start"):
+                operation = self.get_operation(phase, resource)
+                operation['start'] = timestamp
+                operation['action'] = hook.get('action')
+            elif event_type in ("apply_complete", "refresh_complete",
+                                "apply_errored"):
+                operation = self.get_operation(phase, resource)
+                operation['finish'] = timestamp
+                operation['status'] = "error" \
+                    if event_type == "apply_errored" else "ok"
+                if operation['action'] is None:
+                    operation['action'] = hook.get('action')
+                if hook.get('elapsed_seconds') is not None:
+                    operation['duration'] = float(hook['elapsed_seconds'])
+                elif operation['start'] is not None and \
+                        timestamp is not None:
+                    operation['duration'] = timestamp - operation['start']
+
+    def get_operations(self, phase=None):
+        return [self.operations[key] for key in self.order
+                if phase is None or key[0] == phase]
+
+    def totals_by_type(self, phase="apply"):
+        '''
+        Return {resource type: {'count', 'duration'}} for a phase.
+        '''
+        totals = {}
+        for operation in self.get_operations(phase):
+            total = totals.setdefault(operation['type'],
+                                      {'count': 0, 'duration': 0.0})
+            total['count'] += 1
+            total['duration'] += operation['duration'] or 0.0
+        return totals
+
+    def report(self):
+        '''
+        Return the timings as a JSON serializable dictionary.
+        '''
+        return {
+            'operations': self.get_operations(),
+            'totals_by_type': self.totals_by_type(),
+            'change_summary': self.change_summary,
+            'errors': [diag.get('summary') for diag in self.diagnostics
+                       if diag.get('severity') == "error"]
+        }
+
+    def write_report(self, report_file):
+        with open(report_file, "w") as report_fp:
+            json.dump(self.report(), report_fp, indent=2)
+
+    def summary(self, top=10):
+        '''
+        Return the slowest resources and the totals by resource type, as
+        printable lines.
+        '''
+        operations = [operation for operation in self.get_operations("apply")
+                      if operation['duration'] is not None]
+        operations.sort(key=lambda operation: operation['duration'],
+                        reverse=True)
+
+        lines = []
+        lines.append("Slowest resources:")
+        lines.append("%-50s %-8s %-7s %9s" % ("Resource", "Action", "Status",
+                                              "Duration"))
+        lines.append("-" * 77)
+        for operation in operations[:top]:
+            lines.append("%-50s %-8s %-7s %8.1fs" %
+                         (operation['address'], operation['action'],
+                          operation['status'], operation['duration']))
+
+        lines.append("")
+        lines.append("%-50s %6s %10s" % ("Resource type", "Count", "Total"))
+        lines.append("-" * 68)
+        totals = self.totals_by_type()
+        for restype in sorted(totals, key=lambda name:
+                              totals[name]['duration'], reverse=True):
+            lines.append("%-50s %6d %9.1fs" % (restype,
+                                               totals[restype]['count'],
+                                               totals[restype]['duration']))
+        errored = [operation for operation in self.get_operations()
+                   if operation['status'] == "error"]
+        lines.append("-" * 68)
+        lines.append("%d resources applied, %d failed" %
+                     (len(operations), len(errored)))
+
+        return lines
+
+
+class EventSink(object):
+    '''
+    Command output sink for the terraform JSON event stream. Lines that
+    are not JSON events are passed on as they are.
+    '''
+    def __init__(self, console=None, timings=None):
+        '''
+        :type console: sink
+        :param console: Sink for the human readable messages, like a
+                        command.ConsoleSink. None to drop them.
+
+        :type timings: ResourceTimings
+        :param timings: Where the timings are kept, a new one by default.
+        '''
+        self.console = console
+        self.timings = timings if timings is not None else ResourceTimings()
+
+    def write(self, source, line):
+        try:
+            event = json.loads(line)
+        except ValueError:
+            event = None
+
+        if not isinstance(event, dict):
+            if self.console is not None:
+                self.console.write(source, line)
+            return
+
+        self.timings.handle_event(event)
+        if self.console is not None and event.get('@message') is not None:
+            self.console.write(source, event['@message'] + "\n")
+
+    def close(self):
+        pass
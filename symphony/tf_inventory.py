@@ -3,26 +3,80 @@
 
 '''
 Ansible Dynamic inventory.
+
+ansible-playbook runs the inventory script for every playbook. The
+generated inventory is cached in <state root>/.symphony/inventory.json,
+and served from there while the fingerprints of the state files are
+unchanged. When a symphony daemon is running, the inventory comes from
+the daemon, which keeps it in memory.
+
+Environment:
+    TERRAFORM_STATE_ROOT:    The staging dir holding the tfstates
+    USE_PRIVATE_IP:          Use the private ips as ansible_ssh_host,
+                             unless 0, false, False or no
+    SYMPHONY_INVENTORY_CACHE: Set to 0 to disable the inventory cache
+    SYMPHONY_INVENTORY_TTL:  Max age of the cached inventory, in seconds.
+                             No limit by default.
+    SYMPHONY_DAEMON:         Set to 0 to not use the symphony daemon
+    SYMPHONY_TFSTATE_STREAMING: Set to 1 to stream the state files, for
+                             states too large to load in memory
 '''
 
-import sys
 import os
+import sys
+import time
 import argparse
 import json
-import main.tfparser as tfparser
+import threading
+
+# ansible runs this file as a script, with its directory first on
+# sys.path, where symphony/symphony.py shadows the symphony package. Put
+# the repository root there instead.
+if __name__ == '__main__':
+    SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+    sys.path = [path for path in sys.path
+                if os.path.abspath(path) != SCRIPT_DIR]
+    sys.path.insert(0, os.path.dirname(SCRIPT_DIR))
+
+import symphony.tfstate_cache as tfstate_cache
 import utils.symphony_logger as logger
+import utils.lazy_import as lazy_import
+
+# Not needed when the daemon serves the inventory.
+tfparser = lazy_import.LazyModule("symphony.tfparser")
+
+# symphony.daemon.DAEMON_SOCKET, without importing the daemon client.
+DAEMON_SOCKET = os.path.expanduser("~/.symphony/daemon.sock")
 
 
 class TFInventory(object):
-    def __init__(self):
+    def __init__(self, tf_root=None, priv_ip_flag=None, streaming=None):
+        '''
+        :type tf_root: string
+        :param tf_root: The state root, defaults to TERRAFORM_STATE_ROOT
+
+        :type priv_ip_flag: string
+        :param priv_ip_flag: Defaults to USE_PRIVATE_IP
+
+        :type streaming: Boolean
+        :param streaming: Stream the states, defaults to
+                          tfparser.streaming_enabled()
+        '''
         self.slog = logger.Logger(name="tf_inventory")
 
-        self.tf_root = os.environ.get('TERRAFORM_STATE_ROOT',
-                                      ".")
-        self.priv_ip_flag = os.environ.get('USE_PRIVATE_IP',
-                                           "True")
+        if tf_root is None:
+            tf_root = os.environ.get('TERRAFORM_STATE_ROOT', ".")
+        if priv_ip_flag is None:
+            priv_ip_flag = os.environ.get('USE_PRIVATE_IP', "True")
+        if streaming is None:
+            streaming = tfparser.streaming_enabled()
+        self.tf_root = tf_root
+        self.priv_ip_flag = priv_ip_flag
 
-        self.tfparser = tfparser.TFParser(self.tf_root)
+        self.tfparser = tfparser.TFParser(
+            self.tf_root,
+            use_cache=True,
+            streaming=streaming)
         self.tfobject = self.tfparser.tfobject
         self.slog.logger.debug("TF Inventory init done")
 
@@ -32,8 +86,8 @@ class TFInventory(object):
         inventory['_meta']['hostvars'] = {}
         hostvars = inventory['_meta']['hostvars']
 
-        self.generate_server_info(hostvars)
-        self.generate_host_groups(inventory)
+        ip_index, tag_index = self.generate_server_info(hostvars)
+        self.generate_host_groups(inventory, ip_index, tag_index)
 
         inventory['testgroup'] = {}
         inventory['testgroup']['hosts'] = []
@@ -41,9 +95,10 @@ class TFInventory(object):
 
         return inventory
 
-    def generate_host_groups(self, inventory):
+    def generate_host_groups(self, inventory, ip_index, tag_index):
         '''
-        Generate the various Ansible groups.
+        Generate the various Ansible groups, from the ip address and tag
+        indexes built by generate_server_info.
         '''
         for env in self.tfobject.keys():
             for module in self.tfobject[env]['modules']:
@@ -55,37 +110,29 @@ class TFInventory(object):
                     inventory[output]['hosts'] = []
                     inventory[output]['vars'] = {}
                     inventory[output]['vars']['ipaddrs'] = []
-                    for ipaddr in module['outputs'][output]['value']:
-                        for host in inventory['_meta']['hostvars'].keys():
-                            hostobj = inventory['_meta']['hostvars'][host]
-                            if hostobj['ansible_ssh_host'] == ipaddr:
-                                inventory[output]['hosts'].append(host)
-                                inventory[output]['vars']['ipaddrs'].\
-                                    append(ipaddr)
-
-                # Group hosts by Tags.
-                for reskey, resval in module['resources'].items():
-                    attributes = resval['primary']['attributes']
-                    restype = resval['type']
-
-                    if restype != "aws_instance":
-                        continue
+                    ipaddrs = module['outputs'][output]['value']
+                    if not isinstance(ipaddrs, list):
+                        ipaddrs = [ipaddrs]
+                    for ipaddr in ipaddrs:
+                        for host in ip_index.get(ipaddr, []):
+                            inventory[output]['hosts'].append(host)
+                            inventory[output]['vars']['ipaddrs'].\
+                                append(ipaddr)
 
-                    hostname = attributes['tags.Name']
-
-                    for key in attributes.keys():
-                        if key.startswith("tags."):
-                            hostgroup = "%s=%s" % (key, attributes[key])
-                            if inventory.get(hostgroup, None) is None:
-                                inventory[hostgroup] = {}
-                                inventory[hostgroup]['hosts'] = []
-                            else:
-                                inventory[hostgroup]['hosts'].append(hostname)
+        # Group hosts by Tags.
+        for hostgroup, hosts in tag_index.items():
+            inventory[hostgroup] = {}
+            inventory[hostgroup]['hosts'] = hosts
 
     def generate_server_info(self, hostvars):
         '''
-        Populate the host specific info in hostvars
+        Populate the host specific info in hostvars.
+
+        Returns the ip address to hosts and the tag group to hosts
+        indexes, built in the same pass over the resources.
         '''
+        ip_index = {}
+        tag_index = {}
         for env in self.tfobject.keys():
             for module in self.tfobject[env]['modules']:
                 for reskey, resval in module['resources'].items():
@@ -101,7 +148,7 @@ class TFInventory(object):
 
                     # Populate hostvar attributes.
                     hostvars[hostname] = {}
-                    if self.priv_ip_flag:
+                    if use_private_ip(self.priv_ip_flag):
                         hostvars[hostname]['ansible_ssh_host'] = \
                             attributes['private_ip']
                     else:
@@ -116,6 +163,189 @@ class TFInventory(object):
                     hostvars[hostname]['subnet_id'] = \
                         attributes['subnet_id']
 
+                    ip_index.setdefault(
+                        hostvars[hostname]['ansible_ssh_host'],
+                        []).append(hostname)
+
+                    for key, value in attributes.items():
+                        if key.startswith("tags."):
+                            hostgroup = "%s=%s" % (key, value)
+                            tag_index.setdefault(hostgroup,
+                                                 []).append(hostname)
+
+        return ip_index, tag_index
+
+
+class InventoryCache(object):
+    '''
+    Cached inventory output, invalidated when any state file under the
+    state root is added, removed or changed, or when it is older than
+    the ttl.
+    '''
+    CACHE_FILE = "inventory.json"
+
+    def __init__(self, tf_root, priv_ip_flag, ttl=None, slogger=None):
+        '''
+        :type tf_root: string
+        :param tf_root: The state root directory
+
+        :type priv_ip_flag: string
+        :param priv_ip_flag: The USE_PRIVATE_IP setting, which changes
+                             the generated inventory
+
+        :type ttl: float
+        :param ttl: Max age of the cached inventory in seconds, None for
+                    no limit
+        '''
+        if slogger is None:
+            self.slog = logger.Logger(name="InventoryCache")
+        else:
+            self.slog = slogger
+
+        self.tf_root = tf_root
+        self.priv_ip_flag = priv_ip_flag
+        self.ttl = ttl
+        self.cache_file = os.path.join(tf_root, tfstate_cache.CACHE_DIR,
+                                       InventoryCache.CACHE_FILE)
+
+    def get_fingerprints(self):
+        '''
+        Return the fingerprints of all the state files under the root.
+        '''
+        fingerprints = {}
+        for _, state_file in tfparser.find_state_files(self.tf_root):
+            try:
+                fingerprints[state_file] = \
+                    tfstate_cache.fingerprint(state_file)
+            except OSError:
+                continue
+
+        return fingerprints
+
+    def load(self, fingerprints):
+        '''
+        Return the cached inventory, or None if it is missing or stale.
+        '''
+        try:
+            with open(self.cache_file, "r") as cache_fp:
+                entry = json.load(cache_fp)
+        except (IOError, OSError, ValueError):
+            return None
+
+        if entry.get('fingerprints') != fingerprints or \
+                entry.get('priv_ip_flag') != self.priv_ip_flag:
+            self.slog.logger.debug("Inventory cache stale [%s]",
+                                   self.cache_file)
+            return None
+        if self.ttl is not None and \
+                time.time() - entry.get('created', 0) > self.ttl:
+            self.slog.logger.debug("Inventory cache expired [%s]",
+                                   self.cache_file)
+            return None
+
+        return entry.get('inventory')
+
+    def store(self, fingerprints, inventory):
+        '''
+        Write the inventory to the cache. Failing to write the cache is
+        not an error.
+        '''
+        entry = {'fingerprints': fingerprints,
+                 'priv_ip_flag': self.priv_ip_flag,
+                 'created': time.time(),
+                 'inventory': inventory}
+        cache_dir = os.path.dirname(self.cache_file)
+        tmpfile = "%s.%d.%d.tmp" % (self.cache_file, os.getpid(),
+                                    threading.get_ident())
+        try:
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+            with open(tmpfile, "w") as cache_fp:
+                json.dump(entry, cache_fp, separators=(",", ":"))
+            os.rename(tmpfile, self.cache_file)
+        except (IOError, OSError) as err:
+            self.slog.logger.error("Failed to write inventory cache [%s] "
+                                   "[%s]", self.cache_file, err)
+
+
+def use_private_ip(priv_ip_flag):
+    '''
+    Return True if the USE_PRIVATE_IP setting selects the private ips.
+    '''
+    return str(priv_ip_flag) not in ("0", "false", "False", "no")
+
+
+def get_inventory_ttl(env=None):
+    '''
+    Return the SYMPHONY_INVENTORY_TTL setting of env (os.environ by
+    default), None if unset or invalid.
+    '''
+    if env is None:
+        env = os.environ
+    ttl = env.get('SYMPHONY_INVENTORY_TTL', None)
+    if not ttl:
+        return None
+    try:
+        return float(ttl)
+    except ValueError:
+        return None
+
+
+def get_inventory(tf_root=None, priv_ip_flag=None, env=None):
+    '''
+    Return the inventory, from the cache when it is current.
+
+    tf_root and priv_ip_flag default to TERRAFORM_STATE_ROOT and
+    USE_PRIVATE_IP, and the settings are read from env, os.environ by
+    default.
+    '''
+    if env is None:
+        env = os.environ
+    if tf_root is None:
+        tf_root = env.get('TERRAFORM_STATE_ROOT', ".")
+    if priv_ip_flag is None:
+        priv_ip_flag = env.get('USE_PRIVATE_IP', "True")
+    streaming = tfparser.streaming_enabled(env)
+    if env.get('SYMPHONY_INVENTORY_CACHE', "1") in \
+            ("0", "false", "False", "no"):
+        return TFInventory(tf_root, priv_ip_flag,
+                           streaming=streaming).list_inventory()
+
+    cache = InventoryCache(tf_root, priv_ip_flag,
+                           ttl=get_inventory_ttl(env))
+    # Fingerprint before parsing, so a state written meanwhile
+    # invalidates the entry.
+    fingerprints = cache.get_fingerprints()
+    inventory = cache.load(fingerprints)
+    if inventory is None:
+        inventory = TFInventory(tf_root, priv_ip_flag,
+                                streaming=streaming).list_inventory()
+        cache.store(fingerprints, inventory)
+
+    return inventory
+
+
+def load_inventory():
+    '''
+    Return the inventory from the symphony daemon when one is running, or
+    build it in process.
+    '''
+    # ansible runs the inventory for every playbook. Without a daemon
+    # socket, the daemon client is not imported and no connect is tried.
+    socket_path = os.environ.get('SYMPHONY_DAEMON_SOCKET',
+                                 DAEMON_SOCKET)
+    if os.environ.get('SYMPHONY_DAEMON', "1") != "0" and \
+            os.path.exists(socket_path):
+        import symphony.daemon as daemon
+        args = {'staging': os.environ.get('TERRAFORM_STATE_ROOT', "."),
+                'priv_ip_flag': os.environ.get('USE_PRIVATE_IP', "True")}
+        reply = daemon.call("inventory", args, socket_path=socket_path,
+                            output=sys.stderr)
+        if reply is not None and reply[0] == 0:
+            return reply[1]
+
+    return get_inventory()
+
 
 def show_help():
     msg = "Terraform Ansible Dynamic Inventory"
@@ -131,7 +361,8 @@ def parse_arguments():
     parser.add_argument("--list",
                         action='store_true')
     parser.add_argument("--host",
-                        action='store_true')
+                        metavar="HOST",
+                        help="Show the variables of a single host")
 
     return parser.parse_args()
 
@@ -140,12 +371,13 @@ def main():
 
     args = parse_arguments()
     if args.list:
-        tfinventory = TFInventory()
-        inv = tfinventory.list_inventory()
+        inv = load_inventory()
         jinv = json.dumps(inv, indent=2, sort_keys=True)
-        print jinv
+        print(jinv)
     elif args.host:
-        sys.exit(1)
+        inv = load_inventory()
+        hostvars = inv['_meta']['hostvars'].get(args.host, {})
+        print(json.dumps(hostvars, indent=2, sort_keys=True))
 
 
 if __name__ == '__main__':
@@ -21,17 +21,104 @@ and all resources within.
 
 '''
 
-import sys
 import os
+import sys
+import csv
 import json
-import prettytable
-import re
+import collections
 import utils.symphony_logger as logger
+import utils.lazy_import as lazy_import
+import symphony.tfstate_cache as tfstate_cache
+import symphony.tfstream as tfstream
+import symphony.tfsummary as tfsummary
+
+# Only the table output needs it.
+prettytable = lazy_import.LazyModule("prettytable")
+
+
+LIST_FORMATS = ["table", "json", "jsonl", "csv"]
+
+
+def streaming_enabled(env=None):
+    '''
+    Return True if the states are to be streamed, with
+    SYMPHONY_TFSTATE_STREAMING=1 in env (os.environ by default). The
+    streaming parser is slower than json.load, so it is only worth it
+    when the states do not fit in memory.
+    '''
+    if env is None:
+        env = os.environ
+    return env.get('SYMPHONY_TFSTATE_STREAMING', "0") != "0"
+
+
+def get_columns(types=None):
+    '''
+    Return the columns of the resource rows of these types, or of any
+    type.
+    '''
+    columns = ['environment', 'type', 'id']
+    if types:
+        fields = []
+        for restype in types:
+            fields.extend(tfsummary.get_fields(restype))
+    else:
+        fields = tfsummary.get_all_fields()
+    for field in fields:
+        if field not in columns:
+            columns.append(field)
+
+    return columns
+
+
+def parse_tag(tag):
+    '''
+    Return the (key, value) of a key=value tag filter. Raises ValueError
+    if there is no '='.
+    '''
+    key, sep, value = tag.partition("=")
+    if not sep or not key:
+        raise ValueError("Invalid tag filter %s, expected key=value" % tag)
+    return key, value
+
+
+def match_tags(attributes, tags):
+    '''
+    Return True if the resource attributes have all the (key, value) tags.
+    '''
+    for key, value in tags:
+        if attributes.get("tags." + key) != value:
+            return False
+    return True
+
+
+def find_state_files(staging_dir):
+    '''
+    Return the (environment name, path) of every terraform.tfstate under
+    the staging directory, skipping the .terraform and .symphony dirs.
+    '''
+    state_files = []
+    for dirpath, dirs, files in os.walk(staging_dir):
+        dirname = os.path.basename(dirpath)
+        if dirname == "" or dirname == ".terraform":
+            continue
+        if dirname == tfstate_cache.CACHE_DIR:
+            dirs[:] = []
+            continue
+
+        if "terraform.tfstate" in files:
+            state_files.append((dirname,
+                                os.path.join(dirpath, "terraform.tfstate")))
+
+    return state_files
 
 
 class TFParser(object):
     def __init__(self, cluster_staging_dir,
-                 slogger=None):
+                 slogger=None,
+                 use_cache=False,
+                 streaming=False,
+                 environments=None,
+                 preload=True):
         '''
         Terraform Parser Initializer.
 
@@ -40,9 +127,33 @@ class TFParser(object):
 
         :type slogger: Symphony logger
         :param slogger: Symphony logging class to log debug/info/error/warnings
+
+        :type use_cache: Boolean
+        :param use_cache: Load the states through the on disk cache of
+                          digested states under <staging>/.symphony. The
+                          digested states only keep the module outputs and
+                          the resource types and attributes.
+
+        :type streaming: Boolean
+        :param streaming: Stream the state files, keeping only the outputs
+                          and the resource attributes used by the summaries
+                          and the dynamic inventory. Memory use then does
+                          not grow with the state size.
+
+        :type environments: list
+        :param environments: Only load the states of these environments
+
+        :type preload: Boolean
+        :param preload: Load every state into tfobject now. Without it,
+                        tfobject stays None, and terraform_iter_resources
+                        and terraform_display_environments load one state
+                        at a time as they go.
         '''
         self.cluster_staging_dir = None
         self.tfobject = None
+        self.cache = None
+        self.streaming = streaming
+        self.environments = environments
 
         if slogger is None:
             self.slog = logger.Logger(name="TFParser")
@@ -56,7 +167,11 @@ class TFParser(object):
             return
 
         self.cluster_staging_dir = cluster_staging_dir
-        self.tfobject = self.__parser_walk_staging_environment()
+        if use_cache:
+            self.cache = tfstate_cache.TFStateCache(cluster_staging_dir,
+                                                    slogger=self.slog)
+        if preload:
+            self.tfobject = self.__parser_walk_staging_environment()
 
         self.slog.logger.debug("TFParser Initialized")
 
@@ -67,30 +182,59 @@ class TFParser(object):
         depending on the staging dir.
         '''
         envobj = {}
-        for dirpath, dirs, files in os.walk(self.cluster_staging_dir):
-            dirname = os.path.basename(dirpath)
-            if dirname == "" or dirname == ".terraform":
-                continue
-
-            if "terraform.tfstate" not in files:
-                continue
+        for dirname, state in self.__parser_iter_states():
+            envobj[dirname] = state
 
-            terraform_file = os.path.join(dirpath, "terraform.tfstate")
-            self.slog.logger.debug("TF File: %s", terraform_file)
+        return envobj
 
-            if not os.path.exists(terraform_file):
-                self.slog.logger.error("Invalid terraform file [%s]",
-                                       terraform_file)
-                sys.exit()
+    def __parser_iter_states(self, types=None):
+        '''
+        Yield the (environment name, state) of each state file, loading
+        it only when its turn comes. With types, a streamed state only
+        holds the resources of these types.
+        '''
+        if self.tfobject is not None:
+            for dirname in self.tfobject.keys():
+                yield dirname, self.tfobject[dirname]
+            return
+        if self.cluster_staging_dir is None:
+            return
 
-            with open(terraform_file, "r") as tf_fp:
-                envobj[dirname] = {}
-                envobj[dirname] = json.load(tf_fp)
+        state_files = []
+        for dirname, terraform_file in \
+                find_state_files(self.cluster_staging_dir):
+            if self.environments and dirname not in self.environments:
+                continue
+            self.slog.logger.debug("TF File: %s", terraform_file)
+            state_files.append(terraform_file)
+            yield dirname, self.__parser_load_state(terraform_file,
+                                                    types=types)
+
+        if self.cache is not None:
+            # The entries of the skipped environments are still valid.
+            if not self.environments:
+                self.cache.prune(state_files)
+            self.slog.logger.debug("TF state cache: %d hits, %d misses",
+                                   self.cache.hits, self.cache.misses)
+
+    def __parser_load_state(self, terraform_file, types=None):
+        '''
+        Load a single state file, streamed or not, through the cache
+        when it is enabled. The cache keeps whole states, so types only
+        applies to the streamed states without the cache.
+        '''
+        if self.streaming:
+            if self.cache is not None:
+                return self.cache.load(terraform_file,
+                                       loader=tfstream.load_state,
+                                       loader_key=tfstream.LOADER_KEY)
+            return tfstream.load_state(terraform_file, types=types)
 
-            self.slog.logger.debug("oswalk: dripath: %s, dirs: %s, files: %s",
-                                   dirpath, dirs, files)
+        if self.cache is not None:
+            return self.cache.load(terraform_file)
 
-        return envobj
+        with open(terraform_file, "r") as tf_fp:
+            return json.load(tf_fp)
 
     def parser_get_all_resource_types(self):
         '''
@@ -144,87 +288,162 @@ class TFParser(object):
                     if summary[env].get(restype, None) is None:
                         summary[env][restype] = {}
 
-                    res_id = attributes['id']
-                    summary[env][restype][res_id] = {}
-                    obj = summary[env][restype][res_id]
-                    if restype == "aws_instance":
-                        obj['ami'] = attributes['ami']
-                        obj['private_ip'] = attributes['private_ip']
-                        obj['instance_state'] = attributes['instance_state']
-                        obj['instance_type'] = attributes['instance_type']
-                        obj['key_name'] = attributes['key_name']
-                    if restype == "aws_elb":
-                        obj['name'] = attributes['name']
-                        obj['availability_zones'] = []
-                        obj['instances'] = []
-                        for key, attr in attributes.items():
-                            if re.match(r'availability_zones\.(\d+)',
-                                        key):
-                                obj['availability_zones'].append(attr)
-                            elif re.match(r'instances\.(\d+)',
-                                          key):
-                                obj['instances'].append(attr)
+                    summary[env][restype][attributes['id']] = \
+                        tfsummary.summarize_resource(restype, attributes)
 
         return summary
 
+    def terraform_iter_resources(self, types=None, tags=None):
+        '''
+        Yield a summary row for each resource, as the states are scanned.
+        A row is a dict with the environment, type and id of the resource,
+        and its summary fields. The rows of a state are yielded before the
+        next state is loaded.
+
+        :type types: list
+        :param types: Only the resources of these types
+
+        :type tags: list
+        :param tags: (key, value) pairs, only the resources with all these
+                     tags
+        '''
+        for env, state in self.__parser_iter_states(types=types):
+            for module in state['modules']:
+                for reskey, resval in module['resources'].items():
+                    restype = resval['type']
+                    if types and restype not in types:
+                        continue
+                    attributes = resval['primary']['attributes']
+                    if tags and not match_tags(attributes, tags):
+                        continue
+
+                    row = {'environment': env,
+                           'type': restype,
+                           'id': attributes['id']}
+                    row.update(tfsummary.summarize_resource(restype,
+                                                            attributes))
+                    yield row
+
+    def terraform_write_resources(self, output_format,
+                                  types=None, tags=None, out=None):
+        '''
+        Write the resource rows as json, jsonl or csv. Each row is written
+        as it is produced.
+
+        :type out: file
+        :param out: Where to write, sys.stdout by default
+        '''
+        if out is None:
+            out = sys.stdout
+        rows = self.terraform_iter_resources(types=types, tags=tags)
+
+        if output_format == "jsonl":
+            for row in rows:
+                out.write(json.dumps(row, sort_keys=True) + "\n")
+        elif output_format == "json":
+            separator = "[\n"
+            for row in rows:
+                out.write(separator + json.dumps(row, sort_keys=True))
+                separator = ",\n"
+            out.write("[]\n" if separator == "[\n" else "\n]\n")
+        elif output_format == "csv":
+            writer = csv.DictWriter(out, get_columns(types),
+                                    restval="", extrasaction="ignore",
+                                    lineterminator="\n")
+            writer.writeheader()
+            for row in rows:
+                for key, value in row.items():
+                    if isinstance(value, list):
+                        row[key] = ";".join(value)
+                writer.writerow(row)
+        else:
+            raise ValueError("Invalid output format %s" % output_format)
+
     def terraform_display_aws_resource_summary(self,
                                                resource_type,
-                                               resource_info):
+                                               resource_info,
+                                               out=None):
         '''
-        Display aws instance summary info.
+        Display the summary table of the resources of a type, to out
+        (sys.stdout by default).
         '''
-        header_set = False
-        headers = []
-        row = []
+        headers = ["Id"] + tfsummary.get_fields(resource_type)
+        table = prettytable.PrettyTable(headers)
         for resource in resource_info.keys():
-            row = []
-            if not header_set:
-                headers.append("Id")
-
-            row.append(resource)
-            for key, attr in resource_info[resource].items():
-                if not header_set:
-                    headers.append(key)
-                row.append(attr)
-
-            if not header_set:
-                table = prettytable.PrettyTable(headers)
-                header_set = True
-
+            row = [resource]
+            for key in headers[1:]:
+                row.append(resource_info[resource].get(key, ""))
             table.add_row(row)
 
-        print "Resource: " + resource_type
-        print "-" * 30
-        print table
-        print "\n"
+        print("Resource: " + resource_type, file=out)
+        print("-" * 30, file=out)
+        print(table, file=out)
+        print("\n", file=out)
 
-    def terraform_display_environments(self):
+    def terraform_display_environments(self, types=None, tags=None,
+                                       out=None):
         '''
-        API that displays the tf environments.
+        API that displays the tf environments, a table per resource type.
+        An environment is displayed before the next state is loaded.
         '''
-        summary = self.terraform_get_environment_summary()
-        print "=" * 50
-        print "Symphony - TF Environments"
-        print "=" * 50
-
-        for env in summary.keys():
-            print "Environment: ", env
-            print "-" * 30
-
-            for restype in summary[env].keys():
-                if restype == "aws_instance" or \
-                        restype == "aws_elb":
-                    self.terraform_display_aws_resource_summary(
-                        restype,
-                        summary[env][restype])
-            print "\n"
-
-
-
-
-
-
-
-
-
-
+        print("=" * 50, file=out)
+        print("Symphony - TF Environments", file=out)
+        print("=" * 50, file=out)
+
+        for env, state in self.__parser_iter_states(types=types):
+            summary = collections.OrderedDict()
+            for module in state['modules']:
+                for resval in module['resources'].values():
+                    restype = resval['type']
+                    if types and restype not in types:
+                        continue
+                    attributes = resval['primary']['attributes']
+                    if tags and not match_tags(attributes, tags):
+                        continue
+                    summary.setdefault(restype, {})[attributes['id']] = \
+                        tfsummary.summarize_resource(restype, attributes)
+
+            print("Environment: " + env, file=out)
+            print("-" * 30, file=out)
+
+            for restype in summary.keys():
+                self.terraform_display_aws_resource_summary(
+                    restype,
+                    summary[restype],
+                    out=out)
+            print("\n", file=out)
+
+
+def write_environments(staging_dir, list_format="table", environments=None,
+                       types=None, tags=None, streaming=False, out=None,
+                       slogger=None):
+    '''
+    Write the resources of the states under a staging dir to out
+    (sys.stdout by default), as tables or as json, jsonl or csv rows. The
+    states are loaded one at a time, through the state cache.
+    '''
+    parserobj = TFParser(staging_dir,
+                         slogger=slogger,
+                         use_cache=True,
+                         streaming=streaming,
+                         environments=environments,
+                         preload=False)
+    if list_format == "table":
+        parserobj.terraform_display_environments(types=types, tags=tags,
+                                                 out=out)
+    else:
+        parserobj.terraform_write_resources(list_format, types=types,
+                                            tags=tags, out=out)
+
+
+def write_summary(staging_dir, streaming=False, out=None, slogger=None):
+    '''
+    Write the summary of the resources of each environment under a
+    staging dir to out (sys.stdout by default), as JSON.
+    '''
+    parserobj = TFParser(staging_dir,
+                         slogger=slogger,
+                         use_cache=True,
+                         streaming=streaming)
+    summary = parserobj.terraform_get_environment_summary()
+    print(json.dumps(summary, indent=2, sort_keys=True), file=out)
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+TF State Cache:
+---------------
+Parsing every terraform.tfstate under a staging directory is expensive,
+and it happens on every list, configure and dynamic inventory run.
+
+The cache keeps a compact, pre-digested copy of each state file under
+<staging>/.symphony/tfstate/, keyed by the state file path. Each entry
+records the state file fingerprint (mtime, size and inode), and is only
+used while the state file still has the same fingerprint.
+
+The digested state keeps the layout of the terraform state, with only the
+parts symphony reads: the module outputs, and the type and attributes of
+each resource.
+
+The digested states are also kept in memory for the life of the process,
+under the same fingerprint check, so a long running process (the symphony
+daemon) does not read the cache entries again. They are shared, and must
+not be modified.
+'''
+
+import os
+import json
+import hashlib
+import threading
+import utils.symphony_logger as logger
+
+
+CACHE_DIR = ".symphony"
+
+
+def fingerprint(path):
+    '''
+    Return the fingerprint of a file: mtime (ns), size and inode.
+    '''
+    fstat = os.stat(path)
+    return [fstat.st_mtime_ns, fstat.st_size, fstat.st_ino]
+
+
+def digest_state(state):
+    '''
+    Return the compact form of a parsed terraform state.
+    '''
+    modules = []
+    for module in state.get('modules', []):
+        outputs = {}
+        for name, output in module.get('outputs', {}).items():
+            # Terraform < 0.7 stores outputs as plain strings.
+            if isinstance(output, dict):
+                outputs[name] = {'value': output.get('value')}
+            else:
+                outputs[name] = {'value': output}
+
+        resources = {}
+        for reskey, resval in module.get('resources', {}).items():
+            primary = resval.get('primary', {})
+            resources[reskey] = {
+                'type': resval['type'],
+                'primary': {'attributes': primary.get('attributes', {})}
+            }
+
+        modules.append({'path': module.get('path', []),
+                        'outputs': outputs,
+                        'resources': resources})
+
+    return {'modules': modules}
+
+
+class TFStateCache(object):
+    '''
+    On disk cache of digested terraform states.
+    '''
+    # entry file: (fingerprint, loader key, state), shared by all the
+    # caches of the process.
+    states = {}
+    lock = threading.Lock()
+
+    def __init__(self, staging_dir, slogger=None):
+        '''
+        Initialize the cache for a staging directory.
+
+        :type staging_dir: string
+        :param staging_dir: The staging directory holding the tfstates
+        '''
+        if slogger is None:
+            self.slog = logger.Logger(name="TFStateCache")
+        else:
+            self.slog = slogger
+
+        self.cache_dir = os.path.abspath(
+            os.path.join(staging_dir, CACHE_DIR, "tfstate"))
+        self.hits = 0
+        self.misses = 0
+
+    def get_entry_file(self, state_file):
+        '''
+        Return the path of the cache entry for a state file.
+        '''
+        key = hashlib.sha1(
+            os.path.abspath(state_file).encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, key + ".json")
+
+    def load(self, state_file, loader=None, loader_key="full"):
+        '''
+        Return the digested state for a state file, from the cache when
+        the state file is unchanged, or by parsing it otherwise.
+
+        :type loader: callable
+        :param loader: Called with the state file path on a cache miss, to
+                       return the digested state. Defaults to json.load
+                       followed by digest_state.
+
+        :type loader_key: string
+        :param loader_key: Identifies what the loader keeps. An entry
+                           written by a different loader is not used.
+        '''
+        state_fingerprint = fingerprint(state_file)
+        entry_file = self.get_entry_file(state_file)
+        with TFStateCache.lock:
+            entry = TFStateCache.states.get(entry_file)
+        if entry is not None and entry[0] == state_fingerprint and \
+                entry[1] == loader_key:
+            self.hits += 1
+            return entry[2]
+
+        try:
+            with open(entry_file, "r") as entry_fp:
+                entry = json.load(entry_fp)
+            if entry['fingerprint'] == state_fingerprint and \
+                    entry['loader'] == loader_key:
+                self.hits += 1
+                self.remember(entry_file, state_fingerprint, loader_key,
+                              entry['state'])
+                return entry['state']
+        except (IOError, OSError, ValueError, KeyError):
+            pass
+
+        self.misses += 1
+        self.slog.logger.debug("TF state cache miss [%s]", state_file)
+        if loader is None:
+            with open(state_file, "r") as tf_fp:
+                state = digest_state(json.load(tf_fp))
+        else:
+            state = loader(state_file)
+
+        self.store(entry_file, state_file, state_fingerprint, state,
+                   loader_key)
+        self.remember(entry_file, state_fingerprint, loader_key, state)
+        return state
+
+    def remember(self, entry_file, state_fingerprint, loader_key, state):
+        '''
+        Keep a digested state in memory.
+        '''
+        with TFStateCache.lock:
+            TFStateCache.states[entry_file] = \
+                (state_fingerprint, loader_key, state)
+
+    def store(self, entry_file, state_file, state_fingerprint, state,
+              loader_key):
+        '''
+        Write a cache entry. Failing to write the cache is not an error.
+        '''
+        entry = {'path': os.path.abspath(state_file),
+                 'fingerprint': state_fingerprint,
+                 'loader': loader_key,
+                 'state': state}
+        tmpfile = "%s.%d.%d.tmp" % (entry_file, os.getpid(),
+                                    threading.get_ident())
+        try:
+            if not os.path.exists(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            with open(tmpfile, "w") as entry_fp:
+                json.dump(entry, entry_fp, separators=(",", ":"))
+            os.rename(tmpfile, entry_file)
+        except (IOError, OSError) as err:
+            self.slog.logger.error("Failed to write TF state cache [%s] [%s]",
+                                   entry_file, err)
+
+    def prune(self, state_files):
+        '''
+        Remove cache entries for state files that are no longer present.
+        '''
+        keep = set([os.path.basename(self.get_entry_file(state_file))
+                    for state_file in state_files])
+        with TFStateCache.lock:
+            for entry_file in list(TFStateCache.states):
+                if os.path.dirname(entry_file) == self.cache_dir and \
+                        os.path.basename(entry_file) not in keep:
+                    del TFStateCache.states[entry_file]
+
+        if not os.path.isdir(self.cache_dir):
+            return
+
+        for entry in os.listdir(self.cache_dir):
+            if entry.endswith(".json") and entry not in keep:
+                try:
+                    os.remove(os.path.join(self.cache_dir, entry))
+                except OSError:
+                    pass
+
+    @classmethod
+    def clear_memory(cls):
+        with cls.lock:
+            cls.states = {}
@@ -0,0 +1,339 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Streaming TF State Parser:
+--------------------------
+json.load() needs the whole terraform.tfstate in memory, several times
+over once it is turned into python objects. For state files of hundreds
+of MB that is a lot of memory, while symphony only reads a handful of
+attributes per resource.
+
+This parser reads the state file in fixed size chunks and tokenizes it
+incrementally. It only builds python objects for the parts that are kept:
+the module path and outputs, and the type and selected attributes of
+each resource. Everything else is scanned and dropped, so peak memory
+depends on the size of the result, not on the size of the state file.
+
+The result has the same layout as tfstate_cache.digest_state().
+'''
+
+import re
+import json
+import hashlib
+import symphony.tfsummary as tfsummary
+
+
+# Attributes read by the dynamic inventory.
+INVENTORY_ATTRIBUTES = frozenset([
+    'id', 'ami', 'private_ip', 'public_ip', 'availability_zone',
+    'subnet_id'
+])
+INVENTORY_PREFIXES = ('tags.',)
+
+# And the ones read by the resource summaries.
+SUMMARY_ATTRIBUTES, SUMMARY_PREFIXES = tfsummary.get_attributes()
+
+DEFAULT_ATTRIBUTES = INVENTORY_ATTRIBUTES | SUMMARY_ATTRIBUTES
+DEFAULT_PREFIXES = tuple(sorted(set(INVENTORY_PREFIXES +
+                                    SUMMARY_PREFIXES)))
+
+# The TFStateCache loader key of the streamed states. It changes with
+# the kept attributes, so entries that miss some of them are not used.
+LOADER_KEY = "streaming-" + hashlib.sha1(
+    json.dumps([sorted(DEFAULT_ATTRIBUTES),
+                DEFAULT_PREFIXES]).encode("utf-8")).hexdigest()[:12]
+
+CHUNK_SIZE = 1 << 16
+
+PUNCT, STRING, LITERAL = 1, 2, 3
+TOKEN_RE = re.compile(r'\s*(?:([{}\[\]:,])|("[^"\\]*(?:\\.[^"\\]*)*")|'
+                      r'([^\s{}\[\]:,"]+))')
+# A whole "key": "value" entry of a flat object, with its separator.
+ENTRY_RE = re.compile(r'\s*("[^"\\]*(?:\\.[^"\\]*)*")\s*:\s*'
+                      r'("[^"\\]*(?:\\.[^"\\]*)*")\s*([,}])')
+
+
+class StreamingLexer(object):
+    '''
+    Incremental JSON tokenizer over a file object.
+    '''
+    def __init__(self, fileobj, chunk_size=CHUNK_SIZE):
+        self.fileobj = fileobj
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.pushed = None
+
+    def fill(self):
+        '''
+        Drop the consumed part of the buffer and read the next chunk.
+        '''
+        data = self.fileobj.read(self.chunk_size)
+        if not data:
+            self.eof = True
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+
+    def next(self):
+        '''
+        Return the next (kind, text) token, or None at the end.
+        '''
+        if self.pushed is not None:
+            token = self.pushed
+            self.pushed = None
+            return token
+
+        while True:
+            match = TOKEN_RE.match(self.buf, self.pos)
+            # A token that ends at the end of the buffer may continue in
+            # the next chunk.
+            if match is None or (match.end() == len(self.buf) and
+                                 not self.eof):
+                if self.eof:
+                    if self.buf[self.pos:].strip():
+                        raise ValueError("Invalid JSON near offset %d" %
+                                         self.pos)
+                    return None
+                self.fill()
+                continue
+
+            self.pos = match.end()
+            kind = match.lastindex
+            return kind, match.group(kind)
+
+    def push(self, token):
+        '''
+        Push back a token, to be returned by the next call to next().
+        '''
+        self.pushed = token
+
+
+def decode_string(text):
+    '''
+    Decode a JSON string token.
+    '''
+    if "\\" not in text:
+        return text[1:-1]
+    return json.loads(text)
+
+
+class StreamingStateParser(object):
+    '''
+    Extract the parts of a terraform state that symphony uses.
+    '''
+    def __init__(self, attributes=DEFAULT_ATTRIBUTES,
+                 prefixes=DEFAULT_PREFIXES, types=None):
+        '''
+        :type attributes: set
+        :param attributes: Resource attributes to keep
+
+        :type prefixes: tuple
+        :param prefixes: Keep resource attributes starting with these
+
+        :type types: list
+        :param types: Only keep the resources of these types
+        '''
+        self.attributes = attributes
+        self.prefixes = tuple(prefixes)
+        self.types = set(types) if types else None
+        self.lexer = None
+
+    def expect(self, punct):
+        token = self.lexer.next()
+        if token is None or token != (PUNCT, punct):
+            raise ValueError("Expected '%s', got %s" % (punct, token))
+
+    def iter_object(self):
+        '''
+        Iterate over the keys of the next JSON object. The caller must
+        consume the value of each key before asking for the next one.
+        '''
+        self.expect("{")
+        token = self.lexer.next()
+        if token == (PUNCT, "}"):
+            return
+        while True:
+            if token is None or token[0] != STRING:
+                raise ValueError("Expected object key, got %s" % (token,))
+            self.expect(":")
+            yield decode_string(token[1])
+            token = self.lexer.next()
+            if token == (PUNCT, "}"):
+                return
+            if token != (PUNCT, ","):
+                raise ValueError("Expected ',' or '}', got %s" % (token,))
+            token = self.lexer.next()
+
+    def iter_array(self):
+        '''
+        Iterate over the items of the next JSON array. The caller must
+        consume each item.
+        '''
+        self.expect("[")
+        token = self.lexer.next()
+        if token == (PUNCT, "]"):
+            return
+        self.lexer.push(token)
+        while True:
+            yield
+            token = self.lexer.next()
+            if token == (PUNCT, "]"):
+                return
+            if token != (PUNCT, ","):
+                raise ValueError("Expected ',' or ']', got %s" % (token,))
+
+    def parse_value(self):
+        '''
+        Parse and return the next JSON value.
+        '''
+        token = self.lexer.next()
+        if token is None:
+            raise ValueError("Unexpected end of state file")
+        kind, text = token
+        if kind == STRING:
+            return decode_string(text)
+        if kind == LITERAL:
+            return json.loads(text)
+
+        self.lexer.push(token)
+        if text == "{":
+            obj = {}
+            for key in self.iter_object():
+                obj[key] = self.parse_value()
+            return obj
+        if text == "[":
+            items = []
+            for _ in self.iter_array():
+                items.append(self.parse_value())
+            return items
+        raise ValueError("Unexpected '%s'" % text)
+
+    def skip_value(self):
+        '''
+        Consume the next JSON value without building it.
+        '''
+        depth = 0
+        while True:
+            token = self.lexer.next()
+            if token is None:
+                raise ValueError("Unexpected end of state file")
+            if token[0] == PUNCT:
+                if token[1] in "{[":
+                    depth += 1
+                elif token[1] in "}]":
+                    depth -= 1
+            if depth == 0:
+                return
+
+    def parse_attributes(self):
+        '''
+        Parse the flat attributes map of a resource. Nearly every entry is
+        a string to string pair, which is matched in one go. Any other
+        entry, or one that crosses the end of the buffer, is parsed token
+        by token.
+        '''
+        lexer = self.lexer
+        attributes = {}
+        self.expect("{")
+        token = lexer.next()
+        if token == (PUNCT, "}"):
+            return attributes
+        lexer.push(token)
+
+        while True:
+            if lexer.pushed is None:
+                match = ENTRY_RE.match(lexer.buf, lexer.pos)
+                if match is not None:
+                    lexer.pos = match.end()
+                    key = decode_string(match.group(1))
+                    if key in self.attributes or \
+                            key.startswith(self.prefixes):
+                        attributes[key] = decode_string(match.group(2))
+                    if match.group(3) == "}":
+                        return attributes
+                    continue
+
+            token = lexer.next()
+            if token is None or token[0] != STRING:
+                raise ValueError("Expected object key, got %s" % (token,))
+            self.expect(":")
+            key = decode_string(token[1])
+            if key in self.attributes or key.startswith(self.prefixes):
+                attributes[key] = self.parse_value()
+            else:
+                self.skip_value()
+            token = lexer.next()
+            if token == (PUNCT, "}"):
+                return attributes
+            if token != (PUNCT, ","):
+                raise ValueError("Expected ',' or '}', got %s" % (token,))
+
+    def keep_resource(self, resource):
+        return self.types is None or resource['type'] in self.types
+
+    def parse_resource(self):
+        resource = {'type': None, 'primary': {'attributes': {}}}
+        for key in self.iter_object():
+            if key == "type":
+                resource['type'] = self.parse_value()
+            elif key == "primary" and (resource['type'] is None or
+                                       self.keep_resource(resource)):
+                for pkey in self.iter_object():
+                    if pkey == "attributes":
+                        resource['primary']['attributes'] = \
+                            self.parse_attributes()
+                    else:
+                        self.skip_value()
+            else:
+                self.skip_value()
+        return resource
+
+    def parse_module(self):
+        module = {'path': [], 'outputs': {}, 'resources': {}}
+        for key in self.iter_object():
+            if key == "path":
+                module['path'] = self.parse_value()
+            elif key == "outputs":
+                for name in self.iter_object():
+                    output = self.parse_value()
+                    # Terraform < 0.7 stores outputs as plain strings.
+                    if isinstance(output, dict):
+                        output = output.get('value')
+                    module['outputs'][name] = {'value': output}
+            elif key == "resources":
+                for reskey in self.iter_object():
+                    resource = self.parse_resource()
+                    if self.keep_resource(resource):
+                        module['resources'][reskey] = resource
+            else:
+                self.skip_value()
+        return module
+
+    def parse(self, fileobj, chunk_size=CHUNK_SIZE):
+        '''
+        Parse a terraform state from a file object.
+        '''
+        self.lexer = StreamingLexer(fileobj, chunk_size=chunk_size)
+        state = {'modules': []}
+        for key in self.iter_object():
+            if key == "modules":
+                for _ in self.iter_array():
+                    state['modules'].append(self.parse_module())
+            else:
+                self.skip_value()
+
+        return state
+
+
+def load_state(state_file, attributes=DEFAULT_ATTRIBUTES,
+               prefixes=DEFAULT_PREFIXES, chunk_size=CHUNK_SIZE, types=None):
+    '''
+    Stream a terraform.tfstate file and return its digested form. With
+    types, the other resources are skipped without being parsed.
+    '''
+    parser = StreamingStateParser(attributes=attributes, prefixes=prefixes,
+                                  types=types)
+    with open(state_file, "r") as tf_fp:
+        return parser.parse(tf_fp, chunk_size=chunk_size)
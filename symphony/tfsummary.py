@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+TF Resource Summary:
+--------------------
+The resource summaries shown by the list and summary operations. Each
+resource type has an extractor, registered with @extractor, that returns
+the summary fields of a resource from its attributes. The types without
+one are summarized with their name.
+
+Terraform stores the nested values of a resource as flattened attributes
+(flatmap):
+
+    "instances.#": "2"                    list or set length
+    "instances.3457311208": "i-00000001"  list or set element
+    "tags.%": "1"                         map size
+    "tags.Name": "web-0"                  map element
+    "ingress.2541437006.from_port": "22"  field of a list of objects
+
+decode_flatmap() groups the attributes under the prefixes an extractor
+reads in a single pass, splitting each key at its first dot. No key is
+matched against a pattern.
+'''
+
+
+# resource type: Extractor
+EXTRACTORS = {}
+
+GENERIC_FIELDS = ['name']
+
+
+class Extractor(object):
+    '''
+    The summary of a resource type.
+    '''
+    def __init__(self, resource_type, fields, func, attributes, prefixes):
+        '''
+        :type fields: list
+        :param fields: The summary fields, in display order
+
+        :type func: callable
+        :param func: Called with the resource attributes and the decoded
+                     flatmap groups, returns the summary fields
+
+        :type attributes: list
+        :param attributes: The plain attributes read by func
+
+        :type prefixes: list
+        :param prefixes: The flatmap prefixes read by func
+        '''
+        self.resource_type = resource_type
+        self.fields = list(fields)
+        self.func = func
+        self.attributes = tuple(attributes)
+        self.prefixes = tuple(prefixes)
+
+    def summarize(self, attributes):
+        groups = None
+        if self.prefixes:
+            groups = decode_flatmap(attributes, self.prefixes)
+        return self.func(attributes, groups)
+
+
+def extractor(resource_type, fields, attributes=(), prefixes=()):
+    '''
+    Decorator, registers the summary function of a resource type.
+    '''
+    def register(func):
+        EXTRACTORS[resource_type] = Extractor(resource_type, fields, func,
+                                              attributes, prefixes)
+        return func
+    return register
+
+
+def decode_flatmap(attributes, prefixes):
+    '''
+    Return {prefix: {rest: value}} for the attributes named
+    "<prefix>.<rest>", in one pass over the attributes.
+    '''
+    groups = {}
+    for prefix in prefixes:
+        groups[prefix] = {}
+    for key, value in attributes.items():
+        head, sep, rest = key.partition(".")
+        if sep:
+            group = groups.get(head)
+            if group is not None:
+                group[rest] = value
+
+    return groups
+
+
+def flat_list(group):
+    '''
+    Return the elements of a decoded flatmap list or set.
+    '''
+    return [value for key, value in group.items() if key.isdigit()]
+
+
+def flat_objects(group):
+    '''
+    Return the elements of a decoded flatmap list of objects, each as the
+    flattened attributes of the object.
+    '''
+    objects = {}
+    for key, value in group.items():
+        index, sep, rest = key.partition(".")
+        if sep and index.isdigit():
+            objects.setdefault(index, {})[rest] = value
+
+    return list(objects.values())
+
+
+def get_fields(resource_type):
+    '''
+    Return the summary fields of a resource type.
+    '''
+    entry = EXTRACTORS.get(resource_type)
+    if entry is None:
+        return GENERIC_FIELDS
+    return entry.fields
+
+
+def get_all_fields():
+    '''
+    Return the summary fields of all the types, without duplicates.
+    '''
+    fields = []
+    for resource_type in sorted(EXTRACTORS):
+        for field in EXTRACTORS[resource_type].fields:
+            if field not in fields:
+                fields.append(field)
+    for field in GENERIC_FIELDS:
+        if field not in fields:
+            fields.append(field)
+
+    return fields
+
+
+def get_attributes():
+    '''
+    Return the plain attributes and the flatmap prefixes (with their dot)
+    read by the summaries.
+    '''
+    attributes = set(GENERIC_FIELDS)
+    prefixes = set()
+    for entry in EXTRACTORS.values():
+        attributes.update(entry.attributes)
+        prefixes.update([prefix + "." for prefix in entry.prefixes])
+
+    return frozenset(attributes), tuple(sorted(prefixes))
+
+
+def summarize_resource(resource_type, attributes):
+    '''
+    Return the summary fields of a resource, from its attributes.
+    '''
+    entry = EXTRACTORS.get(resource_type)
+    if entry is not None:
+        return entry.summarize(attributes)
+    if 'name' in attributes:
+        return {'name': attributes['name']}
+    return {}
+
+
+def format_rule(rule):
+    '''
+    Return a security group rule as "protocol from-to sources".
+    '''
+    groups = decode_flatmap(rule, ("cidr_blocks", "security_groups"))
+    sources = flat_list(groups['cidr_blocks']) + \
+        flat_list(groups['security_groups'])
+    if rule.get('self') == "true":
+        sources.append("self")
+
+    return "%s %s-%s %s" % (rule.get('protocol'), rule.get('from_port'),
+                            rule.get('to_port'), ",".join(sources))
+
+
+INSTANCE_FIELDS = ['ami', 'private_ip', 'instance_state', 'instance_type',
+                   'key_name']
+
+
+@extractor("aws_instance", INSTANCE_FIELDS, attributes=INSTANCE_FIELDS)
+def summarize_instance(attributes, groups):
+    return dict((key, attributes.get(key)) for key in INSTANCE_FIELDS)
+
+
+@extractor("aws_elb", ['name', 'availability_zones', 'instances'],
+           attributes=['name'],
+           prefixes=['availability_zones', 'instances'])
+def summarize_elb(attributes, groups):
+    return {'name': attributes.get('name'),
+            'availability_zones': flat_list(groups['availability_zones']),
+            'instances': flat_list(groups['instances'])}
+
+
+@extractor("aws_security_group", ['name', 'vpc_id', 'ingress', 'egress'],
+           attributes=['name', 'vpc_id'],
+           prefixes=['ingress', 'egress'])
+def summarize_security_group(attributes, groups):
+    return {'name': attributes.get('name'),
+            'vpc_id': attributes.get('vpc_id'),
+            'ingress': [format_rule(rule)
+                        for rule in flat_objects(groups['ingress'])],
+            'egress': [format_rule(rule)
+                       for rule in flat_objects(groups['egress'])]}
+
+
+@extractor("aws_subnet", ['name', 'vpc_id', 'cidr_block',
+                          'availability_zone', 'map_public_ip_on_launch'],
+           attributes=['tags.Name', 'vpc_id', 'cidr_block',
+                       'availability_zone', 'map_public_ip_on_launch'])
+def summarize_subnet(attributes, groups):
+    return {'name': attributes.get('tags.Name'),
+            'vpc_id': attributes.get('vpc_id'),
+            'cidr_block': attributes.get('cidr_block'),
+            'availability_zone': attributes.get('availability_zone'),
+            'map_public_ip_on_launch':
+                attributes.get('map_public_ip_on_launch')}
+
+
+@extractor("aws_key_pair", ['key_name', 'fingerprint'],
+           attributes=['key_name', 'fingerprint'])
+def summarize_key_pair(attributes, groups):
+    return {'key_name': attributes.get('key_name'),
+            'fingerprint': attributes.get('fingerprint')}
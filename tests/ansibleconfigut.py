@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Unit tests for the generated ansible.cfg
+'''
+
+import shutil
+import os
+import unittest
+import tempfile
+import configparser
+import symphony.ansible_config as ansible_config
+
+
+class AnsibleConfigUt(unittest.TestCase):
+    '''Test the generated ansible.cfg'''
+    def setUp(self):
+        self.staging = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.staging)
+
+    def test_write_ansible_cfg(self):
+        config_file = ansible_config.write_ansible_cfg(self.staging)
+        self.assertEqual(config_file,
+                         os.path.join(self.staging, "ansible.cfg"))
+        config = configparser.ConfigParser(interpolation=None)
+        config.read(config_file)
+        self.assertEqual(config.get("ssh_connection", "pipelining"), "True")
+        self.assertIn("ControlPersist",
+                      config.get("ssh_connection", "ssh_args"))
+        control_dir = config.get("ssh_connection", "control_path_dir")
+        self.assertEqual(control_dir,
+                         ansible_config.get_control_dir(self.staging))
+        self.assertTrue(os.path.isdir(control_dir))
+        self.assertEqual(config.get("ssh_connection", "control_path"),
+                         "%(directory)s/%%C")
+
+    def test_control_dir(self):
+        self.assertEqual(ansible_config.get_control_dir(self.staging),
+                         os.path.join(self.staging, ".symphony", "cp"))
+        long_staging = os.path.join(self.staging, "x" * 80)
+        control_dir = ansible_config.get_control_dir(long_staging)
+        self.assertTrue(len(control_dir) <= ansible_config.MAX_CONTROL_DIR)
+        self.assertEqual(control_dir,
+                         ansible_config.get_control_dir(long_staging))
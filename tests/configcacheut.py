@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Unit tests for the parsed config cache
+'''
+
+import shutil
+import os
+import unittest
+import tempfile
+import symphony.config_parser as config_parser
+import symphony.config_cache as config_cache
+import testenv
+
+
+# Keep the caches out of HOME.
+setUpModule = testenv.setUpModule
+tearDownModule = testenv.tearDownModule
+
+
+class ConfigCacheUt(unittest.TestCase):
+    '''Test the parsed config cache'''
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.work_dir)
+        saved = os.environ.get('SYMPHONY_CONFIG_CACHE_DIR')
+
+        def restore_env():
+            if saved is None:
+                os.environ.pop('SYMPHONY_CONFIG_CACHE_DIR', None)
+            else:
+                os.environ['SYMPHONY_CONFIG_CACHE_DIR'] = saved
+        self.addCleanup(restore_env)
+        os.environ['SYMPHONY_CONFIG_CACHE_DIR'] = \
+            os.path.join(self.work_dir, "cache")
+        config_cache.ConfigCache.clear_memory()
+        self.addCleanup(config_cache.ConfigCache.clear_memory)
+
+        self.env_dir = os.path.join(self.work_dir, "environments")
+        shutil.copytree("./testdata/environment", self.env_dir)
+
+    def parse_env(self):
+        cfgparser = config_parser.ConfigParser()
+        parsed = cfgparser.parse_environment_configuration(self.env_dir,
+                                                           "testenvironment")
+        return parsed, cfgparser.cache
+
+    def test_libyaml_loader(self):
+        if getattr(config_parser.yaml, "__with_libyaml__", False):
+            self.assertIs(config_parser.SafeLoader,
+                          config_parser.yaml.CSafeLoader)
+        with open("./testdata/clusters/rabbitmq_cluster.yaml") as yaml_fp:
+            content = yaml_fp.read()
+        self.assertEqual(config_parser.load_yaml(content),
+                         config_parser.yaml.safe_load(content))
+
+    def test_cache(self):
+        parsed, cache = self.parse_env()
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+        self.assertEqual(parsed['vpc'], "vpc-8887777")
+
+        # Same process: from memory.
+        parsed_again, cache = self.parse_env()
+        self.assertEqual((cache.hits, cache.misses), (1, 0))
+        self.assertEqual(parsed_again, parsed)
+        parsed_again['vpc'] = "changed"
+
+        # Next process: from disk.
+        config_cache.ConfigCache.clear_memory()
+        parsed_again, cache = self.parse_env()
+        self.assertEqual((cache.hits, cache.misses), (1, 0))
+        self.assertEqual(parsed_again, parsed)
+
+        # A changed file is parsed again.
+        env_file = os.path.join(self.env_dir, "testenvironment.yaml")
+        with open(env_file, "a") as env_fp:
+            env_fp.write("\nvpc: vpc-1234\n")
+        parsed_again, cache = self.parse_env()
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+        self.assertEqual(parsed_again['vpc'], "vpc-1234")
+
+    def test_prune(self):
+        parsed, cache = self.parse_env()
+        other_dir = os.path.join(self.work_dir, "other")
+        shutil.copytree(self.env_dir, other_dir)
+        cfgparser = config_parser.ConfigParser()
+        cfgparser.parse_environment_configuration(other_dir,
+                                                  "testenvironment")
+        self.assertEqual(len(os.listdir(cache.cache_dir)), 2)
+
+        # A changed file drops its older document from memory.
+        env_file = os.path.join(self.env_dir, "testenvironment.yaml")
+        with open(env_file, "a") as env_fp:
+            env_fp.write("\nvpc: vpc-1234\n")
+        self.parse_env()
+        self.assertEqual(len(config_cache.ConfigCache.documents), 2)
+
+        # The next process that writes an entry removes the entries of
+        # the files that are gone.
+        shutil.rmtree(other_dir)
+        config_cache.ConfigCache.clear_memory()
+        with open(env_file, "a") as env_fp:
+            env_fp.write("\nregion: us-west-2\n")
+        self.parse_env()
+        self.assertEqual(os.listdir(cache.cache_dir),
+                         [os.path.basename(cache.get_entry_file(env_file))])
+
+    def test_not_json(self):
+        cfgparser = config_parser.ConfigParser()
+        for _ in range(2):
+            parsed = cfgparser.parse_cluster_configuration(
+                "created: 2017-01-01\nports: {80: http}\n")
+            self.assertEqual(parsed['ports'], {80: "http"})
+        self.assertEqual((cfgparser.cache.hits, cfgparser.cache.misses),
+                         (0, 2))
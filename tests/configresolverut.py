@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Unit tests for the config resolver
+'''
+
+import unittest
+import symphony.config_parser as config_parser
+import symphony.config_resolver as config_resolver
+import testenv
+
+
+# Keep the caches out of HOME.
+setUpModule = testenv.setUpModule
+tearDownModule = testenv.tearDownModule
+
+
+class ConfigResolverUt(unittest.TestCase):
+    '''Test the normalization precedence'''
+    def test_layered_config(self):
+        shared = config_resolver.LayeredConfig([
+            ("config", {'region': "us-west-2", 'tags': None}),
+            ("environment", {'region': "us-east-1", 'vpc': "vpc-1"}),
+            ("default", {'size': 1})])
+        child = shared.new_child("cluster", {'size': 3})
+        self.assertEqual(child.resolve('size'), (3, "cluster"))
+        self.assertEqual(shared.resolve('size'), (1, "default"))
+        self.assertEqual(child.resolve('region'), ("us-west-2", "config"))
+        self.assertEqual(child.resolve('region', layers=("environment",)),
+                         ("us-east-1", "environment"))
+        self.assertEqual(child.resolve('tags'), (None, "config"))
+        self.assertEqual(child.resolve('missing', default="x"),
+                         ("x", "default"))
+
+    def test_normalize(self):
+        parsed_env = {
+            'name': "testenv", 'type': "aws", 'region': "us-east-1",
+            'vpc': "vpc-env",
+            'subnets': {'private': {'us-east-1b': "subnet-env"}},
+            'security_groups': {'all': "sg-env"}
+        }
+        parsed_config = {
+            'name': "app",
+            'security_groups': {'all': "sg-config"},
+            'connection_info': {'username': "ec2-user"},
+            'clusters': {
+                'web': {
+                    'name': "web-cluster",
+                    'cluster_size': 3,
+                    'vpc': "vpc-web",
+                    'connection_info': {'username': "ubuntu"},
+                    'loadbalancer': {'port': 80},
+                    'services': {'nginx': None}
+                },
+                'db': None
+            }
+        }
+        cfgparser = config_parser.ConfigParser(use_cache=False)
+        data = cfgparser.normalize_parsed_configuration(parsed_config,
+                                                        parsed_env)
+        self.assertEqual(data['cluster_name'], "app")
+        self.assertEqual(data['cloud_type'], "aws")
+        self.assertEqual(data['security_groups'], {'all': "sg-config"})
+        self.assertEqual(data['subnets'], parsed_env['subnets'])
+
+        web = data['clusters']['web']
+        self.assertEqual(web['cluster_name'], "web-cluster")
+        self.assertEqual(web['cluster_size'], 3)
+        self.assertEqual(web['vpc_id'], "vpc-web")
+        self.assertEqual(web['connection_info'], {'username': "ubuntu"})
+        self.assertEqual(web['loadbalancer'], {'port': 80})
+        self.assertEqual(web['security_groups'], {'all': "sg-config"})
+
+        db = data['clusters']['db']
+        self.assertEqual(db['cluster_name'], "db")
+        self.assertEqual(db['cluster_size'], 1)
+        self.assertEqual(db['vpc_id'], "vpc-env")
+        self.assertEqual(db['connection_info'], {'username': "ec2-user"})
+        self.assertNotIn('loadbalancer', db)
+        self.assertIsNone(db['services'])
+
+        provenance = cfgparser.get_provenance
+        self.assertEqual(provenance('security_groups'), "config")
+        self.assertEqual(provenance('region'), "environment")
+        self.assertEqual(provenance('vpc_id', "web"), "cluster")
+        self.assertEqual(provenance('loadbalancer', "web"), "cluster")
+        self.assertEqual(provenance('vpc_id', "db"), "environment")
+        self.assertEqual(provenance('connection_info', "db"), "config")
+        self.assertEqual(provenance('instance_type', "db"), "default")
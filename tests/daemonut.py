@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Unit tests for the symphony daemon
+'''
+
+import shutil
+import os
+import unittest
+import json
+import tempfile
+import io
+import threading
+import symphony.tf_inventory as tf_inventory
+import symphony.daemon as daemon
+import testenv
+
+
+# Keep the caches out of HOME.
+setUpModule = testenv.setUpModule
+tearDownModule = testenv.tearDownModule
+
+
+class DaemonUt(unittest.TestCase):
+    '''Test the symphony daemon and its clients'''
+    def setUp(self):
+        self.staging = tempfile.mkdtemp()
+        shutil.copytree("./testdata/env1", os.path.join(self.staging, "env1"))
+        self.socket_path = os.path.join(self.staging, "daemon.sock")
+        self.daemon = daemon.SymphonyDaemon(socket_path=self.socket_path)
+        self.assertTrue(self.daemon.start())
+        self.thread = threading.Thread(target=self.daemon.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.daemon.server.shutdown()
+        self.thread.join()
+        shutil.rmtree(self.staging)
+
+    def call(self, operation, args=None):
+        output = io.StringIO()
+        reply = daemon.call(operation, args, socket_path=self.socket_path,
+                            output=output)
+        return reply, output.getvalue()
+
+    def test_operations(self):
+        reply, output = self.call("list", {'staging': self.staging})
+        self.assertEqual(reply, (0, None))
+        self.assertIn("Environment: env1", output)
+        self.assertIn("i-00000002", output)
+
+        reply, output = self.call("summary", {'staging': self.staging})
+        self.assertEqual(reply[0], 0)
+        summary = json.loads(output)
+        self.assertEqual(
+            summary['env1']['aws_instance']['i-00000002']['private_ip'],
+            "10.0.1.11")
+
+        reply, _ = self.call("inventory", {'staging': self.staging,
+                                           'priv_ip_flag': "True"})
+        self.assertEqual(reply[0], 0)
+        self.assertEqual(reply[1], tf_inventory.get_inventory(
+            tf_root=self.staging, priv_ip_flag="True"))
+
+        reply, output = self.call("nosuchoperation")
+        self.assertEqual(reply, (1, None))
+        self.assertIn("Unknown operation", output)
+
+        reply, _ = self.call("status")
+        self.assertEqual(reply[1]['requests'], 3)
+        self.assertEqual(reply[1]['inventories'], 1)
+
+    def test_logs_and_environment(self):
+        def run_helper(operation, args, env):
+            print(env.get('SYMPHONY_TEST_VALUE'))
+            print(args['staging'])
+            self.daemon.slog.logger.error("%s failed", operation)
+            return 1
+        self.daemon.run_helper = run_helper
+
+        output = io.StringIO()
+        errors = io.StringIO()
+        env = dict(os.environ, SYMPHONY_TEST_VALUE="client")
+        reply = daemon.call("build", {'staging': "teststaging"},
+                            socket_path=self.socket_path,
+                            output=output, errors=errors, env=env)
+        self.assertEqual(reply, (1, None))
+        # The paths are relative to the client working directory.
+        self.assertEqual(output.getvalue(), "client\n%s\n" %
+                         os.path.join(os.getcwd(), "teststaging"))
+        self.assertIn("build failed", errors.getvalue())
+        # The daemon environment is left alone.
+        self.assertNotIn('SYMPHONY_TEST_VALUE', os.environ)
+
+    def test_reads_during_build(self):
+        # A build holds the operation lock, the reads are still served.
+        started = threading.Event()
+        finish = threading.Event()
+
+        def run_helper(operation, args, env):
+            started.set()
+            finish.wait(10)
+            print("built")
+            return 0
+        self.daemon.run_helper = run_helper
+
+        build = {}
+        thread = threading.Thread(
+            target=lambda: build.update(reply=self.call("build", {})))
+        thread.start()
+        self.assertTrue(started.wait(10))
+        try:
+            reply, output = self.call("list", {'staging': self.staging,
+                                               'list_format': "jsonl"})
+            self.assertEqual(reply, (0, None))
+            self.assertEqual(len(output.splitlines()), 5)
+            reply, _ = self.call("inventory", {'staging': self.staging})
+            self.assertIn('Mysql-1', reply[1]['_meta']['hostvars'])
+            self.assertTrue(thread.is_alive())
+        finally:
+            finish.set()
+            thread.join()
+        self.assertEqual(build['reply'], ((0, None), "built\n"))
+
+    def test_inventory_invalidate(self):
+        args = {'staging': self.staging, 'priv_ip_flag': "True"}
+        reply, _ = self.call("inventory", args)
+        self.assertIn('Mysql-1', reply[1]['_meta']['hostvars'])
+
+        # Rewriting a state changes its fingerprint.
+        state_file = os.path.join(self.staging, "env1", "terraform.tfstate")
+        with open(state_file, "r") as tf_fp:
+            state = json.load(tf_fp)
+        resources = state['modules'][0]['resources']
+        del resources['aws_instance.spawn_instance_mysql-testcluster']
+        with open(state_file, "w") as tf_fp:
+            json.dump(state, tf_fp)
+        reply, _ = self.call("inventory", args)
+        self.assertNotIn('Mysql-1', reply[1]['_meta']['hostvars'])
+
+    def test_no_daemon(self):
+        socket_path = os.path.join(self.staging, "nodaemon.sock")
+        self.assertFalse(daemon.is_running(socket_path))
+        self.assertTrue(daemon.is_running(self.socket_path))
+        self.assertIsNone(daemon.call("list", {'staging': self.staging},
+                                      socket_path=socket_path))
+        operobj = {'operation': "list", 'staging': self.staging}
+        self.assertIsNone(daemon.run_operation(operobj,
+                                               socket_path=socket_path))
+
+        # A second daemon does not take over the socket.
+        self.assertFalse(daemon.SymphonyDaemon(
+            socket_path=self.socket_path).start())
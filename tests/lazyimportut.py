@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Unit tests for the lazy imports
+'''
+
+import shutil
+import unittest
+import tempfile
+import utils.lazy_import as lazy_import
+import benchmarks.import_bench as import_bench
+
+
+class ImportTimeUt(unittest.TestCase):
+    '''Test that the CLI only imports what an operation needs'''
+    def test_lazy_module(self):
+        module = lazy_import.LazyModule("json")
+        self.assertIn("not loaded", repr(module))
+        self.assertEqual(module.dumps([1]), "[1]")
+        self.assertIn("(loaded)", repr(module))
+
+    def test_cli_imports(self):
+        staging = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, staging)
+        commands = import_bench.get_commands(staging)
+        for name in ["help", "helper", "list"]:
+            modules, total, _ = import_bench.measure_imports(commands[name])
+            self.assertGreater(total, 0)
+            heavy = [module for module in import_bench.HEAVY_MODULES
+                     if module in modules]
+            if name == "list":
+                self.assertIn("symphony.tfparser", modules)
+            self.assertEqual(heavy, [], msg="%s imports %s" % (name, heavy))
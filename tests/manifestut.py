@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Unit tests for the build manifest
+'''
+
+import shutil
+import os
+import unittest
+import tempfile
+import symphony.manifest as manifest
+
+
+class ManifestUt(unittest.TestCase):
+    '''Test the build manifest digests'''
+    TEMPLATES = {
+        "cluster.j2": '{% include "macros.j2" %}{{ name }}\n',
+        "macros.j2": '{% import "inner.j2" as inner %}{{ inner.x() }}\n',
+        "inner.j2": '{% macro x() %}x{% endmacro %}\n',
+        "other.j2": 'other\n'
+    }
+
+    def setUp(self):
+        self.staging = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.staging)
+        self.searchpath = os.path.join(self.staging, "templates")
+        os.makedirs(self.searchpath)
+        for name, source in ManifestUt.TEMPLATES.items():
+            self.write_template(name, source)
+
+    def write_template(self, name, source):
+        with open(os.path.join(self.searchpath, name), "w") as tmpl_fp:
+            tmpl_fp.write(source)
+
+    def digest(self):
+        # A new manifest, as in the next build.
+        buildmanifest = manifest.BuildManifest(self.staging)
+        return buildmanifest.compute_digest(
+            {'name': "app"}, os.path.join(self.searchpath, "cluster.j2"),
+            None)
+
+    def test_template_closure(self):
+        self.assertEqual(
+            manifest.find_template_closure(self.searchpath, "cluster.j2"),
+            set(["cluster.j2", "macros.j2", "inner.j2"]))
+
+        digest = self.digest()
+        self.write_template("other.j2", "changed\n")
+        self.assertEqual(self.digest(), digest)
+
+        # A change in a template imported by an included one.
+        self.write_template("inner.j2", "{% macro x() %}y{% endmacro %}\n")
+        self.assertNotEqual(self.digest(), digest)
+
+    def test_computed_template_name(self):
+        self.write_template("cluster.j2", "{% include name + '.j2' %}\n")
+        self.assertEqual(
+            manifest.find_template_closure(self.searchpath, "cluster.j2"),
+            None)
+
+        # Any template of the search path may be used.
+        digest = self.digest()
+        self.write_template("other.j2", "changed\n")
+        self.assertNotEqual(self.digest(), digest)
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Unit tests for the multi environment deploy
+'''
+
+import shutil
+import os
+import unittest
+import time
+import tempfile
+import io
+import symphony.multi_deploy as multi_deploy
+import testenv
+
+
+# Keep the caches out of HOME.
+setUpModule = testenv.setUpModule
+tearDownModule = testenv.tearDownModule
+
+
+class MultiDeployUt(unittest.TestCase):
+    '''Test the concurrent deploy of a staging root'''
+    def setUp(self):
+        self.staging = tempfile.mkdtemp()
+        for env_name in ["app_dev", "app_prod", "db_dev"]:
+            env_dir = os.path.join(self.staging, env_name)
+            os.makedirs(env_dir)
+            with open(os.path.join(env_dir, "main.tf"), "w") as tf_fp:
+                tf_fp.write("# empty\n")
+        os.makedirs(os.path.join(self.staging, ".symphony"))
+        os.makedirs(os.path.join(self.staging, "notf"))
+        open(os.path.join(self.staging, "app_prod", "FAIL_plan"), "w").close()
+
+        self.saved_path = os.environ['PATH']
+        os.environ['PATH'] = os.path.abspath("./testdata/bin") + \
+            os.pathsep + self.saved_path
+
+    def tearDown(self):
+        os.environ['PATH'] = self.saved_path
+        os.environ.pop('FAKE_TF_SLEEP', None)
+        shutil.rmtree(self.staging)
+
+    def test_find_environments(self):
+        self.assertEqual(multi_deploy.find_environments(self.staging),
+                         ["app_dev", "app_prod", "db_dev"])
+
+    def test_deploy_all(self):
+        os.environ['FAKE_TF_SLEEP'] = "0.2"
+        stream = io.StringIO()
+        deployer = multi_deploy.MultiDeploy(self.staging, jobs=3,
+                                            stream=stream)
+        start = time.time()
+        results = deployer.run()
+        elapsed = time.time() - start
+        # 3 steps of 0.2s each, for 3 environments in parallel.
+        self.assertLess(elapsed, 1.5)
+
+        self.assertEqual(results['app_dev']['status'], "ok")
+        self.assertEqual(results['db_dev']['status'], "ok")
+        self.assertEqual(results['app_prod']['status'], "failed")
+        self.assertEqual(results['app_prod']['returncode'], 1)
+        self.assertEqual(results['app_prod']['step'], "plan")
+
+        with open(os.path.join(self.staging, "app_dev",
+                               ".fake_terraform.log")) as log_fp:
+            self.assertEqual(log_fp.read().split(), ["init", "plan", "apply"])
+        with open(os.path.join(self.staging, "app_prod",
+                               ".fake_terraform.log")) as log_fp:
+            self.assertEqual(log_fp.read().split(), ["init"])
+
+        output = stream.getvalue().splitlines()
+        self.assertIn("[db_dev] terraform apply", output)
+        self.assertIn("[app_prod] Error: plan failed", output)
+        self.assertIn("[app_dev] args: apply -auto-approve symphony.tfplan",
+                      output)
+        for line in output:
+            self.assertTrue(line.startswith("["), msg=line)
+
+        summary = multi_deploy.format_deploy_summary(results)
+        self.assertEqual(summary[-2], "3 jobs, 1 failed or skipped")
+        self.assertEqual(summary[-1], "app_prod: terraform plan failed")
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Unit tests for the template renderer
+'''
+
+import shutil
+import os
+import unittest
+import tempfile
+import symphony.renderer as renderer
+
+
+class RendererUt(unittest.TestCase):
+    '''Test the shared template engine'''
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_template_engine_shared(self):
+        searchpath = "./testdata/templates/aws"
+        engine = renderer.get_template_engine(searchpath)
+        self.assertIs(engine, renderer.get_template_engine(searchpath))
+
+        # Each bytecode cache dir gets its own engine.
+        cached = renderer.get_template_engine(searchpath,
+                                              cache_dir=self.cache_dir)
+        self.assertIsNot(cached, engine)
+        self.assertEqual(cached.bytecode_cache.directory, self.cache_dir)
+        self.assertIs(cached, renderer.get_template_engine(
+            os.path.abspath(searchpath), cache_dir=self.cache_dir))
+
+    def test_template_engine_counters(self):
+        searchpath = "./testdata/templates/aws"
+        obj = {
+            'region': 'us-west-2',
+            'profile_name': 'default',
+            'credentials_file': "/Users/home"
+        }
+        engine = renderer.TemplateEngine(searchpath,
+                                         cache_dir=self.cache_dir)
+        first = engine.render("common.j2", obj)
+        second = engine.render("common.j2", obj)
+        self.assertEqual(first, second)
+        stats = engine.stats()
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['bytecode_misses'], 1)
+        self.assertEqual(stats['bytecode_hits'], 0)
+
+        # A new engine on the same cache dir, as in the next build,
+        # loads the compiled template from disk.
+        engine = renderer.TemplateEngine(searchpath,
+                                         cache_dir=self.cache_dir)
+        self.assertEqual(engine.render("common.j2", obj), first)
+        stats = engine.stats()
+        self.assertEqual(stats['bytecode_hits'], 1)
+        self.assertEqual(stats['bytecode_misses'], 0)
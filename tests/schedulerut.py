@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Unit tests for the DAG scheduler
+'''
+
+import unittest
+import time
+import symphony.scheduler as scheduler
+
+
+class SchedulerUt(unittest.TestCase):
+    '''Test the DAG scheduler'''
+    def setUp(self):
+        self.events = []
+
+    def job(self, name, ret=0, delay=0.05):
+        self.events.append(("start", name))
+        time.sleep(delay)
+        self.events.append(("end", name))
+        return ret
+
+    def test_dependencies_respected(self):
+        dag = scheduler.DagScheduler(max_workers=4)
+        dag.add_job("a", self.job, args=("a",))
+        dag.add_job("b", self.job, depends_on=["a"], args=("b",))
+        dag.add_job("c", self.job, args=("c",))
+        results = dag.run()
+        self.assertEqual([results[x]['status'] for x in "abc"],
+                         ["ok", "ok", "ok"])
+        self.assertTrue(self.events.index(("end", "a")) <
+                        self.events.index(("start", "b")))
+        # 'c' is independent of 'a', so both start before either ends.
+        self.assertEqual(sorted(self.events[:2]),
+                         [("start", "a"), ("start", "c")])
+
+    def test_worker_limit(self):
+        dag = scheduler.DagScheduler(max_workers=1)
+        for name in "abc":
+            dag.add_job(name, self.job, args=(name,))
+        dag.run()
+        self.assertEqual(self.events,
+                         [("start", "a"), ("end", "a"),
+                          ("start", "b"), ("end", "b"),
+                          ("start", "c"), ("end", "c")])
+
+    def test_failure_skips_dependents(self):
+        dag = scheduler.DagScheduler(max_workers=2)
+        dag.add_job("a", self.job, args=("a",), kwargs={'ret': 2})
+        dag.add_job("b", self.job, depends_on=["a"], args=("b",))
+        dag.add_job("c", self.job, depends_on=["b"], args=("c",))
+        dag.add_job("d", self.job, args=("d",))
+        results = dag.run()
+        self.assertEqual(results["a"]['status'], "failed")
+        self.assertEqual(results["a"]['returncode'], 2)
+        self.assertEqual(results["b"]['status'], "skipped")
+        self.assertEqual(results["c"]['status'], "skipped")
+        self.assertEqual(results["d"]['status'], "ok")
+        summary = scheduler.format_summary(results, order=dag.order)
+        self.assertEqual(summary[-1], "4 jobs, 3 failed or skipped")
+
+    def test_invalid_graph(self):
+        dag = scheduler.DagScheduler()
+        dag.add_job("a", self.job, depends_on=["b"])
+        dag.add_job("b", self.job, depends_on=["a"])
+        self.assertRaises(ValueError, dag.run)
+
+        dag = scheduler.DagScheduler()
+        dag.add_job("a", self.job, depends_on=["missing"])
+        self.assertRaises(ValueError, dag.run)
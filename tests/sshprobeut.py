@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Unit tests for the ssh readiness probe
+'''
+
+import shutil
+import os
+import unittest
+import json
+import time
+import socket
+import tempfile
+import threading
+import symphony.command as command
+import symphony.ssh_probe as ssh_probe
+import symphony.ansible_config as ansible_config
+import symphony.helper as helper
+import testenv
+
+
+# Keep the caches out of HOME.
+setUpModule = testenv.setUpModule
+tearDownModule = testenv.tearDownModule
+
+
+class SSHProbeUt(unittest.TestCase):
+    '''Test the ssh readiness probe'''
+    def setUp(self):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind(("", 0))
+        self.server.listen(16)
+        self.port = self.server.getsockname()[1]
+        self.handshakes = []
+
+    def tearDown(self):
+        self.server.close()
+
+    def fake_handshake(self, host):
+        self.handshakes.append(host)
+        if host != "127.0.0.1":
+            raise Exception("Authentication failed")
+
+    def test_probe_ready(self):
+        probe = ssh_probe.SSHProbe("ec2-user", "/tmp/nokey",
+                                   port=self.port,
+                                   handshake=self.fake_handshake)
+        report = probe.wait_for_hosts(["127.0.0.1"])
+        self.assertTrue(report["127.0.0.1"]['ready'])
+        self.assertEqual(report["127.0.0.1"]['attempts'], 1)
+        self.assertTrue(report["127.0.0.1"]['time_to_ready'] >= 0)
+
+    def test_probe_retries_failing_hosts_only(self):
+        probe = ssh_probe.SSHProbe("ec2-user", "/tmp/nokey",
+                                   port=self.port,
+                                   max_attempts=3,
+                                   base_delay=0.01,
+                                   concurrency=2,
+                                   handshake=self.fake_handshake)
+        report = probe.wait_for_hosts(["127.0.0.1", "127.0.0.2"])
+        self.assertTrue(report["127.0.0.1"]['ready'])
+        self.assertFalse(report["127.0.0.2"]['ready'])
+        self.assertEqual(report["127.0.0.2"]['attempts'], 3)
+        self.assertTrue(report["127.0.0.2"]['error'].startswith("ssh:"))
+        self.assertEqual(self.handshakes.count("127.0.0.1"), 1)
+        self.assertEqual(self.handshakes.count("127.0.0.2"), 3)
+
+    def test_probe_tcp_gates_handshake(self):
+        # Nothing listens on this port, so no handshake is attempted.
+        self.server.close()
+        probe = ssh_probe.SSHProbe("ec2-user", "/tmp/nokey",
+                                   port=self.port,
+                                   max_attempts=2,
+                                   base_delay=0.01,
+                                   handshake=self.fake_handshake)
+        report = probe.wait_for_hosts(["127.0.0.1"])
+        self.assertFalse(report["127.0.0.1"]['ready'])
+        self.assertTrue(report["127.0.0.1"]['error'].startswith("tcp:"))
+        self.assertEqual(self.handshakes, [])
+
+    def test_probe_handshakes_up_to_concurrency(self):
+        # The handshakes are not capped by the default executor size.
+        self.server.listen(64)
+        lock = threading.Lock()
+        running = []
+        peak = []
+
+        def slow_handshake(host):
+            with lock:
+                running.append(host)
+                peak.append(len(running))
+            time.sleep(0.2)
+            with lock:
+                running.remove(host)
+
+        hosts = ["127.0.0.%d" % index for index in range(1, 49)]
+        probe = ssh_probe.SSHProbe("ec2-user", "/tmp/nokey",
+                                   port=self.port,
+                                   concurrency=len(hosts),
+                                   handshake=slow_handshake)
+        report = probe.wait_for_hosts(hosts)
+        self.assertTrue(all([status['ready']
+                             for status in report.values()]))
+        self.assertEqual(max(peak), len(hosts))
+
+    def test_backoff_delay(self):
+        probe = ssh_probe.SSHProbe("ec2-user", "/tmp/nokey",
+                                   base_delay=1, max_delay=8)
+        for attempt in range(10):
+            delay = probe.backoff_delay(attempt)
+            ceiling = min(8, 2 ** attempt)
+            self.assertTrue(ceiling / 2.0 <= delay <= ceiling)
+
+    def test_probe_waits_until_deadline(self):
+        # Without max_attempts, a failing host is retried until max_wait.
+        probe = ssh_probe.SSHProbe("ec2-user", "/tmp/nokey",
+                                   port=self.port,
+                                   max_wait=0.5,
+                                   base_delay=0.05,
+                                   handshake=self.fake_handshake)
+        start = time.time()
+        report = probe.wait_for_hosts(["127.0.0.2"])
+        self.assertGreaterEqual(time.time() - start, 0.5)
+        self.assertFalse(report["127.0.0.2"]['ready'])
+        self.assertGreater(report["127.0.0.2"]['attempts'], 2)
+
+    def test_probe_measures_reuse(self):
+        probe = ssh_probe.SSHProbe("ec2-user", "/tmp/nokey",
+                                   port=self.port,
+                                   measure_reuse=True,
+                                   handshake=self.fake_handshake)
+        report = probe.wait_for_hosts(["127.0.0.1"])
+        self.assertEqual(self.handshakes, ["127.0.0.1", "127.0.0.1"])
+        self.assertTrue(report["127.0.0.1"]['handshake_time'] >= 0)
+        self.assertTrue(report["127.0.0.1"]['reuse_time'] >= 0)
+
+        report = {'a': {'handshake_time': 0.5, 'reuse_time': 0.01},
+                  'b': {'handshake_time': 0.3, 'reuse_time': 0.03},
+                  'c': {'handshake_time': None, 'reuse_time': None}}
+        self.assertEqual(ssh_probe.connection_savings(report),
+                         {'setup_ms': 400.0, 'reuse_ms': 20.0,
+                          'saved_ms': 380.0})
+        self.assertEqual(ssh_probe.connection_savings({}), {})
+
+    def test_credentials(self):
+        probe = ssh_probe.SSHProbe("ec2-user", "/tmp/key",
+                                   credentials={
+                                       '10.0.0.2': ("ubuntu", "/tmp/other")})
+        command = probe.get_ssh_command("10.0.0.1")
+        self.assertIn("ec2-user", command)
+        self.assertIn("/tmp/key", command)
+        command = probe.get_ssh_command("10.0.0.2")
+        self.assertEqual(command[command.index("-l") + 1], "ubuntu")
+        self.assertEqual(command[command.index("-i") + 1], "/tmp/other")
+
+    def test_ssh_targets(self):
+        # The hosts are probed as ansible connects to them.
+        staging = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, staging)
+        env_dir = os.path.join(staging, "env1")
+        shutil.copytree("./testdata/env1", env_dir)
+        state_file = os.path.join(env_dir, "terraform.tfstate")
+        with open(state_file) as tf_fp:
+            state = json.load(tf_fp)
+        for resource in state['modules'][0]['resources'].values():
+            attributes = resource['primary']['attributes']
+            if resource['type'] == "aws_instance":
+                attributes['public_ip'] = \
+                    attributes['private_ip'].replace("10.0.1.", "54.0.0.")
+        # The cluster groups are the outputs, holding the same addresses.
+        for output in state['modules'][0]['outputs'].values():
+            output['value'] = json.loads(json.dumps(
+                output['value']).replace("10.0.1.", "54.0.0."))
+        with open(state_file, "w") as tf_fp:
+            json.dump(state, tf_fp)
+
+        helperobj = helper.Helper({'operation': "list", 'staging': staging})
+        helperobj.normalized_data = {'clusters': {
+            'rabbitmq': {'cluster_name': "rabbitmq-testcluster",
+                         'private_key_loc': "/tmp/rabbitmq-key",
+                         'connection_info': {'username': "ubuntu",
+                                             'use_private_ip': False}}}}
+        targets = helperobj.get_ssh_targets(staging, "ec2-user",
+                                            "/tmp/key")
+        self.assertEqual(targets, {
+            '54.0.0.10': ("ubuntu", "/tmp/rabbitmq-key"),
+            '54.0.0.11': ("ubuntu", "/tmp/rabbitmq-key"),
+            '10.0.1.20': ("ec2-user", "/tmp/key")})
+
+    def test_openssh_handshake(self):
+        staging = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, staging)
+        options = ansible_config.get_ssh_options(staging)
+        probe = ssh_probe.SSHProbe("ec2-user", "/tmp/nokey",
+                                   port=self.port,
+                                   ssh_options=options)
+        self.assertTrue(probe.measure_reuse)
+        command = probe.get_ssh_command("10.0.0.1")
+        self.assertEqual(command[-2:], ["10.0.0.1", "true"])
+        self.assertIn("ControlPath=%s/%%C" %
+                      ansible_config.get_control_dir(staging), command)
+
+        # Nothing listens on the port anymore, ssh fails.
+        self.server.close()
+        if shutil.which("ssh") is not None:
+            self.assertRaises(Exception, probe.openssh_handshake,
+                              "127.0.0.1")
@@ -6,42 +6,71 @@ Unit tests for All symphony modules.
 '''
 
 import os
+import shutil
+import tempfile
 import unittest
 import utils.symphony_logger as logger
 import utils.consulapi as consulapi
 import symphony.tfparser as tfparser
 import symphony.helper as helper
+import symphony.config_parser as config_parser
+import benchmarks.synthetic as synthetic
+import testenv
+
+
+# Keep the caches out of HOME.
+setUpModule = testenv.setUpModule
+tearDownModule = testenv.tearDownModule
 
 
 class TFParserUt(unittest.TestCase):
     def test_parser_init_invalid(self):
-        print "Test TFParser Initialization"
+        print("Test TFParser Initialization")
         cluster_dir = "/foobar"
         parser = tfparser.TFParser(cluster_dir, slogger=None)
         self.failUnless(parser.tfobject is None)
 
     def test_parser_init_valid(self):
-        print "Test TFParser valid"
+        print("Test TFParser valid")
         cluster_dir = "./testdata/env1"
         parser = tfparser.TFParser(cluster_dir, slogger=None)
         self.failUnless(parser.tfobject is not None)
-        print parser.tfobject
+        print(parser.tfobject)
 
     def test_parser_get_all_resource_types(self):
-        print "Test api for resource types"
+        print("Test api for resource types")
         cluster_dir = "./testdata/env1"
         parser = tfparser.TFParser(cluster_dir, slogger=None)
         self.failUnless(parser.tfobject is not None)
         restypes = parser.parser_get_all_resource_types()
-        print "Resource types: ", restypes
+        print("Resource types: ", restypes)
+
+    def test_parser_use_cache(self):
+        print("Test TFParser with the tfstate cache")
+        staging = tempfile.mkdtemp()
+        shutil.copytree("./testdata/env1", os.path.join(staging, "env1"))
+        parser = tfparser.TFParser(staging, slogger=None)
+        expected = parser.terraform_get_environment_summary()
+
+        for _ in range(2):
+            parser = tfparser.TFParser(staging, slogger=None, use_cache=True)
+            self.failUnless(
+                parser.terraform_get_environment_summary() == expected)
+        self.failUnless(parser.cache.hits == 1)
+        self.assertEqual(list(parser.tfobject), ["env1"])
+
+        parser = tfparser.TFParser(staging, slogger=None, streaming=True)
+        self.failUnless(
+            parser.terraform_get_environment_summary() == expected)
+        shutil.rmtree(staging)
 
 
 class SymphonyUt(unittest.TestCase):
     def test_basic(self):
-        print "Test Basic"
+        print("Test Basic")
 
     def test_logging_basic(self):
-        print "Test logging utility"
+        print("Test logging utility")
 
         slog = logger.Logger(name="TestModule")
         self.failUnless(slog.logger is not None)
@@ -55,7 +84,7 @@ class SymphonyUt(unittest.TestCase):
         slog2.logger.info("Another Log INFO MSG")
 
     def test_logging_newfile(self):
-        print "Test Logging utility"
+        print("Test Logging utility")
         slog = logger.Logger(name="NEWTEST",
                              logfile="/tmp/newlog.log")
         self.failUnless(slog.logger is not None)
@@ -63,7 +92,7 @@ class SymphonyUt(unittest.TestCase):
         slog.logger.debug("Test logging newfile: DEBUG log")
 
     def test_build_operation_init_invalid_1(self):
-        print "Helper Build operation init"
+        print("Helper Build operation init")
         obj = {}
         obj['operation'] = "build"
         obj['config'] = open("./testdata/clusters/invalid_cluster.yaml")
@@ -72,7 +101,7 @@ class SymphonyUt(unittest.TestCase):
         obj['skip_deploy'] = True
         obj['template'] = "../templates"
 
-        print "Invalid cluster config --->"
+        print("Invalid cluster config --->")
         helperobj = helper.Helper(obj)
         self.failUnless(helperobj is not None)
         self.failUnless(helperobj.valid is False)
@@ -81,7 +110,7 @@ class SymphonyUt(unittest.TestCase):
         obj['config'] = open("./testdata/clusters/rabbitmq_cluster.yaml")
         obj['environment'] = "./testdata/dummydir/"
 
-        print "Invlaid environments dir path --->"
+        print("Invlaid environments dir path --->")
         helperobj = helper.Helper(obj)
         self.failUnless(helperobj is not None)
         self.failUnless(helperobj.valid is False)
@@ -90,14 +119,14 @@ class SymphonyUt(unittest.TestCase):
         obj['config'] = open("./testdata/clusters/rabbitmq_cluster.yaml")
         obj['environment'] = "./testdata/environment"
         obj['staging'] = "/tmp/symphony.log"
-        print "Invlaid staging path --->"
+        print("Invlaid staging path --->")
         helperobj = helper.Helper(obj)
         self.failUnless(helperobj is not None)
         self.failUnless(helperobj.valid is False)
         obj['config'].close()
 
     def test_normalize_data(self):
-        print "Test Normalizing API"
+        print("Test Normalizing API")
         obj = {}
         obj['operation'] = "build"
         obj['config'] = open("./testdata/clusters/rabbitmq_cluster.yaml")
@@ -111,14 +140,14 @@ class SymphonyUt(unittest.TestCase):
         self.failUnless(helperobj.valid is True)
 
         data = helperobj.normalize_parsed_configuration()
-        print data
+        print(data)
         self.failUnless(data['clusters']['rabbitmq']['region'] == 'us-east-1')
         self.failUnless(data['clusters']['rabbitmq']
                         ['amis']['centos7'] == "ami-xxxxxxx9")
         self.failUnless(data['profile_name'] == "default")
 
     def test_perform_operation_build(self):
-        print "Test the perform_operation API for build"
+        print("Test the perform_operation API for build")
         obj = {}
         obj['operation'] = "build"
         obj['config'] = open("./testdata/clusters/rabbitmq_cluster.yaml")
@@ -133,6 +162,230 @@ class SymphonyUt(unittest.TestCase):
 
         helperobj.perform_operation()
 
+    def test_perform_operation_build_parallel(self):
+        print("Test the parallel build, with per cluster errors")
+        testdir = os.getcwd()
+        staging = tempfile.mkdtemp()
+        obj = {}
+        obj['operation'] = "build"
+        obj['config'] = open("./testdata/clusters/multi_cluster.yaml")
+        obj['environment'] = "./testdata/environment"
+        obj['staging'] = staging
+        obj['skip_deploy'] = True
+        obj['template'] = os.path.join(testdir, "testdata/templates")
+        obj['jobs'] = 4
+
+        helperobj = helper.Helper(obj)
+        self.failUnless(helperobj.valid is True)
+
+        # Init scripts are generated from ./scripts/common.sh
+        os.chdir("..")
+        try:
+            ret = helperobj.perform_operation()
+            errors = helperobj.build_cluster_templates(
+                helperobj.tf_cluster_staging,
+                helperobj.normalized_data, jobs=4)
+        finally:
+            os.chdir(testdir)
+            obj['config'].close()
+
+        # The broken cluster fails, but does not stop the others.
+        self.failUnless(ret == 1)
+        cluster_staging = os.path.join(staging, "multiapp_testenvironment")
+        for cluster in ["rabbitmq", "mysql", "consul"]:
+            tf_file = os.path.join(cluster_staging,
+                                   "%s-testcluster.tf" % cluster)
+            script = os.path.join(cluster_staging, "scripts",
+                                  "%s-testcluster.sh" % cluster)
+            self.failUnless(os.path.exists(tf_file))
+            self.failUnless(os.path.exists(script))
+        self.failIf(os.path.exists(
+            os.path.join(cluster_staging, "broken-testcluster.tf")))
+        self.assertEqual(list(errors), ["broken"])
+        shutil.rmtree(staging)
+
+    def test_perform_operation_build_common_failure(self):
+        print("Test a failed common template render fails the build")
+        testdir = os.getcwd()
+        staging = tempfile.mkdtemp()
+        templates = os.path.join(staging, "templates")
+        shutil.copytree(os.path.join(testdir, "testdata/templates"),
+                        templates)
+        os.remove(os.path.join(templates, "aws", "common.j2"))
+        obj = {}
+        obj['operation'] = "build"
+        obj['config'] = open("./testdata/clusters/rabbitmq_cluster.yaml")
+        obj['environment'] = "./testdata/environment"
+        obj['staging'] = os.path.join(staging, "build")
+        obj['template'] = templates
+
+        helperobj = helper.Helper(obj)
+        self.failUnless(helperobj.valid is True)
+        os.chdir("..")
+        try:
+            ret = helperobj.perform_operation()
+        finally:
+            os.chdir(testdir)
+            obj['config'].close()
+
+        # The clusters are not rendered after the common failure.
+        self.assertEqual(ret, 1)
+        cluster_staging = os.path.join(staging, "build",
+                                       "mytestapp_testenvironment")
+        self.failIf(os.path.exists(os.path.join(cluster_staging,
+                                                "common.tf")))
+        self.failIf(os.path.exists(os.path.join(
+            cluster_staging, "rabbitmq-testcluster.tf")))
+        shutil.rmtree(staging)
+
+    def test_perform_operation_build_incremental(self):
+        print("Test the incremental build skips unchanged clusters")
+        testdir = os.getcwd()
+        staging = tempfile.mkdtemp()
+        tf_file = os.path.join(staging, "multiapp_testenvironment",
+                               "mysql-testcluster.tf")
+        summaries = []
+        mtimes = []
+        for _ in range(2):
+            obj = {}
+            obj['operation'] = "build"
+            obj['config'] = open("./testdata/clusters/multi_cluster.yaml")
+            obj['environment'] = "./testdata/environment"
+            obj['staging'] = staging
+            obj['template'] = os.path.join(testdir, "testdata/templates")
+            obj['incremental'] = True
+
+            helperobj = helper.Helper(obj)
+            self.failUnless(helperobj.valid is True)
+            os.chdir("..")
+            try:
+                helperobj.perform_operation()
+            finally:
+                os.chdir(testdir)
+                obj['config'].close()
+            summaries.append(helperobj.build_summary)
+            mtimes.append(os.stat(tf_file).st_mtime)
+
+        # common + 3 clusters. The broken cluster is never built.
+        self.failUnless(summaries[0] == {'rebuilt': 4, 'skipped': 0})
+        self.failUnless(summaries[1] == {'rebuilt': 0, 'skipped': 4})
+        self.failUnless(mtimes[0] == mtimes[1])
+        shutil.rmtree(staging)
+
+    def test_configure_schedule(self):
+        print("Test the configure DAG built from depends_on")
+        staging = tempfile.mkdtemp()
+        obj = {}
+        obj['operation'] = "configure"
+        obj['config'] = open("./testdata/clusters/multi_cluster.yaml")
+        obj['environment'] = "./testdata/environment"
+        obj['staging'] = staging
+        obj['jobs'] = 4
+
+        helperobj = helper.Helper(obj)
+        self.failUnless(helperobj.valid is True)
+        helperobj.normalized_data = \
+            helperobj.cfgparser.normalize_parsed_configuration(
+                helperobj.parsed_config, helperobj.parsed_env)
+        dag = helperobj.build_configure_schedule(staging)
+        obj['config'].close()
+
+        self.failUnless(sorted(dag.jobs.keys()) ==
+                        ["consul/consul", "mysql/mysql",
+                         "rabbitmq/lmmagent", "rabbitmq/rabbitmq"])
+        # Services of a cluster run in order.
+        self.failUnless(dag.jobs["rabbitmq/lmmagent"].depends_on ==
+                        ["rabbitmq/rabbitmq"])
+        # mysql waits for the whole rabbitmq cluster, consul for nothing.
+        self.failUnless(sorted(dag.jobs["mysql/mysql"].depends_on) ==
+                        ["rabbitmq/lmmagent", "rabbitmq/rabbitmq"])
+        self.failUnless(dag.jobs["consul/consul"].depends_on == [])
+        self.failUnless(dag.jobs["rabbitmq/lmmagent"].args[0] == "/tmp/lmm")
+        dag.validate()
+        shutil.rmtree(staging)
+
+
+class ConfigureBatchUt(unittest.TestCase):
+    '''Test the configure schedule with one playbook per cluster'''
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.paths = synthetic.write_configs(self.work_dir, 2, 2)
+        self.staging = os.path.join(self.work_dir, "staging")
+        os.makedirs(self.staging)
+        self.path = os.environ['PATH']
+        bin_dir = os.path.join(os.path.dirname(os.path.dirname(
+            os.path.abspath(__file__))), "benchmarks", "bin")
+        os.environ['PATH'] = bin_dir + os.pathsep + self.path
+
+    def tearDown(self):
+        os.environ['PATH'] = self.path
+        shutil.rmtree(self.work_dir)
+
+    def get_helper(self, batch):
+        with open(self.paths['config']) as config_fp:
+            helperobj = helper.Helper({'operation': "configure",
+                                       'config': config_fp,
+                                       'environment':
+                                           self.paths['environment'],
+                                       'staging': self.staging,
+                                       'batch': batch})
+        self.assertTrue(helperobj.valid)
+        helperobj.normalized_data = \
+            helperobj.cfgparser.normalize_parsed_configuration(
+                helperobj.parsed_config, helperobj.parsed_env)
+        return helperobj
+
+    def test_schedule(self):
+        dag = self.get_helper(False).build_configure_schedule(self.staging)
+        self.assertEqual(len(dag.order), 4)
+
+        dag = self.get_helper(True).build_configure_schedule(self.staging)
+        self.assertEqual(dag.order, ["cluster0", "cluster1"])
+        job = dag.jobs["cluster0"]
+        self.assertEqual(job.kwargs['job_name'], "cluster0")
+        self.assertNotIn('hosts', job.kwargs)
+        self.assertNotIn('service_vars', job.kwargs)
+        self.assertTrue(os.path.isfile(helper.TF_DYNAMIC_INVENTORY))
+
+        playbook_file = os.path.join(*job.args)
+        self.assertEqual(playbook_file, os.path.join(
+            self.staging, ".symphony", "playbooks", "cluster0.yaml"))
+        with open(playbook_file) as playbook_fp:
+            plays = config_parser.load_yaml(playbook_fp.read())
+        self.assertEqual(
+            [play['import_playbook'] for play in plays],
+            [os.path.join(self.paths['services'], service, "site.yaml")
+             for service in ("service0", "service1")])
+        self.assertEqual(plays[1]['vars']['version'], "1.1")
+        self.assertEqual(plays[1]['vars']['hosts'], "cluster0-bench")
+
+        results = dag.run()
+        self.assertEqual([results[name]['status'] for name in dag.order],
+                         ["ok", "ok"])
+        log_file = os.path.join(self.staging, ".symphony", "logs",
+                                "cluster0.log")
+        with open(log_file) as log_fp:
+            self.assertIn("cluster0.yaml", log_fp.read())
+
+    def test_dependencies(self):
+        helperobj = self.get_helper(True)
+        clusters = helperobj.normalized_data['clusters']
+        clusters['cluster1']['services']['service0']['depends_on'] = \
+            "cluster0/service1"
+        clusters['cluster1']['services']['service1']['depends_on'] = \
+            "service0"
+        dag = helperobj.build_configure_schedule(self.staging)
+        self.assertEqual(dag.jobs["cluster1"].depends_on, ["cluster0"])
+        with open(os.path.join(self.staging, ".symphony", "playbooks",
+                               "cluster1.yaml")) as playbook_fp:
+            self.assertNotIn("depends_on", playbook_fp.read())
+
+        # The imports run in order.
+        clusters['cluster1']['services']['service0']['depends_on'] = \
+            "service1"
+        self.assertRaises(ValueError, helperobj.build_configure_schedule,
+                          self.staging)
+
 
 class ConsulAPIUt(unittest.TestCase):
     def test_basic(self):
@@ -141,7 +394,7 @@ class ConsulAPIUt(unittest.TestCase):
         (ret, members) = cclient.list_nodes()
         self.failUnless(ret == 0)
         for member in members:
-            print member['Name'], member['Tags']['role']
+            print(member['Name'], member['Tags']['role'])
 
 
 
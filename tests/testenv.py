@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Test environment shared by the unit tests
+'''
+
+import os
+import shutil
+import tempfile
+
+
+# The caches default to ~/.symphony, the tests keep theirs in a temporary
+# directory instead.
+CACHE_ENV = {'SYMPHONY_CONFIG_CACHE_DIR': "config-cache",
+             'SYMPHONY_PLUGIN_CACHE_DIR': "plugin-cache"}
+saved_env = {}
+
+
+def setUpModule():
+    cache_home = tempfile.mkdtemp()
+    saved_env['cache_home'] = cache_home
+    for name, subdir in CACHE_ENV.items():
+        saved_env[name] = os.environ.get(name)
+        os.environ[name] = os.path.join(cache_home, subdir)
+
+
+def tearDownModule():
+    for name in CACHE_ENV:
+        if saved_env[name] is None:
+            os.environ.pop(name, None)
+        else:
+            os.environ[name] = saved_env[name]
+    shutil.rmtree(saved_env['cache_home'])
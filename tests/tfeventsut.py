@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Unit tests for the terraform JSON events
+'''
+
+import shutil
+import os
+import unittest
+import json
+import tempfile
+import io
+import symphony.command as command
+import symphony.multi_deploy as multi_deploy
+import symphony.tf_events as tf_events
+import testenv
+
+
+# Keep the caches out of HOME.
+setUpModule = testenv.setUpModule
+tearDownModule = testenv.tearDownModule
+
+
+class TFEventsUt(unittest.TestCase):
+    '''Test the terraform JSON event stream timings'''
+    EVENTS_DIR = "./testdata/tf_events"
+
+    def replay(self, sink, operation):
+        with open(os.path.join(TFEventsUt.EVENTS_DIR,
+                               operation + ".jsonl")) as events_fp:
+            for line in events_fp:
+                sink.write("stdout", line)
+
+    def test_timings(self):
+        console = io.StringIO()
+        sink = tf_events.EventSink(
+            console=command.ConsoleSink(stream=console))
+        self.replay(sink, "plan")
+        self.replay(sink, "apply")
+        sink.write("stderr", "not json\n")
+
+        report = sink.timings.report()
+        operations = dict([((op['phase'], op['address']), op)
+                           for op in report['operations']])
+        refresh = operations[("refresh", "aws_key_pair.spawn_keypair")]
+        self.assertAlmostEqual(refresh['duration'], 0.5)
+        self.assertEqual(
+            operations[("apply", "aws_elb.app")]['duration'], 4.0)
+        failed = operations[("apply", "aws_instance.spawn_instance_rabbitmq[0]")]
+        self.assertEqual((failed['status'], failed['duration'],
+                          failed['action']), ("error", 32.0, "create"))
+        self.assertEqual(report['totals_by_type']['aws_instance'],
+                         {'count': 2, 'duration': 53.0})
+        self.assertEqual(report['change_summary']['add'], 2)
+        self.assertEqual(report['errors'],
+                         ["creating EC2 Instance: InsufficientInstanceCapacity"])
+
+        summary = sink.timings.summary()
+        self.assertTrue(summary[3].startswith(
+            "aws_instance.spawn_instance_rabbitmq[0]"))
+        self.assertEqual(summary[-1], "3 resources applied, 1 failed")
+
+        output = console.getvalue().splitlines()
+        self.assertIn("aws_elb.app: Creation complete after 4s [id=app]",
+                      output)
+        self.assertEqual(output[-1], "not json")
+
+    def test_deploy_json_events(self):
+        staging = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, staging)
+        env_dir = os.path.join(staging, "app_dev")
+        os.makedirs(env_dir)
+        with open(os.path.join(env_dir, "main.tf"), "w") as tf_fp:
+            tf_fp.write('resource "null_resource" "x" {}\n')
+
+        saved_env = dict(os.environ)
+
+        def restore_env():
+            os.environ.clear()
+            os.environ.update(saved_env)
+        self.addCleanup(restore_env)
+        os.environ['PATH'] = os.path.abspath("./testdata/bin") + \
+            os.pathsep + os.environ['PATH']
+        os.environ['FAKE_TF_EVENTS'] = os.path.abspath(TFEventsUt.EVENTS_DIR)
+
+        stream = io.StringIO()
+        deployer = multi_deploy.MultiDeploy(staging, json_events=True,
+                                            stream=stream)
+        results = deployer.run()
+        self.assertEqual(results['app_dev']['status'], "ok")
+
+        output = stream.getvalue().splitlines()
+        self.assertIn("[app_dev] Plan: 3 to add, 0 to change, 0 to destroy.",
+                      output)
+        self.assertIn("[app_dev] 3 resources applied, 1 failed", output)
+        with open(os.path.join(env_dir, tf_events.REPORT_FILE)) as report_fp:
+            report = json.load(report_fp)
+        self.assertEqual(len(report['operations']), 4)
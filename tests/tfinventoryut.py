@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Unit tests for the dynamic inventory
+'''
+
+import shutil
+import os
+import unittest
+import sys
+import json
+import tempfile
+import subprocess
+import symphony.tf_inventory as tf_inventory
+import testenv
+
+
+# Keep the caches out of HOME.
+setUpModule = testenv.setUpModule
+tearDownModule = testenv.tearDownModule
+
+
+class TFInventoryUt(unittest.TestCase):
+    '''Test the dynamic inventory'''
+    def setUp(self):
+        self.staging = tempfile.mkdtemp()
+        shutil.copytree("./testdata/env1", os.path.join(self.staging, "env1"))
+        self.saved_root = os.environ.get('TERRAFORM_STATE_ROOT')
+        os.environ['TERRAFORM_STATE_ROOT'] = self.staging
+
+    def tearDown(self):
+        if self.saved_root is None:
+            del os.environ['TERRAFORM_STATE_ROOT']
+        else:
+            os.environ['TERRAFORM_STATE_ROOT'] = self.saved_root
+        shutil.rmtree(self.staging)
+
+    def test_list_inventory(self):
+        inv = tf_inventory.TFInventory().list_inventory()
+        hostvars = inv['_meta']['hostvars']
+        self.assertEqual(sorted(hostvars.keys()),
+                         ['Mysql-1', 'Rabbitmq-0', 'Rabbitmq-1'])
+        self.assertEqual(hostvars['Mysql-1']['ansible_ssh_host'],
+                         "10.0.1.20")
+
+        self.assertEqual(inv['rabbitmq-testcluster']['hosts'],
+                         ['Rabbitmq-1', 'Rabbitmq-0'])
+        self.assertEqual(inv['rabbitmq-testcluster']['vars']['ipaddrs'],
+                         ['10.0.1.10', '10.0.1.11'])
+        self.assertEqual(inv['mysql-testcluster']['hosts'], ['Mysql-1'])
+
+        # Every host is in its tag groups, including the first one seen.
+        self.assertEqual(sorted(inv['tags.Environment=devtest']['hosts']),
+                         ['Mysql-1', 'Rabbitmq-0', 'Rabbitmq-1'])
+        self.assertEqual(sorted(inv['tags.Project=Rabbitmq']['hosts']),
+                         ['Rabbitmq-0', 'Rabbitmq-1'])
+        self.assertEqual(inv['tags.Name=Mysql-1']['hosts'], ['Mysql-1'])
+
+    def test_run_as_script(self):
+        # The way ansible runs it: as a script, without PYTHONPATH.
+        env = os.environ.copy()
+        env.pop('PYTHONPATH', None)
+        env['SYMPHONY_DAEMON'] = "0"
+        output = subprocess.check_output(
+            [sys.executable, os.path.abspath(tf_inventory.__file__),
+             "--list"], cwd=self.staging, env=env)
+        inv = json.loads(output.decode("utf-8"))
+        self.assertEqual(inv['mysql-testcluster']['hosts'], ['Mysql-1'])
+
+    def test_load_inventory_without_daemon(self):
+        # Without a daemon socket, the daemon client is not imported.
+        env = dict(os.environ, PYTHONPATH=os.path.abspath(".."),
+                   SYMPHONY_DAEMON_SOCKET=os.path.join(self.staging,
+                                                       "daemon.sock"))
+        code = ("import sys, json\n"
+                "import symphony.tf_inventory as tf_inventory\n"
+                "inv = tf_inventory.load_inventory()\n"
+                "print(json.dumps(['symphony.daemon' in sys.modules,\n"
+                "                  inv['mysql-testcluster']['hosts']]))\n")
+        output = subprocess.check_output([sys.executable, "-c", code],
+                                         env=env)
+        self.assertEqual(json.loads(output.decode("utf-8")),
+                         [False, ['Mysql-1']])
+
+    def test_inventory_cache(self):
+        cache = tf_inventory.InventoryCache(self.staging, "True")
+        fingerprints = cache.get_fingerprints()
+        self.assertEqual(len(fingerprints), 1)
+        self.assertEqual(cache.load(fingerprints), None)
+
+        inv = tf_inventory.get_inventory()
+        self.assertEqual(cache.load(fingerprints), inv)
+        self.assertEqual(tf_inventory.get_inventory(), inv)
+
+        # A different USE_PRIVATE_IP, or an expired entry, is a miss.
+        self.assertEqual(tf_inventory.InventoryCache(
+            self.staging, "False").load(fingerprints), None)
+        self.assertEqual(tf_inventory.InventoryCache(
+            self.staging, "True", ttl=-1).load(fingerprints), None)
+
+        # Rewriting a state changes its fingerprint.
+        state_file = os.path.join(self.staging, "env1", "terraform.tfstate")
+        with open(state_file, "r") as tf_fp:
+            state = json.load(tf_fp)
+        resources = state['modules'][0]['resources']
+        del resources['aws_instance.spawn_instance_mysql-testcluster']
+        with open(state_file, "w") as tf_fp:
+            json.dump(state, tf_fp)
+        self.assertEqual(cache.load(cache.get_fingerprints()), None)
+        inv = tf_inventory.get_inventory()
+        self.assertNotIn('Mysql-1', inv['_meta']['hostvars'])
+
+    def test_inventory_host(self):
+        script = [sys.executable, "-m", "symphony.tf_inventory"]
+        env = dict(os.environ, PYTHONPATH=os.path.abspath(".."))
+        output = subprocess.check_output(script + ["--host", "Rabbitmq-0"],
+                                         env=env)
+        hostvars = json.loads(output.decode("utf-8"))
+        self.assertEqual(hostvars['ansible_ssh_host'], "10.0.1.11")
+        self.assertEqual(hostvars['id'], "i-00000002")
+
+        output = subprocess.check_output(script + ["--host", "nosuchhost"],
+                                         env=env)
+        self.assertEqual(json.loads(output.decode("utf-8")), {})
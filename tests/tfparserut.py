@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Unit tests for the tfparser list output
+'''
+
+import shutil
+import os
+import unittest
+import sys
+import json
+import tempfile
+import io
+import symphony.tfparser as tfparser
+
+
+class ListFormatUt(unittest.TestCase):
+    '''Test the list output formats and filters'''
+    def setUp(self):
+        self.staging = tempfile.mkdtemp()
+        shutil.copytree("./testdata/env1", os.path.join(self.staging, "env1"))
+        shutil.copytree("./testdata/env1", os.path.join(self.staging, "env2"))
+        self.parser = tfparser.TFParser(self.staging)
+
+    def tearDown(self):
+        shutil.rmtree(self.staging)
+
+    def write(self, output_format, **kwargs):
+        out = io.StringIO()
+        self.parser.terraform_write_resources(output_format, out=out,
+                                              **kwargs)
+        return out.getvalue()
+
+    def test_jsonl(self):
+        rows = [json.loads(line)
+                for line in self.write("jsonl").splitlines()]
+        self.assertEqual(len(rows), 2 * 5)
+        elb = [row for row in rows if row['type'] == "aws_elb"][0]
+        self.assertEqual(sorted(elb['instances']),
+                         ["i-00000001", "i-00000002"])
+
+        rows = json.loads(self.write("json", types=["aws_instance"]))
+        self.assertEqual(len(rows), 2 * 3)
+        self.assertEqual(set([row['environment'] for row in rows]),
+                         set(["env1", "env2"]))
+        self.assertEqual(json.loads(self.write("json", types=["nosuch"])),
+                         [])
+
+    def test_csv_filters(self):
+        tags = [tfparser.parse_tag("Project=Rabbitmq")]
+        lines = self.write("csv", types=["aws_instance"],
+                           tags=tags).splitlines()
+        self.assertEqual(lines[0], "environment,type,id,ami,private_ip,"
+                         "instance_state,instance_type,key_name")
+        self.assertEqual(len(lines), 1 + 2 * 2)
+        self.assertTrue(lines[1].endswith(",10.0.1.10,running,t2.micro,"
+                                          "mytestapp-key") or
+                        lines[1].endswith(",10.0.1.11,running,t2.micro,"
+                                          "mytestapp-key"))
+
+        parser = tfparser.TFParser(self.staging, environments=["env2"])
+        self.assertEqual(list(parser.tfobject.keys()), ["env2"])
+        self.assertRaises(ValueError, tfparser.parse_tag, "Project")
+
+    def test_rows_per_state(self):
+        # Without preload, the rows of a state come before the next state
+        # is loaded, a broken one here.
+        state_files = tfparser.find_state_files(self.staging)
+        with open(state_files[1][1], "w") as tf_fp:
+            tf_fp.write('{"modules": [')
+        for streaming in [False, True]:
+            parser = tfparser.TFParser(self.staging, streaming=streaming,
+                                       preload=False)
+            self.assertIsNone(parser.tfobject)
+            rows = parser.terraform_iter_resources(types=["aws_instance"])
+            envs = [next(rows)['environment'] for _ in range(3)]
+            self.assertEqual(envs, [state_files[0][0]] * 3)
+            self.assertRaises(ValueError, next, rows)
+
+    def test_table_all_types(self):
+        lazy_parser = tfparser.TFParser(self.staging, preload=False)
+        for parser in [self.parser, lazy_parser]:
+            stdout = sys.stdout
+            sys.stdout = io.StringIO()
+            try:
+                parser.terraform_display_environments(
+                    types=["aws_key_pair", "aws_elb"])
+                output = sys.stdout.getvalue()
+            finally:
+                sys.stdout = stdout
+            self.assertEqual(output.count("Environment: env"), 2)
+            self.assertEqual(output.count("Resource: aws_key_pair"), 2)
+            self.assertIn("Resource: aws_elb", output)
+            self.assertNotIn("Resource: aws_instance", output)
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Unit tests for the tfstate cache
+'''
+
+import shutil
+import os
+import unittest
+import json
+import tempfile
+import symphony.tfstate_cache as tfstate_cache
+import testenv
+
+
+# Keep the caches out of HOME.
+setUpModule = testenv.setUpModule
+tearDownModule = testenv.tearDownModule
+
+
+class TFStateCacheUt(unittest.TestCase):
+    '''Test the digested tfstate cache'''
+    def setUp(self):
+        self.staging = tempfile.mkdtemp()
+        shutil.copytree("./testdata/env1", os.path.join(self.staging, "env1"))
+        self.state_file = os.path.join(self.staging, "env1",
+                                       "terraform.tfstate")
+
+    def tearDown(self):
+        shutil.rmtree(self.staging)
+
+    def test_digest_state(self):
+        with open(self.state_file, "r") as tf_fp:
+            state = json.load(tf_fp)
+        digest = tfstate_cache.digest_state(state)
+        module = digest['modules'][0]
+        self.assertEqual(module['outputs']['mysql-testcluster']['value'],
+                         ["10.0.1.20"])
+        resource = module['resources']['aws_elb.spawn_elb']
+        self.assertEqual(sorted(resource.keys()), ['primary', 'type'])
+        self.assertEqual(resource['primary']['attributes'],
+                         state['modules'][0]['resources']
+                         ['aws_elb.spawn_elb']['primary']['attributes'])
+
+    def test_cache_hit_and_invalidate(self):
+        cache = tfstate_cache.TFStateCache(self.staging)
+        first = cache.load(self.state_file)
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+
+        cache = tfstate_cache.TFStateCache(self.staging)
+        self.assertEqual(cache.load(self.state_file), first)
+        self.assertEqual((cache.hits, cache.misses), (1, 0))
+
+        # Rewriting the state changes its fingerprint.
+        with open(self.state_file, "r") as tf_fp:
+            state = json.load(tf_fp)
+        state['modules'][0]['outputs']['mysql-testcluster']['value'] = \
+            ["10.0.1.21"]
+        with open(self.state_file, "w") as tf_fp:
+            json.dump(state, tf_fp)
+        cache = tfstate_cache.TFStateCache(self.staging)
+        second = cache.load(self.state_file)
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+        self.assertEqual(
+            second['modules'][0]['outputs']['mysql-testcluster']['value'],
+            ["10.0.1.21"])
+
+    def test_cache_prune(self):
+        cache = tfstate_cache.TFStateCache(self.staging)
+        cache.load(self.state_file)
+        self.assertEqual(len(os.listdir(cache.cache_dir)), 1)
+        cache.prune([])
+        self.assertEqual(os.listdir(cache.cache_dir), [])
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Unit tests for the streaming tfstate parser
+'''
+
+import shutil
+import os
+import unittest
+import json
+import tempfile
+import symphony.tfstate_cache as tfstate_cache
+import symphony.tfstream as tfstream
+import symphony.tfparser as tfparser
+import testenv
+
+
+# Keep the caches out of HOME.
+setUpModule = testenv.setUpModule
+tearDownModule = testenv.tearDownModule
+
+
+class TFStreamUt(unittest.TestCase):
+    '''Test the streaming tfstate parser'''
+    STATE_FILE = "./testdata/env1/terraform.tfstate"
+
+    def expected_state(self):
+        with open(TFStreamUt.STATE_FILE, "r") as tf_fp:
+            state = tfstate_cache.digest_state(json.load(tf_fp))
+        for module in state['modules']:
+            for resource in module['resources'].values():
+                attributes = resource['primary']['attributes']
+                for key in list(attributes.keys()):
+                    if key not in tfstream.DEFAULT_ATTRIBUTES and \
+                            not key.startswith(tfstream.DEFAULT_PREFIXES):
+                        del attributes[key]
+        return state
+
+    def test_stream_matches_json_load(self):
+        expected = self.expected_state()
+        # Tiny chunks put token boundaries everywhere.
+        for chunk_size in [1, 7, 64, tfstream.CHUNK_SIZE]:
+            state = tfstream.load_state(TFStreamUt.STATE_FILE,
+                                        chunk_size=chunk_size)
+            self.assertEqual(state, expected)
+
+        resource = state['modules'][0]['resources']['aws_key_pair.spawn_keypair']
+        self.assertEqual(sorted(resource['primary']['attributes'].keys()),
+                         ['fingerprint', 'id', 'key_name'])
+
+    def test_stream_values(self):
+        data = {
+            "version": 1,
+            "modules": [{
+                "path": ["root"],
+                "outputs": {"old": "10.0.0.1",
+                            "new": {"type": "list", "value": [1, 2.5, None,
+                                                              True]}},
+                "resources": {
+                    "aws_instance.x": {
+                        "type": "aws_instance",
+                        "primary": {"id": "i-1", "attributes": {
+                            "id": "i-1",
+                            "tags.Name": "quote \" slash \\ \u00e9",
+                            "user_data": "{[,:]}"}}}}}]}
+        statefile = os.path.join(tempfile.mkdtemp(), "terraform.tfstate")
+        with open(statefile, "w") as tf_fp:
+            json.dump(data, tf_fp)
+        state = tfstream.load_state(statefile, chunk_size=3)
+        shutil.rmtree(os.path.dirname(statefile))
+
+        module = state['modules'][0]
+        self.assertEqual(module['path'], ["root"])
+        self.assertEqual(module['outputs']['old']['value'], "10.0.0.1")
+        self.assertEqual(module['outputs']['new']['value'],
+                         [1, 2.5, None, True])
+        self.assertEqual(module['resources']['aws_instance.x'],
+                         {'type': 'aws_instance',
+                          'primary': {'attributes': {
+                              'id': 'i-1',
+                              'tags.Name': 'quote " slash \\ \u00e9'}}})
+
+    def test_stream_types(self):
+        state = tfstream.load_state(TFStreamUt.STATE_FILE,
+                                    types=["aws_instance"])
+        resources = state['modules'][0]['resources']
+        self.assertEqual(len(resources), 3)
+        self.assertEqual(set([resource['type']
+                              for resource in resources.values()]),
+                         set(["aws_instance"]))
+
+    def test_stream_invalid(self):
+        statefile = os.path.join(tempfile.mkdtemp(), "terraform.tfstate")
+        with open(statefile, "w") as tf_fp:
+            tf_fp.write('{"modules": [{"path": ["root"]')
+        self.assertRaises(ValueError, tfstream.load_state, statefile)
+        shutil.rmtree(os.path.dirname(statefile))
+
+    def test_streaming_opt_in(self):
+        # json.load is faster, the states are only streamed on request.
+        saved = os.environ.pop('SYMPHONY_TFSTATE_STREAMING', None)
+        try:
+            self.assertFalse(tfparser.streaming_enabled())
+            os.environ['SYMPHONY_TFSTATE_STREAMING'] = "0"
+            self.assertFalse(tfparser.streaming_enabled())
+            os.environ['SYMPHONY_TFSTATE_STREAMING'] = "1"
+            self.assertTrue(tfparser.streaming_enabled())
+        finally:
+            os.environ.pop('SYMPHONY_TFSTATE_STREAMING', None)
+            if saved is not None:
+                os.environ['SYMPHONY_TFSTATE_STREAMING'] = saved
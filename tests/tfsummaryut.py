@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Unit tests for the resource summaries
+'''
+
+import unittest
+import symphony.tfstream as tfstream
+import symphony.tfparser as tfparser
+import symphony.tfsummary as tfsummary
+import benchmarks.synthetic as synthetic
+
+
+class TFSummaryUt(unittest.TestCase):
+    '''Test the resource summary extractors'''
+    def test_decode_flatmap(self):
+        attributes = {"instances.#": "2", "instances.123": "i-1",
+                      "instances.456": "i-2", "instances_extra": "x",
+                      "tags.%": "1", "tags.Name": "web"}
+        groups = tfsummary.decode_flatmap(attributes, ("instances", "sg"))
+        self.assertEqual(groups['sg'], {})
+        self.assertEqual(sorted(tfsummary.flat_list(groups['instances'])),
+                         ["i-1", "i-2"])
+
+    def test_elb_and_security_group(self):
+        elb = synthetic.generate_elb(1, ["i-1", "i-2"], ["us-east-1b"])
+        summary = tfsummary.summarize_resource(
+            "aws_elb", elb['primary']['attributes'])
+        self.assertEqual(summary, {'name': "elb-1",
+                                   'availability_zones': ["us-east-1b"],
+                                   'instances': ["i-1", "i-2"]})
+
+        group = synthetic.generate_security_group(1, 2)
+        summary = tfsummary.summarize_resource(
+            "aws_security_group", group['primary']['attributes'])
+        self.assertEqual(summary['vpc_id'], "vpc-xxxxxxx1")
+        self.assertEqual(sorted(summary['ingress']),
+                         ["tcp 8000-8000 10.0.0.0/16",
+                          "tcp 8001-8001 10.1.0.0/16"])
+        self.assertEqual(summary['egress'], ["-1 0-0 0.0.0.0/0"])
+
+    def test_registry(self):
+        self.assertEqual(tfsummary.summarize_resource(
+            "aws_key_pair", {'id': "k", 'key_name': "k",
+                             'fingerprint': "aa:bb"}),
+            {'key_name': "k", 'fingerprint': "aa:bb"})
+        self.assertEqual(tfsummary.summarize_resource(
+            "aws_vpc", {'id': "vpc-1", 'name': "main"}), {'name': "main"})
+        self.assertEqual(tfsummary.get_fields("aws_vpc"), ['name'])
+
+        # The streaming parser keeps what the extractors read.
+        self.assertIn('fingerprint', tfstream.DEFAULT_ATTRIBUTES)
+        self.assertIn('ingress.', tfstream.DEFAULT_PREFIXES)
+
+        @tfsummary.extractor("test_resource", ['size'], attributes=['size'])
+        def summarize_test(attributes, groups):
+            return {'size': int(attributes['size'])}
+        self.addCleanup(tfsummary.EXTRACTORS.pop, "test_resource")
+        self.assertEqual(tfsummary.summarize_resource(
+            "test_resource", {'size': "3"}), {'size': 3})
+        self.assertIn('size', tfparser.get_columns())
@@ -9,9 +9,21 @@ import shutil
 import os
 import unittest
 import sys
+import time
+import tempfile
+import io
+import threading
 import symphony.command as command
 import symphony.terraform as terraform
 import symphony.renderer as renderer
+import symphony.multi_deploy as multi_deploy
+import symphony.helper as helper
+import testenv
+
+
+# Keep the caches out of HOME.
+setUpModule = testenv.setUpModule
+tearDownModule = testenv.tearDownModule
 
 
 class TfUt(unittest.TestCase):
@@ -138,6 +150,456 @@ class TfUt(unittest.TestCase):
                          msg="Expected did not match actual")
 
 
+class PluginCacheUt(unittest.TestCase):
+    '''Test the shared provider plugin cache and the init skip'''
+    NUM_STAGING = 6
+    PROVIDER_TF = '''
+provider "aws" {
+  region = "us-west-2"
+}
+
+provider "null" {}
+'''
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.registry = os.path.join(self.root, "registry")
+        self.mirror = os.path.join(self.root, "mirror")
+        self.cache = os.path.join(self.root, "plugin-cache")
+        for plugin_dir in [self.registry, self.mirror]:
+            os.makedirs(plugin_dir)
+            for provider in ["aws", "null"]:
+                binary = os.path.join(plugin_dir,
+                                      "terraform-provider-%s" % provider)
+                with open(binary, "wb") as bin_fp:
+                    bin_fp.write(b"\0" * (1 << 20))
+
+        self.staging_dirs = []
+        for idx in range(PluginCacheUt.NUM_STAGING):
+            staging_dir = os.path.join(self.root, "app%d_dev" % idx)
+            os.makedirs(staging_dir)
+            with open(os.path.join(staging_dir, "provider.tf"), "w") as tf_fp:
+                tf_fp.write(PluginCacheUt.PROVIDER_TF)
+            with open(os.path.join(staging_dir, "main.tf"), "w") as tf_fp:
+                tf_fp.write('resource "null_resource" "x" {}\n')
+            self.staging_dirs.append(staging_dir)
+
+        self.saved_env = dict(os.environ)
+        os.environ['PATH'] = os.path.abspath("./testdata/bin") + \
+            os.pathsep + os.environ['PATH']
+        os.environ['FAKE_TF_REGISTRY'] = self.registry
+        os.environ['FAKE_TF_DOWNLOAD_SLEEP'] = "0.1"
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.saved_env)
+        shutil.rmtree(self.root)
+
+    def disk_usage(self):
+        '''Bytes used by the plugins, symlinks not followed'''
+        total = 0
+        for dirpath, _, files in os.walk(self.root):
+            if ".terraform" not in dirpath and \
+                    not dirpath.startswith(self.cache):
+                continue
+            for name in files:
+                fstat = os.lstat(os.path.join(dirpath, name))
+                if not os.path.islink(os.path.join(dirpath, name)):
+                    total += fstat.st_size
+        return total
+
+    def init_all(self, **kwargs):
+        tfobj = terraform.Terraform(self.root)
+        start = time.time()
+        for staging_dir in self.staging_dirs:
+            ret, stdout, _ = tfobj.terraform_init(staging_dir, **kwargs)
+            self.assertEqual(ret, 0)
+        return time.time() - start, stdout
+
+    def reset(self):
+        for staging_dir in self.staging_dirs:
+            shutil.rmtree(os.path.join(staging_dir, ".terraform"))
+            shutil.rmtree(os.path.join(staging_dir, ".symphony"))
+
+    def init_count(self, staging_dir):
+        with open(os.path.join(staging_dir, ".fake_terraform.log")) as log_fp:
+            return log_fp.read().split().count("init")
+
+    def test_plugin_cache(self):
+        nocache_time, _ = self.init_all(plugin_cache_dir=False)
+        nocache_disk = self.disk_usage()
+        self.reset()
+
+        cache_time, _ = self.init_all(plugin_cache_dir=self.cache)
+        cache_disk = self.disk_usage()
+        print("init: %.2fs %dMB without cache, %.2fs %dMB with cache" %
+              (nocache_time, nocache_disk >> 20, cache_time, cache_disk >> 20))
+        self.assertEqual(nocache_disk, PluginCacheUt.NUM_STAGING * 2 << 20)
+        self.assertEqual(cache_disk, 2 << 20)
+        self.assertLess(cache_time, nocache_time)
+        self.assertTrue(os.path.islink(os.path.join(
+            self.staging_dirs[0], ".terraform", "plugins",
+            "terraform-provider-aws")))
+
+        # Nothing changed, init is skipped everywhere.
+        _, stdout = self.init_all(plugin_cache_dir=self.cache)
+        self.assertIn("skipped", stdout)
+        self.assertEqual(self.init_count(self.staging_dirs[0]), 2)
+
+        # A resource change does not need an init, a provider change does.
+        staging_dir = self.staging_dirs[0]
+        with open(os.path.join(staging_dir, "main.tf"), "a") as tf_fp:
+            tf_fp.write('resource "null_resource" "y" {}\n')
+        self.init_all(plugin_cache_dir=self.cache)
+        self.assertEqual(self.init_count(staging_dir), 2)
+        with open(os.path.join(staging_dir, "provider.tf"), "w") as tf_fp:
+            tf_fp.write(PluginCacheUt.PROVIDER_TF.replace("us-west-2",
+                                                          "us-east-1"))
+        self.init_all(plugin_cache_dir=self.cache)
+        self.assertEqual(self.init_count(staging_dir), 3)
+        self.assertEqual(self.init_count(self.staging_dirs[1]), 2)
+
+    def test_init_type_provider(self):
+        # A resource of a provider without a provider block needs an init.
+        tfobj = terraform.Terraform(self.root)
+        staging_dir = self.staging_dirs[0]
+        for resource in [None, 'null_resource" "y', 'tls_private_key" "k']:
+            if resource is not None:
+                with open(os.path.join(staging_dir, "main.tf"),
+                          "a") as tf_fp:
+                    tf_fp.write('resource "%s" {}\n' % resource)
+            ret, _, _ = tfobj.terraform_init(staging_dir,
+                                             plugin_cache_dir=self.cache)
+            self.assertEqual(ret, 0)
+        self.assertEqual(self.init_count(staging_dir), 2)
+
+    def test_init_writes_lock_file(self):
+        # init writes .terraform.lock.hcl, the second init is skipped.
+        tfobj = terraform.Terraform(self.root)
+        staging_dir = self.staging_dirs[0]
+        for _ in range(2):
+            ret, _, _ = tfobj.terraform_init(staging_dir,
+                                             plugin_cache_dir=self.cache)
+            self.assertEqual(ret, 0)
+        self.assertTrue(os.path.exists(os.path.join(staging_dir,
+                                                    terraform.LOCK_FILE)))
+        self.assertEqual(self.init_count(staging_dir), 1)
+
+    def test_concurrent_init(self):
+        # The fake terraform fails an init that overlaps another one in
+        # the same plugin cache.
+        tfobj = terraform.Terraform(self.root)
+        results = {}
+
+        def init(staging_dir):
+            results[staging_dir] = tfobj.terraform_init(
+                staging_dir, plugin_cache_dir=self.cache)[0]
+
+        threads = [threading.Thread(target=init, args=(staging_dir,))
+                   for staging_dir in self.staging_dirs]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(list(results.values()),
+                         [0] * PluginCacheUt.NUM_STAGING)
+
+    def test_concurrent_init_warm_cache(self):
+        # Once the cache has the providers, the inits run together.
+        tfobj = terraform.Terraform(self.root)
+        ret, _, _ = tfobj.terraform_init(self.staging_dirs[0],
+                                         plugin_cache_dir=self.cache)
+        self.assertEqual(ret, 0)
+        os.environ['FAKE_TF_SLEEP'] = "0.5"
+        results = {}
+
+        def init(staging_dir):
+            results[staging_dir] = tfobj.terraform_init(
+                staging_dir, plugin_cache_dir=self.cache, force=True)[0]
+
+        threads = [threading.Thread(target=init, args=(staging_dir,))
+                   for staging_dir in self.staging_dirs]
+        start = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - start
+        self.assertEqual(list(results.values()),
+                         [0] * PluginCacheUt.NUM_STAGING)
+        self.assertLess(elapsed, 0.5 * PluginCacheUt.NUM_STAGING / 2)
+
+    def test_needs_cache_fill(self):
+        staging_dir = self.staging_dirs[0]
+        plugin_dir = os.path.join(self.cache, "registry.terraform.io",
+                                  "hashicorp", "aws", "4.0.0", "linux_amd64")
+        os.makedirs(plugin_dir)
+        self.assertTrue(terraform.needs_cache_fill(staging_dir, self.cache))
+        for binary in ["terraform-provider-aws_v4.0.0_x5",
+                       "terraform-provider-null"]:
+            open(os.path.join(plugin_dir, binary), "w").close()
+        self.assertFalse(terraform.needs_cache_fill(staging_dir, self.cache))
+
+        # A resource of another provider, or another version pinned in the
+        # lock file, is not in the cache.
+        with open(os.path.join(staging_dir, "main.tf"), "a") as tf_fp:
+            tf_fp.write('resource "tls_private_key" "k" {}\n')
+        self.assertTrue(terraform.needs_cache_fill(staging_dir, self.cache))
+        open(os.path.join(plugin_dir, "terraform-provider-tls_v3.1.0"),
+             "w").close()
+        self.assertFalse(terraform.needs_cache_fill(staging_dir, self.cache))
+        with open(os.path.join(staging_dir, terraform.LOCK_FILE),
+                  "w") as lock_fp:
+            lock_fp.write('provider "registry.terraform.io/hashicorp/tls" {\n'
+                          '  version = "3.4.0"\n'
+                          '  hashes = ["h1:x"]\n}\n')
+        self.assertTrue(terraform.needs_cache_fill(staging_dir, self.cache))
+
+    def test_plugin_mirror(self):
+        os.environ['SYMPHONY_PLUGIN_CACHE_DIR'] = self.cache
+        del os.environ['FAKE_TF_REGISTRY']
+        tfobj = terraform.Terraform(self.root)
+        ret, _, stderr = tfobj.terraform_init(self.staging_dirs[0])
+        self.assertEqual(ret, 1)
+        self.assertIn("not found", stderr)
+
+        ret, stdout, _ = tfobj.terraform_init(self.staging_dirs[0],
+                                              plugin_mirror=self.mirror)
+        self.assertEqual(ret, 0)
+        self.assertIn("-plugin-dir=%s" % self.mirror, stdout)
+        self.assertTrue(os.path.exists(os.path.join(
+            self.cache, "terraform-provider-null")))
+
+        # Init from the registry, after the mirror, is not skipped.
+        os.environ['FAKE_TF_REGISTRY'] = self.registry
+        ret, stdout, _ = tfobj.terraform_init(self.staging_dirs[0])
+        self.assertEqual(ret, 0)
+        self.assertNotIn("skipped", stdout)
+
+    def test_extract_init_blocks(self):
+        text = PluginCacheUt.PROVIDER_TF + '''
+module "vpc" {
+  source = "./vpc"
+  tags = { Name = "${var.name}" }
+}
+resource "aws_instance" "x" {
+  ami = "ami-1"
+}
+'''
+        blocks = terraform.extract_init_blocks(text)
+        self.assertEqual(len(blocks), 3)
+        self.assertTrue(blocks[0].startswith('provider "aws" {'))
+        self.assertTrue(blocks[2].endswith('"${var.name}" }\n}'))
+
+
+class PlanWorkflowUt(unittest.TestCase):
+    '''Test the saved plan workflow'''
+    def setUp(self):
+        self.staging = tempfile.mkdtemp()
+        with open(os.path.join(self.staging, "main.tf"), "w") as tf_fp:
+            tf_fp.write('resource "null_resource" "x" {}\n')
+        self.plan_file = os.path.join(self.staging, terraform.PLAN_FILE)
+        self.saved_path = os.environ['PATH']
+        os.environ['PATH'] = os.path.abspath("./testdata/bin") + \
+            os.pathsep + self.saved_path
+
+    def tearDown(self):
+        os.environ['PATH'] = self.saved_path
+        shutil.rmtree(self.staging)
+
+    def operations(self):
+        with open(os.path.join(self.staging, ".fake_terraform.log")) as log_fp:
+            return log_fp.read().split()
+
+    def plan(self, tfobj):
+        ret, stdout, _ = tfobj.terraform_plan(self.staging,
+                                              plan_file=terraform.PLAN_FILE)
+        self.assertEqual(ret, 0)
+        return stdout
+
+    def test_generate_command(self):
+        tfobj = terraform.Terraform(self.staging)
+        self.assertEqual(
+            tfobj.generate_terraform_command("plan", var_file="x.tfvars",
+                                             plan_file="p.tfplan"),
+            ["terraform", "plan", "-var-file=x.tfvars", "-out=p.tfplan"])
+        self.assertEqual(
+            tfobj.generate_terraform_command("apply", var_file="x.tfvars",
+                                             plan_file="p.tfplan"),
+            ["terraform", "apply", "-auto-approve", "p.tfplan"])
+
+    def test_plan_apply(self):
+        tfobj = terraform.Terraform(self.staging)
+        self.plan(tfobj)
+        self.assertTrue(os.path.exists(self.plan_file))
+
+        # The state may have changed, in a remote backend too, every
+        # deploy plans again.
+        self.plan(tfobj)
+        self.assertEqual(self.operations(), ["plan", "plan"])
+
+        ret, stdout, _ = tfobj.terraform_apply(self.staging,
+                                               plan_file=terraform.PLAN_FILE)
+        self.assertEqual(ret, 0)
+        self.assertIn("args: apply -auto-approve %s" % terraform.PLAN_FILE,
+                      stdout)
+        self.assertFalse(os.path.exists(self.plan_file))
+
+        # Applying a missing plan fails.
+        ret, _, stderr = tfobj.terraform_apply(self.staging,
+                                               plan_file=terraform.PLAN_FILE)
+        self.assertEqual(ret, 1)
+        self.assertIn("not found", stderr)
+
+    def deploy(self, answer, **operobj):
+        saved_stdin = sys.stdin
+        sys.stdin = io.StringIO(answer)
+        try:
+            helperobj = helper.Helper(dict(operobj, operation="deploy",
+                                           staging=self.staging))
+            return helperobj.deploy_terraform_environment(self.staging)
+        finally:
+            sys.stdin = saved_stdin
+
+    def test_deploy_confirm(self):
+        # The plan is applied once confirmed with yes.
+        self.assertEqual(self.deploy("no\n"), 1)
+        self.assertEqual(self.operations(), ["plan"])
+        self.assertFalse(os.path.exists(self.plan_file))
+        self.assertEqual(self.deploy(""), 1)
+        self.assertEqual(self.operations(), ["plan", "plan"])
+
+        self.assertEqual(self.deploy("yes\n"), 0)
+        self.assertEqual(self.deploy("", auto_approve=True), 0)
+        self.assertEqual(self.operations(),
+                         ["plan", "plan", "plan", "apply", "plan", "apply"])
+
+    def test_deploy_all_needs_auto_approve(self):
+        helperobj = helper.Helper({'operation': "deploy", 'all': True,
+                                   'staging': self.staging})
+        self.assertEqual(helperobj.deploy_all_environments(self.staging), 1)
+        self.assertFalse(os.path.exists(os.path.join(
+            self.staging, ".fake_terraform.log")))
+
+
+class TargetedApplyUt(unittest.TestCase):
+    '''Test the targeted apply of changed cluster files'''
+    COMMON_TF = '''
+provider "aws" {
+    region = "us-east-1"
+}
+
+resource "aws_key_pair" "spawn_keypair" {
+    key_name = "app-key"
+}
+'''
+    CLUSTER_TF = '''
+#--------------------------------------
+# AWS Instance.
+
+resource "aws_instance" "spawn_instance_%(name)s" {
+    count = "%(count)d"
+    user_data = "${file("./scripts/%(name)s.sh")}"
+    tags = {
+        Name = "%(name)s"
+    }
+}
+
+output "%(name)s" {
+    value = ["${aws_instance.spawn_instance_%(name)s.*.private_ip}"]
+}
+'''
+
+    def setUp(self):
+        self.staging = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.staging, "scripts"))
+        self.write("common.tf", TargetedApplyUt.COMMON_TF)
+        for name in ["rabbitmq", "mysql"]:
+            self.write_cluster(name, 1)
+            self.write(os.path.join("scripts", name + ".sh"), "#!/bin/bash\n")
+        self.saved_path = os.environ['PATH']
+        os.environ['PATH'] = os.path.abspath("./testdata/bin") + \
+            os.pathsep + self.saved_path
+
+    def tearDown(self):
+        os.environ['PATH'] = self.saved_path
+        shutil.rmtree(self.staging)
+
+    def write(self, filename, data, mode="w"):
+        with open(os.path.join(self.staging, filename), mode) as tf_fp:
+            tf_fp.write(data)
+
+    def write_cluster(self, name, count):
+        self.write(name + ".tf", TargetedApplyUt.CLUSTER_TF %
+                   {'name': name, 'count': count})
+
+    def test_describe_tf_file(self):
+        addresses, targetable = terraform.describe_tf_file(
+            TargetedApplyUt.CLUSTER_TF % {'name': "x", 'count': 1} +
+            'data "aws_ami" "centos" {}\nmodule "vpc" {}\n')
+        self.assertEqual(addresses, ["aws_instance.spawn_instance_x",
+                                     "data.aws_ami.centos", "module.vpc"])
+        self.assertTrue(targetable)
+
+        addresses, targetable = terraform.describe_tf_file(
+            TargetedApplyUt.COMMON_TF)
+        self.assertEqual(addresses, ["aws_key_pair.spawn_keypair"])
+        self.assertFalse(targetable)
+
+    def test_find_changed_targets(self):
+        # Never applied, nothing to compare with.
+        self.assertEqual(terraform.find_changed_targets(self.staging), None)
+        terraform.record_applied(self.staging)
+        self.assertEqual(terraform.find_changed_targets(self.staging), None)
+
+        self.write_cluster("rabbitmq", 3)
+        self.assertEqual(terraform.find_changed_targets(self.staging),
+                         ["aws_instance.spawn_instance_rabbitmq"])
+
+        # An init script change, a new cluster and a removed cluster.
+        self.write(os.path.join("scripts", "mysql.sh"), "echo hi\n", "a")
+        self.write_cluster("consul", 3)
+        os.remove(os.path.join(self.staging, "rabbitmq.tf"))
+        self.assertEqual(terraform.find_changed_targets(self.staging),
+                         ["aws_instance.spawn_instance_consul",
+                          "aws_instance.spawn_instance_mysql",
+                          "aws_instance.spawn_instance_rabbitmq"])
+
+        # A provider change needs a full apply.
+        self.write("common.tf", TargetedApplyUt.COMMON_TF.replace(
+            "us-east-1", "us-west-2"))
+        self.assertEqual(terraform.find_changed_targets(self.staging), None)
+
+    def test_targeted_deploy(self):
+        mirror = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, mirror)
+        open(os.path.join(mirror, "terraform-provider-aws"), "w").close()
+        init_options = {'plugin_mirror': mirror, 'plugin_cache_dir': False}
+
+        def deploy():
+            stream = io.StringIO()
+            deployer = multi_deploy.MultiDeploy(os.path.dirname(self.staging),
+                                                targeted=True, stream=stream,
+                                                init_options=init_options)
+            env_name = os.path.basename(self.staging)
+            self.assertEqual(deployer.deploy_environment(env_name), 0)
+            return [line for line in stream.getvalue().splitlines()
+                    if "args: plan" in line][0]
+
+        # The first deploy applies everything.
+        self.assertNotIn("-target", deploy())
+
+        self.write_cluster("mysql", 2)
+        self.assertIn("plan -target=aws_instance.spawn_instance_mysql "
+                      "-out=%s" % terraform.PLAN_FILE, deploy())
+
+        self.assertNotIn("-target", deploy())
+
+        tfobj = terraform.Terraform(self.staging)
+        self.assertEqual(
+            tfobj.generate_terraform_command("apply", targets=["a.b"]),
+            ["terraform", "apply", "-auto-approve", "-target=a.b"])
+
 
 class CommandUt(unittest.TestCase):
     '''Test Command class'''
@@ -186,3 +648,51 @@ class CommandUt(unittest.TestCase):
 
 
 
+
+    def test_command_execute_async(self):
+        '''Async executor with sinks and a bounded tail'''
+        cmdobj = command.Command()
+        logdir = tempfile.mkdtemp()
+        logfile = os.path.join(logdir, "logs", "cmd.log")
+        ring = command.RingBufferSink(maxlines=5)
+        console = io.StringIO()
+        script = "for i in $(seq 1 1000); do echo out$i; done; " \
+            "echo err1 >&2; echo err2 >&2; exit 3"
+        ret, out, err = cmdobj.execute_async(
+            ["sh", "-c", script],
+            tail_lines=10,
+            sinks=[command.LogFileSink(logfile), ring,
+                   command.ConsoleSink(prefix="[t] ", stream=console)])
+        self.assertEqual(ret, 3)
+        self.assertEqual(out.split(), ["out%d" % i for i in range(991, 1001)])
+        self.assertEqual(err, "err1\nerr2\n")
+        self.assertEqual(len(ring.text().split()), 5)
+        with open(logfile) as log_fp:
+            self.assertEqual(len(log_fp.readlines()), 1002)
+        self.assertIn("[t] out1\n", console.getvalue())
+        shutil.rmtree(logdir)
+
+        # A line without a newline, longer than the read chunks.
+        ret, out, _ = cmdobj.execute_async(
+            ["python", "-c", "import sys; sys.stdout.write('x' * 200000)"])
+        self.assertEqual((ret, len(out)), (0, 200000))
+
+        ret, _, _ = cmdobj.execute_async(["foobar"])
+        self.assertEqual(ret, 2)
+
+    def test_command_execute_many(self):
+        '''Several commands from one event loop'''
+        cmdobj = command.Command()
+        commands = [{'cmd': ["sh", "-c", "sleep 0.3; echo %d" % idx]}
+                    for idx in range(4)]
+        commands.append({'cmd': ["sh", "-c", "pwd; exit 255"], 'cwd': "/tmp"})
+        start = time.time()
+        results = cmdobj.execute_many(commands)
+        self.assertLess(time.time() - start, 1.0)
+        self.assertEqual([result[1] for result in results[:4]],
+                         ["0\n", "1\n", "2\n", "3\n"])
+        self.assertEqual(results[4][:2], (255, "/tmp\n"))
+
+        start = time.time()
+        results = cmdobj.execute_many(commands[:4], concurrency=2)
+        self.assertGreater(time.time() - start, 0.55)
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Unit tests for the phase timings
+'''
+
+import shutil
+import unittest
+import json
+import time
+import tempfile
+import symphony.scheduler as scheduler
+import utils.symphony_timer as symphony_timer
+
+
+class TimerUt(unittest.TestCase):
+    '''Test the phase timings'''
+    def test_disabled(self):
+        timer = symphony_timer.Timer()
+        with timer.span("build") as span:
+            span.set(hosts=2)
+        self.assertIs(span, symphony_timer.NULL_SPAN)
+        self.assertEqual(timer.roots, [])
+
+        timer.enable()
+        with timer.span("probe", hosts=2) as span:
+            span.set(saved_ms=12.5)
+        self.assertEqual(span.label(), "probe [hosts=2, saved_ms=12.5]")
+
+    def test_span_tree(self):
+        timer = symphony_timer.Timer(enabled=True)
+        with timer.span("build"):
+            with timer.span("normalize"):
+                time.sleep(0.05)
+            with timer.span("build_clusters", jobs=2):
+                dag = scheduler.DagScheduler(max_workers=2)
+                for name in ["web", "db"]:
+                    dag.add_job(name, lambda name: timer.span(
+                        "cluster", cluster=name).__enter__().__exit__(
+                            None, None, None), args=(name,))
+                dag.run()
+            with self.assertRaises(ValueError):
+                with timer.span("render"):
+                    raise ValueError("bad template")
+
+        self.assertEqual(len(timer.roots), 1)
+        build = timer.roots[0]
+        self.assertEqual([child.name for child in build.children],
+                         ["normalize", "build_clusters", "render"])
+        self.assertGreaterEqual(build.children[0].duration, 0.05)
+        clusters = build.children[1].children
+        self.assertEqual(sorted([child.attrs['cluster'] for child in clusters]),
+                         ["db", "web"])
+        self.assertEqual(build.children[2].attrs, {'error': "ValueError"})
+
+        lines = timer.format_tree()
+        self.assertTrue(lines[2].startswith("build "))
+        self.assertTrue(lines[4].startswith("  build_clusters [jobs=2]"))
+        self.assertTrue(lines[-1].startswith("Total"))
+
+        staging = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, staging)
+        report_file = symphony_timer.get_report_file(staging, "build")
+        timer.write_report(report_file, operation="build")
+        with open(report_file) as report_fp:
+            report = json.load(report_fp)
+        self.assertEqual(report['operation'], "build")
+        self.assertEqual(report['spans'][0]['children'][0]['name'],
+                         "normalize")
+        self.assertAlmostEqual(report['total'], build.duration)
@@ -30,7 +30,7 @@ class ConsulAPI(object):
         try:
             members = self.client.agent.members()
         except requests.ConnectionError:
-            print "Connection Error: "
+            print("Connection Error: ")
             return (255, None)
 
         return (0, members)
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Lazy Imports:
+-------------
+A module that is imported on first use, so a CLI operation only pays for
+the modules it uses:
+
+    import utils.lazy_import as lazy_import
+    renderer = lazy_import.LazyModule("symphony.renderer")
+
+    renderer.get_template_engine(...)   # imports symphony.renderer
+
+The import happens under a lock, so the first use may come from any
+thread.
+'''
+
+import sys
+import threading
+
+
+class LazyModule(object):
+    '''
+    Stand-in for a module, imported on the first attribute access.
+    '''
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+        self.__dict__['_lock'] = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._module is None:
+                # __import__ rather than importlib.import_module, so the
+                # import shows in python -X importtime.
+                __import__(self._name)
+                self.__dict__['_module'] = sys.modules[self._name]
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return "<lazy module '%s' (%s)>" % (self._name, state)
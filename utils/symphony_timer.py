@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Timing Facility:
+----------------
+Nested spans, to see where the time of an operation goes.
+
+    import utils.symphony_timer as symphony_timer
+
+    with symphony_timer.span("render", cluster="web"):
+        ...
+
+Spans opened inside a span become its children. Each thread has its own
+stack of open spans; a span opened by a worker thread with no open span
+of its own becomes a child of the span open in the thread that enabled
+the timer, so the work of a thread pool shows up under the span that
+started it.
+
+The timer is disabled by default, and span() then returns a shared no-op
+context manager, so the instrumented code costs next to nothing unless
+timings were asked for (symphony <operation> --timings).
+'''
+
+import os
+import json
+import time
+import socket
+import threading
+import timeit
+
+
+TIMINGS_DIR = "timings"
+
+
+class Span(object):
+    '''
+    A timed section of the run.
+    '''
+    def __init__(self, timer, name, attrs):
+        self.timer = timer
+        self.name = name
+        self.attrs = attrs
+        self.thread = threading.current_thread().name
+        self.children = []
+        self.start = None
+        self.started = None
+        self.duration = None
+
+    def __enter__(self):
+        self.timer.push(self)
+        self.started = time.time()
+        self.start = timeit.default_timer()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.duration = timeit.default_timer() - self.start
+        if exc_type is not None:
+            self.attrs['error'] = exc_type.__name__
+        self.timer.pop(self)
+        return False
+
+    def set(self, **attrs):
+        '''
+        Add attributes measured while the span runs.
+        '''
+        self.attrs.update(attrs)
+
+    def label(self):
+        if not self.attrs:
+            return self.name
+        return "%s [%s]" % (self.name,
+                            ", ".join(["%s=%s" % (key, self.attrs[key])
+                                       for key in sorted(self.attrs)]))
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'attrs': self.attrs,
+            'thread': self.thread,
+            'started': self.started,
+            'duration': self.duration,
+            'children': [child.to_dict() for child in self.children]
+        }
+
+
+class NullSpan(object):
+    '''
+    The span returned while the timer is disabled.
+    '''
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class Timer(object):
+    '''
+    Collects the spans of a run, as a tree.
+    '''
+    def __init__(self, enabled=False):
+        self.enabled = False
+        self.roots = []
+        self.stacks = {}
+        self.main_thread = None
+        self.lock = threading.Lock()
+        if enabled:
+            self.enable()
+
+    def enable(self):
+        self.enabled = True
+        self.main_thread = threading.current_thread().ident
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self.lock:
+            self.roots = []
+            self.stacks = {}
+
+    def span(self, name, **attrs):
+        '''
+        Return a context manager timing the enclosed block.
+        '''
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, attrs)
+
+    def push(self, span):
+        thread_id = threading.current_thread().ident
+        with self.lock:
+            stack = self.stacks.setdefault(thread_id, [])
+            if stack:
+                parent = stack[-1]
+            else:
+                main_stack = self.stacks.get(self.main_thread)
+                parent = main_stack[-1] if main_stack else None
+
+            if parent is None:
+                self.roots.append(span)
+            else:
+                parent.children.append(span)
+            stack.append(span)
+
+    def pop(self, span):
+        thread_id = threading.current_thread().ident
+        with self.lock:
+            stack = self.stacks.get(thread_id, [])
+            if span in stack:
+                del stack[stack.index(span):]
+
+    def total(self):
+        return sum([root.duration or 0.0 for root in self.roots])
+
+    def format_tree(self):
+        '''
+        Return the span tree as printable lines, with the duration of each
+        span and its share of the total.
+        '''
+        total = self.total()
+        lines = []
+        lines.append("%-60s %10s %7s" % ("Phase", "Time", "%"))
+        lines.append("-" * 79)
+
+        def add_lines(span, depth):
+            duration = span.duration
+            if duration is None:
+                timing = "%10s %7s" % ("running", "")
+            else:
+                share = 100.0 * duration / total if total else 0.0
+                timing = "%9.3fs %6.1f%%" % (duration, share)
+            lines.append("%-60s %s" % ("  " * depth + span.label(), timing))
+            for child in span.children:
+                add_lines(child, depth + 1)
+
+        for root in self.roots:
+            add_lines(root, 0)
+        lines.append("-" * 79)
+        lines.append("%-60s %9.3fs" % ("Total", total))
+
+        return lines
+
+    def report(self, **metadata):
+        '''
+        Return the spans as a JSON serializable dictionary. The metadata,
+        like the operation, is added to the report.
+        '''
+        report = {
+            'host': socket.gethostname(),
+            'created': time.time(),
+            'total': self.total(),
+            'spans': [root.to_dict() for root in self.roots]
+        }
+        report.update(metadata)
+        return report
+
+    def write_report(self, report_file, **metadata):
+        report_dir = os.path.dirname(report_file)
+        if report_dir and not os.path.exists(report_dir):
+            os.makedirs(report_dir)
+        with open(report_file, "w") as report_fp:
+            json.dump(self.report(**metadata), report_fp, indent=2)
+
+
+TIMER = Timer()
+
+
+def get_timer():
+    return TIMER
+
+
+def enable():
+    TIMER.enable()
+
+
+def span(name, **attrs):
+    '''
+    Time a block with the process wide timer.
+    '''
+    return TIMER.span(name, **attrs)
+
+
+def get_report_file(staging_dir, operation):
+    '''
+    Return a new report file for an operation, under
+    <staging>/.symphony/timings, named by the operation and the time of the
+    run, so the reports of past runs are kept to compare against.
+    '''
+    return os.path.join(staging_dir, ".symphony", TIMINGS_DIR,
+                        "%s-%s.json" % (operation,
+                                        time.strftime("%Y%m%d-%H%M%S")))